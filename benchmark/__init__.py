@@ -0,0 +1 @@
+# Reproducible benchmarks of the DAO hot paths, run with python -m benchmark
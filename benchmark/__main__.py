@@ -0,0 +1,80 @@
+# python -m benchmark --size 1m --output results.json
+# python -m benchmark --size 1m --compare baseline.json --threshold 0.15
+
+import argparse
+import json
+import sys
+from .cases import CASES
+from .datasets import SIZES
+from .runner import compare, format_comparison, log_stderr, run_suite
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmark",
+        description="Benchmark the sqlitedao hot paths on synthetic datasets.",
+    )
+    parser.add_argument("--size", choices=sorted(SIZES), default="10k")
+    parser.add_argument("--rows", type=int, help="exact dataset size, overrides --size")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cases", help="comma separated case names, default all")
+    parser.add_argument("--list", action="store_true", help="list the cases and exit")
+    parser.add_argument(
+        "--db-dir", help="keep the databases here and reuse them across runs"
+    )
+    parser.add_argument("--profile", help="PRAGMA profile for the connection")
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="multiply the samples per case"
+    )
+    parser.add_argument("--output", help="write the JSON report here, - for stdout")
+    parser.add_argument("--compare", help="baseline JSON report to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="p50 slowdown counted as a regression, as a fraction",
+    )
+    return parser
+
+
+# Returns the exit status, 1 when --compare found a regression
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    if args.list:
+        for case in CASES:
+            print("{:<24} {}".format(case.name, case.dataset))
+        return 0
+    rows = args.rows if args.rows is not None else SIZES[args.size]
+    cases = args.cases.split(",") if args.cases else None
+    report = run_suite(
+        rows,
+        seed=args.seed,
+        cases=cases,
+        db_dir=args.db_dir,
+        profile=args.profile,
+        scale=args.scale,
+        log=log_stderr,
+    )
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if not args.compare:
+        return 0
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    if baseline["meta"]["rows"] != rows:
+        log_stderr(
+            "warning: baseline ran on {} rows, this run on {}".format(
+                baseline["meta"]["rows"], rows
+            )
+        )
+    comparison = compare(report, baseline, args.threshold)
+    log_stderr(format_comparison(comparison))
+    return int(any(row["status"] == "regressed" for row in comparison))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+# Benchmark cases over the DAO hot paths.
+#
+# A case's setup(dao, rows, rng) prepares its inputs and returns (op,
+# teardown): op(sample) runs one timed operation and returns the number of
+# rows it handled, teardown (or None) undoes what the ops wrote so every
+# case sees the same dataset.
+
+from collections import namedtuple
+from sqlitedao import SearchDict
+from .datasets import (
+    POSITIONS,
+    REGIONS,
+    Country,
+    Player,
+    country_name,
+    generate_countries,
+    generate_players,
+    player_name,
+)
+
+Case = namedtuple("Case", ["name", "dataset", "samples", "setup"])
+# Rows per op for the batched cases
+BATCH_SIZE = 1000
+LOOKUP_BATCH_SIZE = 100
+PAGE_SIZE = 50
+# Players the update cases pick from, their ages are restored afterwards
+UPDATE_POOL_SIZE = 20000
+
+
+def delete_from(dao, table_name, first_key):
+    return lambda: dao.delete_rows(
+        table_name, SearchDict().add_filter("name", first_key, ">=")
+    )
+
+
+# Reads the ages of the named players, the returned teardown writes them back
+def restore_ages(dao, names):
+    columns = dao.search_columns(
+        "players",
+        SearchDict().add_in("name", list(names)),
+        columns=["name", "age"],
+        use_numpy=False,
+    )
+    return lambda: dao.update_many(
+        "players",
+        [{"age": age} for age in columns["age"]],
+        [{"name": name} for name in columns["name"]],
+        method="temp_table",
+    )
+
+
+def insert_item(dao, rows, rng):
+    players = generate_players(rows, rows + 10000000, rng)
+
+    def op(sample):
+        dao.insert_item(Player(next(players)))
+        return 1
+
+    return op, delete_from(dao, "players", player_name(rows))
+
+
+def insert_rows(dao, rows, rng):
+    def op(sample):
+        start = rows + sample * BATCH_SIZE
+        return dao.insert_rows(
+            "players", generate_players(start, start + BATCH_SIZE, rng)
+        )["inserted"]
+
+    return op, delete_from(dao, "players", player_name(rows))
+
+
+def update_item(dao, rows, rng):
+    players = dao.find_items(
+        [Player(name=player_name(rng.randrange(rows))) for _ in range(BATCH_SIZE)]
+    )
+
+    def op(sample):
+        player = players[sample % len(players)]
+        player.get_row_tuple()["age"] += 1
+        return int(dao.update_item(player))
+
+    return op, restore_ages(dao, set(p.get_row_tuple()["name"] for p in players))
+
+
+def update_many(method):
+    def setup(dao, rows, rng):
+        pool = [
+            player_name(number)
+            for number in rng.sample(range(rows), min(rows, UPDATE_POOL_SIZE))
+        ]
+
+        def op(sample):
+            search_dicts = [{"name": rng.choice(pool)} for _ in range(BATCH_SIZE)]
+            update_dicts = [{"age": rng.randint(19, 42)} for _ in search_dicts]
+            return dao.update_many(
+                "players", update_dicts, search_dicts, method=method
+            )["affected"]
+
+        return op, restore_ages(dao, pool)
+
+    return setup
+
+
+def find_item(dao, rows, rng):
+    def op(sample):
+        return int(
+            dao.find_item(Player(name=player_name(rng.randrange(rows)))) is not None
+        )
+
+    return op, None
+
+
+def find_items(dao, rows, rng):
+    def op(sample):
+        players = [
+            Player(name=player_name(rng.randrange(rows)))
+            for _ in range(LOOKUP_BATCH_SIZE)
+        ]
+        return sum(item is not None for item in dao.find_items(players))
+
+    return op, None
+
+
+def filtered_search(dao, rows, rng):
+    def op(sample):
+        age = rng.randint(19, 40)
+        search = SearchDict().add_filter("position", rng.choice(POSITIONS))
+        search.add_between("age", age, age + 2)
+        return len(dao.search_table("players", search))
+
+    return op, None
+
+
+# No index on height and no player that tall, every op reads the whole table
+def unindexed_search(dao, rows, rng):
+    def op(sample):
+        search = SearchDict().add_filter("height", "8-0")
+        return len(dao.search_table("players", search, limit=PAGE_SIZE))
+
+    return op, None
+
+
+# Keyset pagination, sample n fetches page n + 1
+def keyset_page(dao, rows, rng):
+    state = {"last": None}
+
+    def op(sample):
+        page = dao.get_items_page(
+            Player, SearchDict(), state["last"], desc=False, limit=PAGE_SIZE
+        )
+        state["last"] = page[-1] if page else None
+        return len(page)
+
+    return op, None
+
+
+# OFFSET pagination halfway through the table, for contrast with keyset_page
+def offset_page(dao, rows, rng):
+    def op(sample):
+        return len(
+            dao.search_table(
+                "players",
+                {},
+                order_by=["name"],
+                limit=PAGE_SIZE,
+                offset=rows // 2,
+                desc=False,
+            )
+        )
+
+    return op, None
+
+
+def group_by(dataset, column):
+    def setup(dao, rows, rng):
+        def op(sample):
+            return len(dao.search_table(dataset, {}, group_by=[column]))
+
+        return op, None
+
+    return setup
+
+
+def insert_countries(dao, rows, rng):
+    def op(sample):
+        start = rows + sample * BATCH_SIZE
+        return dao.insert_rows(
+            "countries", generate_countries(start, start + BATCH_SIZE, rng)
+        )["inserted"]
+
+    return op, delete_from(dao, "countries", country_name(rows))
+
+
+def country_items(dao, rows, rng):
+    def op(sample):
+        search = SearchDict().add_filter("region", rng.choice(REGIONS))
+        return len(dao.get_items(Country, search, limit=BATCH_SIZE))
+
+    return op, None
+
+
+def country_columns(dao, rows, rng):
+    def op(sample):
+        low = rng.uniform(0, 15000)
+        search = SearchDict()
+        search.add_between("gdp_per_capita", low, low + 1000)
+        columns = dao.search_columns(
+            "countries", search, columns=["gdp", "population"], use_numpy=False
+        )
+        return len(columns["gdp"])
+
+    return op, None
+
+
+def country_aggregate(dao, rows, rng):
+    def op(sample):
+        rich = SearchDict().add_filter("gdp_per_capita", rng.uniform(0, 15000), ">")
+        return len(
+            dao.aggregate(
+                "countries",
+                group_by=["region"],
+                metrics={
+                    "total_gdp": ("sum", "gdp"),
+                    "mean_area": ("avg", "area"),
+                    "rich": ("count", "*", rich),
+                },
+                order_by=["total_gdp"],
+            )
+        )
+
+    return op, None
+
+
+CASES = [
+    Case("insert_item", "players", 1000, insert_item),
+    Case("insert_rows", "players", 20, insert_rows),
+    Case("update_item", "players", 1000, update_item),
+    Case("update_many", "players", 20, update_many("executemany")),
+    Case("update_many_temp_table", "players", 20, update_many("temp_table")),
+    Case("find_item", "players", 2000, find_item),
+    Case("find_items", "players", 200, find_items),
+    Case("filtered_search", "players", 20, filtered_search),
+    Case("unindexed_search", "players", 10, unindexed_search),
+    Case("keyset_page", "players", 200, keyset_page),
+    Case("offset_page", "players", 20, offset_page),
+    Case("group_by", "players", 10, group_by("players", "position")),
+    Case("country_insert_rows", "countries", 20, insert_countries),
+    Case("country_items", "countries", 50, country_items),
+    Case("country_columns", "countries", 20, country_columns),
+    Case("country_group_by", "countries", 10, group_by("countries", "region")),
+    Case("country_aggregate", "countries", 10, country_aggregate),
+]
@@ -0,0 +1,121 @@
+# Synthetic, seeded datasets shaped like the players and countries tables
+# used throughout the tests.
+
+import random
+from sqlitedao import ColumnDict, TableItem
+
+# Named dataset sizes accepted by --size
+SIZES = {"10k": 10000, "1m": 1000000, "10m": 10000000}
+POSITIONS = ["PG", "SG", "SF", "PF", "C"]
+HEIGHTS = ["{}-{}".format(feet, inches) for feet in (5, 6, 7) for inches in range(12)]
+REGIONS = [
+    "Africa",
+    "Asia",
+    "Caribbean",
+    "CentralAmerica",
+    "Europe",
+    "MiddleEast",
+    "NorthAmerica",
+    "Oceania",
+    "SouthAmerica",
+]
+# Rows per insert_rows call while building a dataset
+LOAD_CHUNK_SIZE = 50000
+
+
+class Player(TableItem):
+    TABLE_NAME = "players"
+    INDEX_KEYS = ["name"]
+    ALL_COLUMNS = {"name": str, "position": str, "age": int, "height": str}
+
+
+class Country(TableItem):
+    TABLE_NAME = "countries"
+    INDEX_KEYS = ["name"]
+    ALL_COLUMNS = {
+        "name": str,
+        "region": str,
+        "area": float,
+        "population": float,
+        "gdp": float,
+        "gdp_per_capita": float,
+    }
+
+
+# Keys are derived from the row number, so cases can pick random existing
+# (or new) rows without holding every key in memory.
+def player_name(number):
+    return "player{:09d}".format(number)
+
+
+def country_name(number):
+    return "country{:09d}".format(number)
+
+
+def player_columns():
+    return (
+        ColumnDict()
+        .add_column("name", "text", primary_key=True)
+        .add_column("position", "text")
+        .add_column("age", "integer")
+        .add_column("height", "text")
+    )
+
+
+def country_columns():
+    return (
+        ColumnDict()
+        .add_column("name", "text", primary_key=True)
+        .add_column("region", "text")
+        .add_column("area", "real")
+        .add_column("population", "real")
+        .add_column("gdp", "real")
+        .add_column("gdp_per_capita", "real")
+    )
+
+
+def generate_players(start, stop, rng):
+    for number in range(start, stop):
+        yield {
+            "name": player_name(number),
+            "position": rng.choice(POSITIONS),
+            "age": rng.randint(19, 42),
+            "height": rng.choice(HEIGHTS),
+        }
+
+
+def generate_countries(start, stop, rng):
+    for number in range(start, stop):
+        area = rng.uniform(10, 17000000)
+        population = rng.uniform(1, 1400000)
+        gdp = rng.uniform(100, 20000000)
+        yield {
+            "name": country_name(number),
+            "region": rng.choice(REGIONS),
+            "area": area,
+            "population": population,
+            "gdp": gdp,
+            "gdp_per_capita": gdp / population * 1000,
+        }
+
+
+DATASETS = {
+    "players": (player_columns, {"position_index": ["position"]}, generate_players),
+    "countries": (country_columns, {"region_index": ["region"]}, generate_countries),
+}
+
+
+# Creates and fills the table for dataset unless it already holds rows rows.
+# Returns True when the table was (re)built.
+def load_dataset(dao, dataset, rows, seed):
+    columns, indexes, generate = DATASETS[dataset]
+    if dao.is_table_exist(dataset):
+        if dao.get_row_count(dataset) == rows:
+            return False
+        dao.drop_table(dataset)
+    dao.create_table(dataset, columns(), indexes)
+    rng = random.Random("{}-{}".format(dataset, seed))
+    for start in range(0, rows, LOAD_CHUNK_SIZE):
+        stop = min(start + LOAD_CHUNK_SIZE, rows)
+        dao.insert_rows(dataset, generate(start, stop, rng))
+    return True
@@ -0,0 +1,218 @@
+# Runs the benchmark cases and compares their results with a saved baseline.
+
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from sqlitedao import SqliteDao
+from .cases import CASES
+from .datasets import load_dataset
+
+# Bumped whenever the JSON layout changes
+FORMAT_VERSION = 1
+
+
+def select_cases(names=None):
+    if not names:
+        return list(CASES)
+    by_name = {case.name: case for case in CASES}
+    unknown = [name for name in names if name not in by_name]
+    if unknown:
+        raise ValueError("Unknown benchmark cases: {}".format(", ".join(unknown)))
+    return [by_name[name] for name in names]
+
+
+# Builds each dataset the selected cases need with rows rows, in db_dir when
+# given (kept and reused by later runs with the same rows and seed) or in a
+# temporary directory. scale multiplies the samples taken per case.
+# Returns {"meta": {...}, "results": {case name: {...}}}.
+def run_suite(rows, seed=0, cases=None, db_dir=None, profile=None, scale=1.0, log=None):
+    if rows < 1:
+        raise ValueError("rows must be a positive integer")
+    selected = select_cases(cases)
+    temp_dir = None
+    if db_dir is None:
+        temp_dir = db_dir = tempfile.mkdtemp(prefix="sqlitedao-benchmark-")
+    db_path = os.path.join(db_dir, "benchmark-{}-{}.db".format(rows, seed))
+    dao = SqliteDao.get_instance(db_path, profile=profile)
+    build_seconds = {}
+    results = {}
+    try:
+        for dataset in sorted(set(case.dataset for case in selected)):
+            start = time.perf_counter()
+            if load_dataset(dao, dataset, rows, seed):
+                build_seconds[dataset] = time.perf_counter() - start
+                if log is not None:
+                    log(
+                        "built {} ({} rows) in {:.1f}s".format(
+                            dataset, rows, build_seconds[dataset]
+                        )
+                    )
+        for case in selected:
+            results[case.name] = run_case(dao, case, rows, seed, scale)
+            if log is not None:
+                log(format_result(case.name, results[case.name]))
+    finally:
+        SqliteDao.terminate_instance(db_path)
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    return {
+        "meta": {
+            "format_version": FORMAT_VERSION,
+            "rows": rows,
+            "seed": seed,
+            "profile": profile,
+            "scale": scale,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "build_seconds": build_seconds,
+        },
+        "results": results,
+    }
+
+
+# One untimed warm up op, the timed samples, then one more op traced for
+# its peak memory. Ops are numbered so inserting cases never reuse keys.
+def run_case(dao, case, rows, seed, scale=1.0):
+    rng = random.Random("{}-{}".format(case.name, seed))
+    samples = max(1, int(case.samples * scale))
+    op, teardown = case.setup(dao, rows, rng)
+    timings = []
+    handled = 0
+    try:
+        op(0)
+        for sample in range(1, samples + 1):
+            start = time.perf_counter()
+            count = op(sample)
+            timings.append(time.perf_counter() - start)
+            handled += count
+        peak_bytes = measure_peak(op, samples + 1)
+    finally:
+        if teardown is not None:
+            teardown()
+    result = summarize(timings, handled)
+    result["dataset"] = case.dataset
+    result["peak_bytes"] = peak_bytes
+    return result
+
+
+# Peak Python heap allocated while op runs. Memory SQLite allocates itself,
+# like its page cache, is not traced.
+def measure_peak(op, sample):
+    was_tracing = tracemalloc.is_tracing()
+    if was_tracing:
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.start()
+    try:
+        current = tracemalloc.get_traced_memory()[0]
+        op(sample)
+        return tracemalloc.get_traced_memory()[1] - current
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+
+def summarize(timings, handled):
+    ordered = sorted(timings)
+    total = sum(ordered)
+    return {
+        "samples": len(ordered),
+        "rows": handled,
+        "total_seconds": total,
+        "mean_seconds": total / len(ordered),
+        "p50_seconds": percentile(ordered, 0.5),
+        "p99_seconds": percentile(ordered, 0.99),
+        "max_seconds": ordered[-1],
+        "ops_per_second": len(ordered) / total if total else 0.0,
+        "rows_per_second": handled / total if total else 0.0,
+    }
+
+
+# Nearest rank percentile of an already sorted list
+def percentile(ordered, fraction):
+    return ordered[max(1, math.ceil(len(ordered) * fraction)) - 1]
+
+
+# Per case changes of p50, p99 and throughput from baseline to current, as
+# fractions (0.25 is 25% slower, or 25% more ops per second). A case whose
+# p50 grew by more than threshold is a regression, one the baseline lacks
+# is "new".
+def compare(current, baseline, threshold=0.1):
+    rows = []
+    for name, now in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            rows.append({"case": name, "status": "new"})
+            continue
+        p50_change = get_change(now["p50_seconds"], before["p50_seconds"])
+        if p50_change > threshold:
+            status = "regressed"
+        elif p50_change < -threshold:
+            status = "improved"
+        else:
+            status = "ok"
+        rows.append(
+            {
+                "case": name,
+                "status": status,
+                "p50_change": p50_change,
+                "p99_change": get_change(now["p99_seconds"], before["p99_seconds"]),
+                "throughput_change": get_change(
+                    now["ops_per_second"], before["ops_per_second"]
+                ),
+                "p50_seconds": now["p50_seconds"],
+                "baseline_p50_seconds": before["p50_seconds"],
+            }
+        )
+    return rows
+
+
+def get_change(now, before):
+    if not before:
+        return 0.0
+    return now / before - 1
+
+
+def format_result(name, result):
+    return (
+        "{:<24} {:>12.1f} ops/s {:>12.1f} rows/s  p50 {:>9.3f} ms"
+        "  p99 {:>9.3f} ms  peak {:>8.1f} KiB".format(
+            name,
+            result["ops_per_second"],
+            result["rows_per_second"],
+            result["p50_seconds"] * 1000,
+            result["p99_seconds"] * 1000,
+            result["peak_bytes"] / 1024,
+        )
+    )
+
+
+def format_comparison(rows):
+    lines = []
+    for row in rows:
+        if "p50_change" not in row:
+            lines.append("{:<24} {}".format(row["case"], row["status"]))
+            continue
+        lines.append(
+            "{:<24} {:<9}  p50 {:>+7.1%}  p99 {:>+7.1%}  throughput {:>+7.1%}".format(
+                row["case"],
+                row["status"],
+                row["p50_change"],
+                row["p99_change"],
+                row["throughput_change"],
+            )
+        )
+    return "\n".join(lines)
+
+
+def log_stderr(message):
+    print(message, file=sys.stderr, flush=True)
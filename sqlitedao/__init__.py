@@ -1 +1,2 @@
 from .sqlitedao import *
+from .asyncdao import AsyncSqliteDao
@@ -0,0 +1,156 @@
+# Collects query plans and timings per statement shape and suggests indexes.
+
+import threading
+
+# Operators an index can serve with a seek per value, ahead of a range
+EQUALITY_OPERATORS = {"=", "IN"}
+# Operators an index can serve as the last, range constrained column
+RANGE_OPERATORS = {"<", "<=", ">", ">=", "BETWEEN"}
+
+
+# Plan steps reading a whole table or index rather than seeking into it
+def is_scan(detail):
+    if not detail.startswith("SCAN "):
+        return False
+    return "CONSTANT ROW" not in detail and "VIRTUAL TABLE" not in detail
+
+
+class QueryAdvisor:
+    def __init__(self):
+        self.shapes = {}
+        self.lock = threading.Lock()
+
+    def is_known(self, query):
+        return query in self.shapes
+
+    # filter_shape as returned by SqliteDao.get_search_shape, plan is the
+    # detail column of EXPLAIN QUERY PLAN.
+    def add_shape(
+        self, kind, table_name, query, filter_shape, order_by, group_by, plan
+    ):
+        with self.lock:
+            if query in self.shapes:
+                return
+            self.shapes[query] = {
+                "kind": kind,
+                "table": table_name,
+                "query": query,
+                "filters": filter_shape,
+                "order_by": tuple(order_by or ()),
+                "group_by": tuple(group_by or ()),
+                "plan": plan,
+                "scans": [detail for detail in plan if is_scan(detail)],
+                "count": 0,
+                "total_seconds": 0.0,
+            }
+
+    def record(self, query, seconds):
+        with self.lock:
+            shape = self.shapes[query]
+            shape["count"] += 1
+            shape["total_seconds"] += seconds
+
+    # Shapes sorted by frequency x mean time, i.e. total time spent
+    def get_shapes(self):
+        with self.lock:
+            shapes = [dict(shape) for shape in self.shapes.values()]
+        report = []
+        for shape in shapes:
+            count = shape["count"]
+            mean = shape["total_seconds"] / count if count else 0.0
+            report.append(
+                {
+                    "kind": shape["kind"],
+                    "table": shape["table"],
+                    "query": shape["query"],
+                    "count": count,
+                    "mean_seconds": mean,
+                    "cost": count * mean,
+                    "plan": shape["plan"],
+                    "scans": shape["scans"],
+                }
+            )
+        report.sort(key=lambda shape: shape["cost"], reverse=True)
+        return report
+
+    # table -> [{"column", "operator", "count"}], most used first. Sorting
+    # and grouping count as the ORDER BY and GROUP BY operators.
+    def get_column_usage(self):
+        usage = {}
+        with self.lock:
+            for shape in self.shapes.values():
+                table_usage = usage.setdefault(shape["table"], {})
+                for column, operator in QueryAdvisor.get_uses(shape):
+                    key = (column, operator)
+                    table_usage[key] = table_usage.get(key, 0) + shape["count"]
+        return {
+            table: [
+                {"column": column, "operator": operator, "count": count}
+                for (column, operator), count in sorted(
+                    table_usage.items(), key=lambda use: use[1], reverse=True
+                )
+            ]
+            for table, table_usage in usage.items()
+        }
+
+    @staticmethod
+    def get_uses(shape):
+        for column, operator, *_ in shape["filters"]:
+            if isinstance(column, tuple):
+                for each in column:
+                    yield each, operator
+            else:
+                yield column, operator
+        for column in shape["order_by"]:
+            yield column, "ORDER BY"
+        for column in shape["group_by"]:
+            yield column, "GROUP BY"
+
+    # index_dict per table, in the format create_table accepts, for shapes
+    # whose plan scans. existing maps table -> {index name: [columns]}, a
+    # suggestion already covered by the leading columns of one is dropped.
+    def suggest_indexes(self, existing=None):
+        existing = existing or {}
+        weights = {}
+        with self.lock:
+            for shape in self.shapes.values():
+                if not shape["scans"]:
+                    continue
+                columns = QueryAdvisor.get_index_columns(shape)
+                if not columns:
+                    continue
+                key = (shape["table"], tuple(columns))
+                weights[key] = weights.get(key, 0) + shape["count"]
+        suggestions = {}
+        for (table, columns), _ in sorted(
+            weights.items(), key=lambda weight: weight[1], reverse=True
+        ):
+            covered = any(
+                list(index[: len(columns)]) == list(columns)
+                for index in existing.get(table, {}).values()
+            )
+            if covered:
+                continue
+            name = "advised_" + "_".join(columns)
+            suggestions.setdefault(table, {})[name] = list(columns)
+        return suggestions
+
+    # Equality columns first, then one range column, else the sort or
+    # grouping columns, following the left-most prefix rule.
+    @staticmethod
+    def get_index_columns(shape):
+        columns = []
+        ranged = None
+        for column, operator, *_ in shape["filters"]:
+            if isinstance(column, tuple):
+                if ranged is None:
+                    ranged = list(column)
+            elif operator in EQUALITY_OPERATORS:
+                columns.append(column)
+            elif operator in RANGE_OPERATORS and ranged is None:
+                ranged = [column]
+        if ranged is not None:
+            columns.extend(ranged)
+        else:
+            columns.extend(shape["group_by"] or shape["order_by"])
+        return list(dict.fromkeys(columns))
@@ -0,0 +1,183 @@
+# asyncio facade over SqliteDao, running every call off the event loop.
+
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from sqlitedao.sqlitedao import SqliteDao
+
+
+# The open stream of the current task. Streams run on their own thread, and
+# so do the task's calls while one is open: they reuse the pooled reader the
+# stream holds instead of waiting for it (see ConnectionPool.connection).
+current_stream = contextvars.ContextVar("sqlitedao_stream", default=None)
+
+
+class Stream:
+    __slots__ = ("executor",)
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="sqlitedao-stream"
+        )
+
+    def close(self):
+        executor = self.executor
+        self.executor = None
+        executor.shutdown(wait=False)
+
+
+class AsyncSqliteDao:
+    # Calls run on a dedicated executor with one thread per connection: the
+    # writer plus every pooled reader. At most max_pending calls may be queued
+    # or running, further callers wait for a slot instead of piling up work.
+    def __init__(self, dao, max_pending=64):
+        if max_pending < 1:
+            raise ValueError("max_pending must be a positive integer")
+        self.dao = dao
+        workers = 1
+        if dao.read_pool is not None:
+            workers += dao.read_pool.size
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="sqlitedao"
+        )
+        self.max_pending = max_pending
+        self.pending = 0
+        # Created on first use so it binds to the running loop
+        self.slots = None
+
+    @staticmethod
+    def get_instance(db_path, max_pending=64, **kwargs):
+        return AsyncSqliteDao(SqliteDao.get_instance(db_path, **kwargs), max_pending)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    async def run(self, fn, *args, **kwargs):
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_pending)
+        async with self.slots:
+            self.pending += 1
+            stream = current_stream.get()
+            executor = self.executor
+            if stream is not None and stream.executor is not None:
+                executor = stream.executor
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(
+                    executor, partial(fn, *args, **kwargs)
+                )
+            finally:
+                self.pending -= 1
+
+    async def search_table(self, table_name, search_dict, **kwargs):
+        return await self.run(self.dao.search_table, table_name, search_dict, **kwargs)
+
+    async def get_row_count(self, table_name):
+        return await self.run(self.dao.get_row_count, table_name)
+
+    async def aggregate(self, table_name, search_dict=None, **kwargs):
+        return await self.run(self.dao.aggregate, table_name, search_dict, **kwargs)
+
+    async def count_rows(self, table_name, search_dict=None):
+        return await self.run(self.dao.count_rows, table_name, search_dict)
+
+    async def insert_row(self, table_name, row_tuple):
+        return await self.run(self.dao.insert_row, table_name, row_tuple)
+
+    async def insert_rows(self, table_name, row_tuples):
+        return await self.run(self.dao.insert_rows, table_name, row_tuples)
+
+    async def update_rows(self, table_name, update_dict, search_dict):
+        return await self.run(
+            self.dao.update_rows, table_name, update_dict, search_dict
+        )
+
+    async def delete_rows(self, table_name, search_dict):
+        return await self.run(self.dao.delete_rows, table_name, search_dict)
+
+    async def insert_item(self, table_item, update_if_duplicate=False):
+        return await self.run(self.dao.insert_item, table_item, update_if_duplicate)
+
+    async def insert_items(self, table_items):
+        return await self.run(self.dao.insert_items, table_items)
+
+    async def find_item(self, table_item):
+        return await self.run(self.dao.find_item, table_item)
+
+    async def find_items(self, table_items, **kwargs):
+        return await self.run(self.dao.find_items, table_items, **kwargs)
+
+    async def get_items(self, class_type, search_dict, **kwargs):
+        return await self.run(self.dao.get_items, class_type, search_dict, **kwargs)
+
+    async def get_items_page(self, class_type, search_dict, last_item, **kwargs):
+        return await self.run(
+            self.dao.get_items_page, class_type, search_dict, last_item, **kwargs
+        )
+
+    async def update_item(self, table_item):
+        return await self.run(self.dao.update_item, table_item)
+
+    async def update_items(self, table_items):
+        return await self.run(self.dao.update_items, table_items)
+
+    async def delete_item(self, table_item):
+        return await self.run(self.dao.delete_item, table_item)
+
+    async def delete_items(self, table_items, **kwargs):
+        return await self.run(self.dao.delete_items, table_items, **kwargs)
+
+    # Streams a large scan batch by batch, each fetch runs on the executor:
+    #   async for batch in adao.iter_batches("players", {}, batch_size=500):
+    #       await response.write(encode(batch))
+    async def iter_batches(self, table_name, search_dict, **kwargs):
+        batches = self.stream(self.dao.iter_batches(table_name, search_dict, **kwargs))
+        try:
+            async for batch in batches:
+                yield batch
+        finally:
+            await batches.aclose()
+
+    # Pulls a sync generator on the task's stream thread, opening the stream
+    # unless an outer one is already open.
+    async def stream(self, batches):
+        stream = current_stream.get()
+        opened = stream is None or stream.executor is None
+        if opened:
+            stream = Stream()
+            current_stream.set(stream)
+        try:
+            while True:
+                batch = await self.run(next, batches, None)
+                if batch is None:
+                    break
+                yield batch
+        finally:
+            try:
+                await self.run(batches.close)
+            finally:
+                if opened:
+                    stream.close()
+
+    async def iter_table(self, table_name, search_dict, **kwargs):
+        batches = self.iter_batches(table_name, search_dict, **kwargs)
+        try:
+            async for batch in batches:
+                for row in batch:
+                    yield row
+        finally:
+            await batches.aclose()
+
+    # Items are built on the executor like the sync iter_items, in the dao's
+    # row format and marked clean
+    async def iter_items(self, class_type, search_dict, **kwargs):
+        batches = self.stream(
+            self.dao.iter_item_batches(class_type, search_dict, **kwargs)
+        )
+        try:
+            async for batch in batches:
+                for item in batch:
+                    yield item
+        finally:
+            await batches.aclose()
@@ -0,0 +1,138 @@
+# Bounded caches used by SqliteDao for items and query results.
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class LRUCache:
+    # Least recently used entries are evicted beyond max_entries, or once the
+    # entry sizes given to put add up to more than max_bytes. Entries
+    # older than ttl seconds are dropped on access when ttl is set. Each
+    # entry carries a tag (the table it was read from) so every entry of a
+    # table can be invalidated at once.
+    #
+    # Every invalidation bumps the generation of its tag. A reader takes the
+    # generation before querying and passes it to put, which drops the value
+    # if a write invalidated the tag in between.
+    def __init__(self, max_entries=1024, ttl=None, max_bytes=None):
+        if max_entries < 1:
+            raise ValueError("max_entries must be a positive integer")
+        if max_bytes is not None and max_bytes < 1:
+            raise ValueError("max_bytes must be a positive integer")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.generations = {}
+        self.epoch = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None:
+                if time.monotonic() - entry[2] > self.ttl:
+                    self.remove(key)
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    # Presence only, unlike get this counts no hit or miss
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get_generation(self, tag=None):
+        with self.lock:
+            return self.epoch, self.generations.get(tag, 0)
+
+    def put(self, key, value, tag=None, generation=None, size=0):
+        with self.lock:
+            if generation is not None and generation != (
+                self.epoch,
+                self.generations.get(tag, 0),
+            ):
+                return
+            if key in self.entries:
+                self.remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self.entries[key] = (value, tag, time.monotonic(), size)
+            self.bytes += size
+            self.tags.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries or (
+                self.max_bytes is not None and self.bytes > self.max_bytes
+            ):
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    # Must hold self.lock
+    def remove(self, key):
+        _, tag, _, size = self.entries.pop(key)
+        self.bytes -= size
+        keys = self.tags[tag]
+        keys.discard(key)
+        if not keys:
+            del self.tags[tag]
+
+    def pop(self, key, tag=None):
+        with self.lock:
+            self.generations[tag] = self.generations.get(tag, 0) + 1
+            if key in self.entries:
+                self.remove(key)
+                self.invalidations += 1
+
+    def invalidate_tag(self, tag):
+        with self.lock:
+            self.generations[tag] = self.generations.get(tag, 0) + 1
+            for key in self.tags.pop(tag, ()):
+                self.bytes -= self.entries.pop(key)[3]
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.epoch += 1
+            self.invalidations += len(self.entries)
+            self.entries.clear()
+            self.tags.clear()
+            self.bytes = 0
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "size": len(self.entries),
+                "max_entries": self.max_entries,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+# Rough memory footprint of a list of result rows, counting the containers
+# and the values they hold.
+def estimate_size(rows):
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row)
+        for value in row.values() if isinstance(row, dict) else row:
+            size += sys.getsizeof(value)
+    return size
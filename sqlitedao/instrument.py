@@ -0,0 +1,145 @@
+# Per statement timings, latency histograms, slow query log and listeners.
+
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("sqlitedao")
+
+# Histogram bucket upper bounds in seconds, the last bucket is unbounded
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+# Statements tracked separately, later ones are counted under OTHER_QUERIES
+MAX_SHAPES = 1000
+OTHER_QUERIES = "(other)"
+
+
+class Instrumentation:
+    # Statements whose wall time reaches slow_query_seconds are logged as
+    # warnings on the "sqlitedao" logger. Listeners are called with an event
+    # dict per statement: kind ("read", "write" or "commit"), query, params
+    # (bound parameter count), rows (returned or affected), seconds, error.
+    def __init__(self, slow_query_seconds=None, buckets=DEFAULT_BUCKETS):
+        if list(buckets) != sorted(buckets):
+            raise ValueError("buckets must be in increasing order")
+        self.slow_query_seconds = slow_query_seconds
+        self.buckets = tuple(buckets)
+        self.listeners = []
+        self.shapes = {}
+        self.lock = threading.Lock()
+
+    def add_listener(self, callback):
+        self.listeners = self.listeners + [callback]
+
+    def remove_listener(self, callback):
+        self.listeners = [e for e in self.listeners if e != callback]
+
+    @staticmethod
+    def new_event(kind, query, values=(), many=False):
+        return {
+            "kind": kind,
+            "query": query,
+            "params": count_params(values, many),
+            "rows": None,
+            "seconds": 0.0,
+            "error": None,
+        }
+
+    # Times the block and reports it, the block may fill in event["rows"]
+    @contextmanager
+    def measure(self, kind, query, values=(), many=False):
+        event = Instrumentation.new_event(kind, query, values, many)
+        start = time.perf_counter()
+        try:
+            yield event
+        except Exception as e:
+            event["error"] = e
+            raise
+        finally:
+            event["seconds"] = time.perf_counter() - start
+            self.observe(event)
+
+    def observe(self, event):
+        seconds = event["seconds"]
+        with self.lock:
+            query = event["query"]
+            if query not in self.shapes and len(self.shapes) >= MAX_SHAPES:
+                query = OTHER_QUERIES
+            shape = self.shapes.get(query)
+            if shape is None:
+                shape = self.shapes[query] = {
+                    "kind": event["kind"],
+                    "count": 0,
+                    "errors": 0,
+                    "rows": 0,
+                    "total_seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "histogram": [0] * (len(self.buckets) + 1),
+                }
+            shape["count"] += 1
+            if event["error"] is not None:
+                shape["errors"] += 1
+            if event["rows"] is not None and event["rows"] > 0:
+                shape["rows"] += event["rows"]
+            shape["total_seconds"] += seconds
+            shape["max_seconds"] = max(shape["max_seconds"], seconds)
+            shape["histogram"][bisect.bisect_left(self.buckets, seconds)] += 1
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            logger.warning(
+                "Slow %s (%.1f ms, %s rows, %s params): %s",
+                event["kind"],
+                seconds * 1000,
+                event["rows"],
+                event["params"],
+                event["query"],
+            )
+        for callback in self.listeners:
+            try:
+                callback(event)
+            except Exception:
+                logger.exception("Query listener %r failed", callback)
+
+    # query -> count, errors, rows, total/mean/max seconds, p50 and p99
+    # estimated as the upper bound of their bucket (max_seconds for the
+    # last one), and histogram as [(upper bound, count)].
+    def get_stats(self):
+        with self.lock:
+            shapes = {
+                query: dict(shape, histogram=list(shape["histogram"]))
+                for query, shape in self.shapes.items()
+            }
+        bounds = self.buckets + (float("inf"),)
+        stats = {}
+        for query, shape in shapes.items():
+            count = shape["count"]
+            histogram = shape.pop("histogram")
+            shape["mean_seconds"] = shape["total_seconds"] / count
+            shape["p50_seconds"] = self.get_quantile(histogram, 0.5, shape)
+            shape["p99_seconds"] = self.get_quantile(histogram, 0.99, shape)
+            shape["histogram"] = list(zip(bounds, histogram))
+            stats[query] = shape
+        return stats
+
+    def get_quantile(self, histogram, quantile, shape):
+        rank = quantile * shape["count"]
+        seen = 0
+        for index, count in enumerate(histogram):
+            seen += count
+            if seen >= rank and count:
+                if index == len(self.buckets):
+                    return shape["max_seconds"]
+                return min(self.buckets[index], shape["max_seconds"])
+        return shape["max_seconds"]
+
+    def reset(self):
+        with self.lock:
+            self.shapes = {}
+
+
+def count_params(values, many=False):
+    if not many:
+        return len(values)
+    if isinstance(values, list):
+        return sum(len(row) for row in values)
+    return None
@@ -0,0 +1,161 @@
+# Bounded pool of read connections shared between threads.
+
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class ConnectionPool:
+    # connect is a callable returning a new, fully configured connection.
+    # Connections are opened lazily up to size, then callers wait for one
+    # to be returned, for at most timeout seconds (forever if None).
+    def __init__(self, connect, size, timeout=None):
+        if size < 1:
+            raise ValueError("pool size must be a positive integer")
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        # LIFO hands the most recently used, cache-warm connection back out
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.connections = []
+        # Connections opened before the last recycle() are closed on checkin
+        self.generation = 0
+        self.generations = {}
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.checkout_seconds = 0.0
+        # The connection each thread holds, so nested reads (a lookup inside
+        # an iter_table loop) reuse it instead of waiting on the pool
+        self.local = threading.local()
+
+    # Re-entrant per thread. The hold is kept by reference, so a generator
+    # resumed on another thread still returns the connection it checked out.
+    @contextmanager
+    def connection(self):
+        hold = getattr(self.local, "hold", None)
+        if hold is None or hold.conn is None:
+            hold = self.local.hold = ConnectionHold(self.checkout())
+        hold.depth += 1
+        conn = hold.conn
+        try:
+            yield conn
+        finally:
+            hold.depth -= 1
+            if hold.depth == 0:
+                hold.conn = None
+                self.checkin(conn)
+
+    def checkout(self):
+        start = time.perf_counter()
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            conn = self.open_or_wait(start)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.checkouts += 1
+            self.checkout_seconds += elapsed
+        return conn
+
+    def open_or_wait(self, start):
+        with self.lock:
+            can_open = len(self.connections) < self.size
+            if can_open:
+                # Reserve the slot before connecting outside the lock
+                self.connections.append(None)
+        if can_open:
+            try:
+                conn = self.connect()
+            except Exception:
+                with self.lock:
+                    self.connections.remove(None)
+                raise
+            with self.lock:
+                self.connections[self.connections.index(None)] = conn
+                self.generations[id(conn)] = self.generation
+            return conn
+        try:
+            conn = self.idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeoutError(
+                "No read connection available after {}s".format(self.timeout)
+            )
+        waited = time.perf_counter() - start
+        with self.lock:
+            self.waits += 1
+            self.wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        return conn
+
+    def checkin(self, conn):
+        with self.lock:
+            stale = self.generations.get(id(conn)) != self.generation
+            if stale:
+                self.discard(conn)
+        if stale:
+            conn.close()
+        else:
+            self.idle.put(conn)
+
+    # Must hold self.lock
+    def discard(self, conn):
+        self.generations.pop(id(conn), None)
+        if conn in self.connections:
+            self.connections.remove(conn)
+
+    # Close idle connections and retire busy ones once they are returned,
+    # so the next checkouts get connections built by a fresh connect().
+    def recycle(self):
+        with self.lock:
+            self.generation += 1
+            stale = []
+            while True:
+                try:
+                    conn = self.idle.get_nowait()
+                except queue.Empty:
+                    break
+                self.discard(conn)
+                stale.append(conn)
+        for conn in stale:
+            conn.close()
+
+    def close(self):
+        with self.lock:
+            connections = [c for c in self.connections if c is not None]
+            self.connections = []
+            self.generations = {}
+        for conn in connections:
+            conn.close()
+        self.idle = queue.LifoQueue()
+
+    def get_stats(self):
+        with self.lock:
+            checkouts = self.checkouts
+            return {
+                "size": self.size,
+                "open": len(self.connections),
+                "idle": self.idle.qsize(),
+                "checkouts": checkouts,
+                "waits": self.waits,
+                "wait_seconds": self.wait_seconds,
+                "max_wait_seconds": self.max_wait_seconds,
+                "avg_checkout_seconds": (
+                    self.checkout_seconds / checkouts if checkouts else 0.0
+                ),
+            }
+
+
+class ConnectionHold:
+    __slots__ = ("conn", "depth")
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.depth = 0
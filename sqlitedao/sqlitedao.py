@@ -1,15 +1,117 @@
+import base64
+import csv
+import json
+import multiprocessing
+import re
 import sqlite3
-from sqlitedao import sanitize
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from collections.abc import MutableMapping
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache, partial
+from sqlitedao import sanitize, transfer
+from sqlitedao.advisor import QueryAdvisor
+from sqlitedao.cache import LRUCache, MISSING, estimate_size
+from sqlitedao.instrument import DEFAULT_BUCKETS, Instrumentation
+from sqlitedao.pool import ConnectionPool, PoolTimeoutError
 
 
 class SqliteDao:
     # One connection per database of sqlite
     INSTANCE_MAP = {}
+    # Number of distinct statement shapes kept compiled per dao
+    STATEMENT_CACHE_SIZE = 256
+    # Rows pulled per fetchmany call by the iterators
+    ITER_BATCH_SIZE = 1000
+    # Shapes a fetched row can take: dict copies, plain tuples, namedtuples
+    # (one class cached per column set) or the sqlite3.Row itself, uncopied
+    ROW_FORMATS = ["dict", "tuple", "namedtuple", "row"]
+    # Rows per executemany call in insert_rows
+    INSERT_CHUNK_SIZE = 10000
+    # update_many strategies, see update_many
+    UPDATE_METHODS = ["executemany", "temp_table"]
+    UPDATE_TEMP_TABLE = "sqlitedao_update"
+    # Items per IN list in find_items
+    FIND_CHUNK_SIZE = 500
+    # Functions aggregate accepts in metrics, count_distinct is
+    # count(DISTINCT column)
+    AGGREGATE_FUNCTIONS = [
+        "count",
+        "count_distinct",
+        "sum",
+        "total",
+        "avg",
+        "min",
+        "max",
+        "group_concat",
+    ]
+    # SearchDict.add_in lists up to this long bind one parameter per value,
+    # longer ones bind a single JSON array read back with json_each
+    IN_LIST_LIMIT = 128
+    # Item keys per table remembered inside a transaction to evict again
+    # on commit, beyond that the commit drops the whole table
+    UNCOMMITTED_EVICTION_LIMIT = 10000
+    # Named PRAGMA settings, applied in this order at connection time.
+    # page_size only takes effect on a database with no pages yet.
+    PRAGMA_NAMES = [
+        "page_size",
+        "journal_mode",
+        "synchronous",
+        "cache_size",
+        "mmap_size",
+        "temp_store",
+        "wal_autocheckpoint",
+    ]
+    # Per-connection settings that also apply to pooled readers
+    READER_PRAGMAS = ["cache_size", "mmap_size", "temp_store"]
+    PRAGMA_PROFILES = {
+        "durable": {
+            "page_size": 4096,
+            "journal_mode": "DELETE",
+            "synchronous": "FULL",
+            "cache_size": -2000,
+            "mmap_size": 0,
+            "temp_store": "DEFAULT",
+            "wal_autocheckpoint": 1000,
+        },
+        "balanced-wal": {
+            "page_size": 4096,
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "cache_size": -16000,
+            "mmap_size": 268435456,
+            "temp_store": "MEMORY",
+            "wal_autocheckpoint": 1000,
+        },
+        # Stays in WAL so readers keep working, but skips fsync and
+        # checkpoints rarely. Recent commits may be lost on power failure.
+        "bulk-load": {
+            "page_size": 4096,
+            "journal_mode": "WAL",
+            "synchronous": "OFF",
+            "cache_size": -262144,
+            "mmap_size": 268435456,
+            "temp_store": "MEMORY",
+            "wal_autocheckpoint": 10000,
+        },
+        "read-mostly": {
+            "page_size": 4096,
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "cache_size": -65536,
+            "mmap_size": 1073741824,
+            "temp_store": "MEMORY",
+            "wal_autocheckpoint": 1000,
+        },
+    }
 
     @staticmethod
-    def get_instance(db_path, single_threaded=False):
+    def get_instance(db_path, single_threaded=False, **kwargs):
         if db_path not in SqliteDao.INSTANCE_MAP:
-            SqliteDao.INSTANCE_MAP[db_path] = SqliteDao(db_path, single_threaded)
+            SqliteDao.INSTANCE_MAP[db_path] = SqliteDao(
+                db_path, single_threaded, **kwargs
+            )
         return SqliteDao.INSTANCE_MAP[db_path]
 
     @staticmethod
@@ -22,39 +124,350 @@ class SqliteDao:
     def terminate_all_instances():
         SqliteDao.INSTANCE_MAP = {}
 
-    def __init__(self, db_path, single_threaded=False):
-        self.conn = sqlite3.connect(db_path, check_same_thread=single_threaded)
-        self.conn.row_factory = sqlite3.Row
+    # read_pool_size > 0 routes reads to a pool of that many read-only
+    # connections, while writes stay serialized on self.conn. Checkouts wait
+    # up to pool_timeout seconds (forever if None) when every reader is busy.
+    # profile names an entry of PRAGMA_PROFILES, pragmas overrides its values.
+    # row_format is the default for search_table, one of ROW_FORMATS.
+    def __init__(
+        self,
+        db_path,
+        single_threaded=False,
+        read_pool_size=0,
+        pool_timeout=None,
+        profile=None,
+        pragmas=None,
+        row_format="dict",
+    ):
+        if read_pool_size and db_path in (":memory:", ""):
+            raise ValueError("read pool requires a database file")
+        SqliteDao.validate_row_format(row_format)
+        self.row_format = row_format
+        self.row_classes = {}
+        self.db_path = db_path
+        self.profile = None
+        self.pragmas = {}
+        self.single_threaded = single_threaded
+        self.conn = self.connect(check_same_thread=single_threaded)
+        self.write_lock = threading.RLock()
+        self.transaction_owner = None
+        self.read_pool = None
+        if read_pool_size:
+            self.read_pool = ConnectionPool(
+                self.connect_reader, read_pool_size, pool_timeout
+            )
+        self.statement_cache = OrderedDict()
+        self.statement_lock = threading.Lock()
+        self.statement_cache_hits = 0
+        self.statement_cache_misses = 0
+        self.transaction_depth = 0
+        self.batch_every = None
+        self.batch_interval = None
+        self.pending_writes = 0
+        self.last_commit = time.monotonic()
+        self.flush_timer = None
+        self.item_cache = None
+        self.item_cache_keys = {}
+        self.result_cache = None
+        self.data_version = None
+        self.uncommitted_writes = {}
+        self.advisor = None
+        self.instrumentation = None
+        if profile is not None or pragmas:
+            self.set_profile(profile, **(pragmas or {}))
+
+    def connect(self, check_same_thread=False):
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=check_same_thread,
+            cached_statements=SqliteDao.STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def connect_reader(self):
+        conn = self.connect()
+        conn.execute("PRAGMA query_only = ON")
+        for name in SqliteDao.READER_PRAGMAS:
+            if name in self.pragmas:
+                conn.execute("PRAGMA {} = {}".format(name, self.pragmas[name]))
+        return conn
 
     def close(self):
+        if self.pending_writes:
+            self.flush()
+        if self.read_pool is not None:
+            self.read_pool.close()
         self.conn.close()
 
+    # ======================================== #
+    # PRAGMA PROFILES                          #
+    # ======================================== #
+
+    # Switch to a named profile and/or override individual settings:
+    #   dao.set_profile("bulk-load")
+    #   dao.set_profile("balanced-wal", cache_size=-64000)
+    #   dao.set_profile(mmap_size=0)  # keeps the current profile
+    # Returns the effective settings as reported by sqlite.
+    def set_profile(self, profile=None, **overrides):
+        if profile is not None and profile not in SqliteDao.PRAGMA_PROFILES:
+            raise ValueError(
+                "Unknown profile {}, expected one of {}".format(
+                    profile, list(SqliteDao.PRAGMA_PROFILES)
+                )
+            )
+        if profile is None:
+            # Overrides alone adjust the current settings
+            profile = self.profile
+            settings = dict(self.pragmas)
+        else:
+            settings = dict(SqliteDao.PRAGMA_PROFILES[profile])
+        for name, value in overrides.items():
+            if name not in SqliteDao.PRAGMA_NAMES:
+                raise ValueError("Unsupported pragma: {}".format(name))
+            if not re.fullmatch(r"-?\w+", str(value)):
+                raise ValueError("Invalid value for pragma {}: {}".format(name, value))
+            settings[name] = value
+        with self.write_lock:
+            if self.transaction_depth:
+                raise ValueError("Cannot change pragmas inside a transaction")
+            if self.conn.in_transaction:
+                self.flush()
+            # Idle readers would keep the database locked against a
+            # journal_mode change, the next checkouts reconnect anyway
+            if self.read_pool is not None:
+                self.read_pool.recycle()
+            new_database = self.conn.execute("PRAGMA page_count").fetchone()[0] == 0
+            for name in SqliteDao.PRAGMA_NAMES:
+                if name not in settings:
+                    continue
+                if name == "page_size" and not new_database:
+                    continue
+                if name == "journal_mode":
+                    # Runs before the settings below, so a failed switch
+                    # leaves the current profile in place
+                    self.set_journal_mode(settings[name])
+                    continue
+                cursor = self.conn.execute(
+                    "PRAGMA {} = {}".format(name, settings[name])
+                )
+                cursor.fetchall()
+                cursor.close()
+            self.profile = profile
+            self.pragmas = settings
+        return self.get_pragmas()
+
+    # In-memory databases keep journal_mode memory, only a refused switch raises
+    def set_journal_mode(self, journal_mode):
+        try:
+            cursor = self.conn.execute("PRAGMA journal_mode = {}".format(journal_mode))
+            cursor.fetchall()
+            cursor.close()
+        except sqlite3.OperationalError as e:
+            raise sqlite3.OperationalError(
+                "Could not switch journal_mode to {} while other connections "
+                "use the database ({}), profile left unchanged".format(journal_mode, e)
+            )
+
+    def get_pragmas(self):
+        pragmas = {}
+        for name in SqliteDao.PRAGMA_NAMES:
+            cursor = self.conn.execute("PRAGMA {}".format(name))
+            row = cursor.fetchone()
+            cursor.close()
+            # In-memory databases report no mmap_size
+            pragmas[name] = row[0] if row is not None else None
+        return pragmas
+
+    # ======================================== #
+    # CONNECTION ROUTING                       #
+    # ======================================== #
+
+    # Yields the connection reads should use: a pooled reader, or the writer
+    # when pooling is off, this thread is inside its own transaction or
+    # batched writes are waiting for their commit (see set_batch_commit).
+    @contextmanager
+    def reader(self):
+        if (
+            self.read_pool is None
+            or self.pending_writes
+            or self.transaction_owner == threading.get_ident()
+        ):
+            yield self.conn
+        else:
+            with self.read_pool.connection() as conn:
+                yield conn
+
+    # All mutations funnel through here, serialized on the writer connection.
+    def execute_write(self, query, values=(), many=False):
+        with self.write_lock:
+            cursor = self.conn.cursor()
+            try:
+                if self.instrumentation is None:
+                    SqliteDao.run_statement(cursor, query, values, many)
+                else:
+                    with self.instrumentation.measure(
+                        "write", query, values, many
+                    ) as event:
+                        SqliteDao.run_statement(cursor, query, values, many)
+                        event["rows"] = cursor.rowcount
+                self.commit_write()
+                return cursor.rowcount
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def run_statement(cursor, query, values, many):
+        if many:
+            cursor.executemany(query, values)
+        else:
+            cursor.execute(query, values)
+
+    def get_pool_stats(self):
+        if self.read_pool is None:
+            return None
+        return self.read_pool.get_stats()
+
+    # ======================================== #
+    # TRANSACTIONS AND COMMIT BATCHING         #
+    # ======================================== #
+
+    # Group writes into one commit, nested blocks become savepoints:
+    #   with dao.transaction():
+    #       dao.insert_item(item)
+    @contextmanager
+    def transaction(self):
+        with self.write_lock:
+            if self.transaction_depth == 0:
+                if self.conn.in_transaction:
+                    self.flush()
+                self.conn.execute("BEGIN")
+                self.transaction_owner = threading.get_ident()
+                savepoint = None
+            else:
+                savepoint = "sqlitedao_sp_{}".format(self.transaction_depth)
+                self.conn.execute(f"SAVEPOINT {savepoint}")
+            self.transaction_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self.transaction_depth -= 1
+                if savepoint is None:
+                    self.transaction_owner = None
+                    with self.measure("commit", "ROLLBACK"):
+                        self.conn.rollback()
+                    self.uncommitted_writes = {}
+                else:
+                    self.conn.execute(f"ROLLBACK TO {savepoint}")
+                    self.conn.execute(f"RELEASE {savepoint}")
+                if self.item_cache is not None:
+                    self.item_cache.clear()
+                if self.result_cache is not None:
+                    self.result_cache.clear()
+                raise
+            self.transaction_depth -= 1
+            if savepoint is None:
+                self.transaction_owner = None
+                self.flush()
+            else:
+                self.conn.execute(f"RELEASE {savepoint}")
+
+    # Commit after every `every` writes and/or once `interval_ms` has passed
+    # since the last commit. A timer commits the tail of an interval batch
+    # when no further write lands, except on single_threaded daos whose writer
+    # is bound to its thread: there the interval is checked on the next write
+    # and close() commits the rest. Pass no arguments to commit every write.
+    def set_batch_commit(self, every=None, interval_ms=None):
+        if every is not None and every < 1:
+            raise ValueError("every must be a positive integer")
+        with self.write_lock:
+            if self.transaction_depth:
+                raise ValueError("Cannot change batch commits inside a transaction")
+            self.flush()
+            self.batch_every = every
+            self.batch_interval = None if interval_ms is None else interval_ms / 1000
+
+    # Commits pending batched writes. An open transaction() commits when its
+    # block ends, flushing inside it would commit part of the block.
+    def flush(self):
+        with self.write_lock:
+            if self.transaction_depth:
+                raise ValueError("Cannot flush inside a transaction")
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            self.commit_connection()
+            self.pending_writes = 0
+            self.last_commit = time.monotonic()
+            self.invalidate_uncommitted()
+
+    # Runs on the timer thread. A transaction holds the write lock until its
+    # own commit, which leaves nothing pending by the time this gets it.
+    def flush_on_timer(self):
+        with self.write_lock:
+            if self.pending_writes:
+                self.flush()
+
+    # Called by every mutation in place of a bare commit.
+    def commit_write(self):
+        if self.transaction_depth:
+            return
+        if self.batch_every is None and self.batch_interval is None:
+            self.commit_connection()
+            self.invalidate_uncommitted()
+            return
+        self.pending_writes += 1
+        if self.batch_every is not None and self.pending_writes >= self.batch_every:
+            self.flush()
+        elif self.batch_interval is not None:
+            remaining = self.batch_interval - (time.monotonic() - self.last_commit)
+            if remaining <= 0:
+                self.flush()
+            elif self.flush_timer is None and not self.single_threaded:
+                self.flush_timer = threading.Timer(remaining, self.flush_on_timer)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+
+    def commit_connection(self):
+        if self.instrumentation is None:
+            self.conn.commit()
+            return
+        with self.instrumentation.measure("commit", "COMMIT"):
+            self.conn.commit()
+
     def is_table_exist(self, table_name):
         query = "SELECT name from sqlite_master WHERE type='table' AND name=?"
-        cursor = self.conn.execute(query, (table_name,))
-        table = cursor.fetchone()
-        cursor.close()
+        with self.reader() as conn, self.measure("read", query, (table_name,)):
+            cursor = conn.execute(query, (table_name,))
+            table = cursor.fetchone()
+            cursor.close()
         return table is not None
 
     def get_row_count(self, table_name):
         sanitize.validate_table_name(table_name)
         quoted_table_name = sanitize.quote_string(table_name)
         query = f"SELECT count(*) from {quoted_table_name}"
-        cursor = self.conn.execute(query)
-        num_count = cursor.fetchone()[0]
-        cursor.close()
+        with self.reader() as conn, self.measure("read", query) as event:
+            cursor = conn.execute(query)
+            num_count = cursor.fetchone()[0]
+            event["rows"] = 1
+            cursor.close()
         return num_count
 
     def get_schema(self, info="name", type="table"):
         query = "SELECT {} from sqlite_master WHERE type='{}'".format(info, type)
-        cursor = self.conn.execute(query)
-        return [dict(t) for t in cursor.fetchall()]
+        with self.reader() as conn, self.measure("read", query) as event:
+            cursor = conn.execute(query)
+            rows = cursor.fetchall()
+            event["rows"] = len(rows)
+        return [dict(t) for t in rows]
 
     def drop_table(self, table_name):
         sanitize.validate_table_name(table_name)
         quoted_table_name = sanitize.quote_string(table_name)
         query = f"DROP TABLE {quoted_table_name}"
-        self.conn.execute(query)
+        self.execute_write(query)
+        self.invalidate_caches(table_name)
 
     def drop_index(self, table_name, index_name):
         sanitize.validate_table_name(table_name)
@@ -63,7 +476,7 @@ class SqliteDao:
         quoted_index_name = sanitize.quote_string(index_name_actual)
         query = "DROP INDEX {}".format(index_name_actual)
         query = f"DROP INDEX {quoted_index_name}"
-        self.conn.execute(query)
+        self.execute_write(query)
 
     def create_table(self, table_name, column_dict, index_dict=None):
         sanitize.validate_table_name(table_name)
@@ -83,8 +496,7 @@ class SqliteDao:
             primary_key_str = "PRIMARY KEY({})".format(", ".join(primary_keys))
             columns.append(primary_key_str)
         query += ", ".join(columns) + " )"
-        cursor = self.conn.cursor()
-        cursor.execute(query)
+        index_queries = []
         if index_dict:
             for k, v in index_dict.items():
                 if not isinstance(v, list):
@@ -93,9 +505,16 @@ class SqliteDao:
                 index_name = "idx_{}_".format(table_name) + k
                 quoted_index_name = sanitize.quote_string(index_name)
                 index_query = f"CREATE INDEX IF NOT EXISTS {quoted_index_name} ON {quoted_table_name} ({index_string})"
-                cursor.execute(index_query)
-        self.conn.commit()
-        cursor.close()
+                index_queries.append(index_query)
+        with self.write_lock:
+            cursor = self.conn.cursor()
+            with self.measure("write", query):
+                cursor.execute(query)
+            for index_query in index_queries:
+                with self.measure("write", index_query):
+                    cursor.execute(index_query)
+            self.commit_write()
+            cursor.close()
 
     # fetch rows where search_dict is satisfied
     def search_table(
@@ -108,105 +527,574 @@ class SqliteDao:
         offset=None,
         desc=True,
         debug=False,
+        row_format=None,
     ):
-        def group_by_ops():
-            if group_by is None:
-                return ""
-            select_clause = query.split("from")[0]
-            substitute_select_clause = "SELECT count(*) AS count,{} ".format(
-                ",".join(group_by)
+        row_format = self.get_row_format(row_format)
+        query, values = self.compile_search(
+            table_name, search_dict, order_by, group_by, limit, offset, desc
+        )
+        if debug:
+            print(query)
+        run = self.get_fetch(table_name, query, values, row_format)
+        if self.advisor is None:
+            return run()
+        return self.advise(
+            "search", table_name, query, values, search_dict, order_by, group_by, run
+        )
+
+    # Reads through the result cache when enabled, except inside the
+    # calling thread's own transaction.
+    def get_fetch(self, table_name, query, values, row_format):
+        if (
+            self.result_cache is not None
+            and self.transaction_owner != threading.get_ident()
+        ):
+            return partial(
+                self.fetch_cached_result, table_name, query, values, row_format
             )
-            groupby_query = query.replace(select_clause, substitute_select_clause)
-            groupby_query += (
-                " GROUP BY {}".format(",".join(group_by)) + " ORDER BY count DESC"
+        return partial(
+            self.fetch_query,
+            query,
+            values,
+            row_format,
+            lambda cursor, rows: self.format_rows(cursor, rows, row_format),
+        )
+
+    # Grouped metrics computed by SQLite, one row per group (a single row
+    # without group_by) holding the group_by columns and one column per
+    # metric. metrics maps alias -> (function, column) or (function, column,
+    # search_dict), the last only aggregating rows matching search_dict:
+    #   dao.aggregate("countries", {}, group_by=["region"], metrics={
+    #       "total_gdp": ("sum", "gdp"),
+    #       "rich": ("count", "*", SearchDict().add_filter("gdp", 1e6, ">")),
+    #   }, having=SearchDict().add_filter("rich", 0, ">"), order_by=["total_gdp"])
+    # having filters on metric aliases and group_by columns, order_by sorts
+    # on either. Functions are limited to AGGREGATE_FUNCTIONS.
+    def aggregate(
+        self,
+        table_name,
+        search_dict=None,
+        group_by=None,
+        metrics=None,
+        having=None,
+        order_by=None,
+        limit=None,
+        desc=True,
+        row_format=None,
+    ):
+        row_format = self.get_row_format(row_format)
+        query, values = self.compile_aggregate(
+            table_name, search_dict, group_by, metrics, having, order_by, limit, desc
+        )
+        run = self.get_fetch(table_name, query, values, row_format)
+        if self.advisor is None:
+            return run()
+        return self.advise(
+            "aggregate",
+            table_name,
+            query,
+            values,
+            search_dict or {},
+            None,
+            group_by,
+            run,
+        )
+
+    # Number of rows matching search_dict, get_row_count with a filter
+    def count_rows(self, table_name, search_dict=None):
+        rows = self.aggregate(
+            table_name,
+            search_dict,
+            metrics={"count": ("count", "*")},
+            row_format="tuple",
+        )
+        return rows[0][0]
+
+    def compile_aggregate(
+        self,
+        table_name,
+        search_dict=None,
+        group_by=None,
+        metrics=None,
+        having=None,
+        order_by=None,
+        limit=None,
+        desc=True,
+    ):
+        if metrics is None:
+            metrics = {"count": ("count", "*")}
+        if not metrics:
+            raise ValueError("aggregate needs at least one metric")
+        metric_shapes = []
+        values = []
+        for alias, metric in metrics.items():
+            if not isinstance(metric, (tuple, list)) or len(metric) not in (2, 3):
+                raise ValueError(
+                    "metric {} should be (function, column[, search_dict])".format(
+                        alias
+                    )
+                )
+            filter_shape = None
+            if len(metric) == 3 and metric[2]:
+                filter_shape, filter_values = self.get_search_shape(metric[2])
+                values.extend(filter_values)
+            metric_shapes.append((alias, metric[0], metric[1], filter_shape))
+        filter_shape, search_values = self.get_search_shape(search_dict or {})
+        having_shape, having_values = self.get_search_shape(having or {})
+        values.extend(search_values)
+        values.extend(having_values)
+        shape = (
+            "aggregate",
+            table_name,
+            tuple(metric_shapes),
+            filter_shape,
+            None if group_by is None else tuple(group_by),
+            having_shape,
+            None if order_by is None else tuple(order_by),
+            limit is not None,
+            desc,
+        )
+
+        def build():
+            sanitize.validate_table_name(table_name)
+            quoted_table_name = sanitize.quote_string(table_name)
+            columns = list(group_by or [])
+            for alias, function, column, metric_filter in metric_shapes:
+                sanitize.validate_table_name(alias)
+                columns.append(
+                    "{} AS {}".format(
+                        self.get_metric_expression(function, column, metric_filter),
+                        sanitize.quote_string(alias),
+                    )
+                )
+            query = "SELECT {} from {}".format(",".join(columns), quoted_table_name)
+            if filter_shape:
+                query += " WHERE " + self.get_where_clause(filter_shape)
+            if group_by:
+                query += " GROUP BY {}".format(",".join(group_by))
+            if having_shape:
+                query += " HAVING " + self.get_where_clause(having_shape)
+            if order_by:
+                query += " ORDER BY " + SqliteDao.get_order_clause(order_by, desc)
+            if limit is not None:
+                query += " LIMIT ?"
+            return query
+
+        query = self.get_statement(shape, build)
+        if limit is not None:
+            values.append(limit)
+        return query, values
+
+    # A filtered metric aggregates CASE WHEN filter THEN column END, the
+    # aggregate functions skip the NULLs left for other rows. Same result as
+    # FILTER (WHERE ...) without needing sqlite 3.30.
+    @staticmethod
+    def get_metric_expression(function, column, filter_shape=None):
+        if function not in SqliteDao.AGGREGATE_FUNCTIONS:
+            raise ValueError(
+                "aggregate function should be one of {}".format(
+                    SqliteDao.AGGREGATE_FUNCTIONS
+                )
+            )
+        if column == "*":
+            if function != "count":
+                raise ValueError("only count can aggregate *")
+            argument = "1" if filter_shape else "*"
+        else:
+            sanitize.validate_table_name(column)
+            argument = column
+        if filter_shape:
+            argument = "CASE WHEN {} THEN {} END".format(
+                SqliteDao.get_where_clause(filter_shape), argument
             )
-            return groupby_query
+        if function == "count_distinct":
+            return "count(DISTINCT {})".format(argument)
+        return "{}({})".format(function, argument)
 
-        sanitize.validate_table_name(table_name)
-        quoted_table_name = sanitize.quote_string(table_name)
-        cursor = self.conn.cursor()
-        query = f"SELECT * from {quoted_table_name}"
-        if not search_dict:
+    def fetch_query(self, query, values, row_format, convert):
+        instrumentation = self.instrumentation
+        with self.reader() as conn:
+            if instrumentation is None:
+                cursor = self.open_cursor(conn, query, values, row_format)
+                try:
+                    return convert(cursor, cursor.fetchall())
+                finally:
+                    cursor.close()
+            cursor = None
+            try:
+                with instrumentation.measure("read", query, values) as event:
+                    cursor = self.open_cursor(conn, query, values, row_format)
+                    rows = cursor.fetchall()
+                    event["rows"] = len(rows)
+                return convert(cursor, rows)
+            finally:
+                if cursor is not None:
+                    cursor.close()
+
+    # Same arguments as search_table, but yields rows lazily instead of a list.
+    def iter_table(
+        self,
+        table_name,
+        search_dict,
+        order_by=None,
+        group_by=None,
+        limit=None,
+        offset=None,
+        desc=True,
+        batch_size=None,
+        columns=None,
+        row_format=None,
+    ):
+        batches = self.iter_batches(
+            table_name,
+            search_dict,
+            order_by=order_by,
+            group_by=group_by,
+            limit=limit,
+            offset=offset,
+            desc=desc,
+            batch_size=batch_size,
+            columns=columns,
+            row_format=row_format,
+        )
+        try:
+            for batch in batches:
+                yield from batch
+        finally:
+            batches.close()
+
+    # Yields lists of rows, each pulled with one fetchmany call.
+    # The cursor is closed when the generator is exhausted, closed or collected.
+    def iter_batches(
+        self,
+        table_name,
+        search_dict,
+        order_by=None,
+        group_by=None,
+        limit=None,
+        offset=None,
+        desc=True,
+        batch_size=None,
+        columns=None,
+        row_format=None,
+    ):
+        if batch_size is None:
+            batch_size = SqliteDao.ITER_BATCH_SIZE
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive integer")
+        row_format = self.get_row_format(row_format)
+        query, values = self.compile_search(
+            table_name, search_dict, order_by, group_by, limit, offset, desc, columns
+        )
+        batches = self.iter_query(
+            query,
+            values,
+            row_format,
+            lambda cursor, rows: self.format_rows(cursor, rows, row_format),
+            batch_size,
+        )
+        try:
+            yield from batches
+        finally:
+            batches.close()
+
+    # Runs a read query and yields convert(cursor, rows) per fetchmany batch.
+    # Instrumented streams are reported once exhausted or closed, timing only
+    # the execute and fetchmany calls, not the consumer.
+    def iter_query(self, query, values, row_format, convert, batch_size):
+        instrumentation = self.instrumentation
+        if instrumentation is not None:
+            yield from self.iter_query_measured(
+                instrumentation, query, values, row_format, convert, batch_size
+            )
+            return
+        with self.reader() as conn:
+            cursor = self.open_cursor(conn, query, values, row_format)
+            try:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield convert(cursor, rows)
+            finally:
+                cursor.close()
+
+    def iter_query_measured(
+        self, instrumentation, query, values, row_format, convert, batch_size
+    ):
+        event = instrumentation.new_event("read", query, values)
+        event["rows"] = 0
+        cursor = None
+        with self.reader() as conn:
+            start = time.perf_counter()
+            try:
+                cursor = self.open_cursor(conn, query, values, row_format)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    event["seconds"] += time.perf_counter() - start
+                    start = None
+                    if not rows:
+                        break
+                    event["rows"] += len(rows)
+                    yield convert(cursor, rows)
+                    start = time.perf_counter()
+            except Exception as e:
+                if start is not None:
+                    event["seconds"] += time.perf_counter() - start
+                event["error"] = e
+                raise
+            finally:
+                if cursor is not None:
+                    cursor.close()
+                instrumentation.observe(event)
+
+    # ======================================== #
+    # ROW FORMATS                              #
+    # ======================================== #
+
+    @staticmethod
+    def validate_row_format(row_format):
+        if row_format not in SqliteDao.ROW_FORMATS:
+            raise ValueError(
+                "row_format must be one of {}".format(SqliteDao.ROW_FORMATS)
+            )
+
+    def get_row_format(self, row_format):
+        if row_format is None:
+            return self.row_format
+        SqliteDao.validate_row_format(row_format)
+        return row_format
+
+    def open_cursor(self, conn, query, values, row_format):
+        cursor = conn.cursor()
+        if row_format in ("tuple", "namedtuple"):
+            # Skip building sqlite3.Row objects that would be thrown away
+            cursor.row_factory = None
+        cursor.execute(query, values)
+        return cursor
+
+    def format_rows(self, cursor, rows, row_format):
+        if row_format == "dict":
+            return [dict(row) for row in rows]
+        if row_format == "namedtuple":
+            make = self.get_row_class(cursor.description)._make
+            return [make(row) for row in rows]
+        return rows
+
+    def get_row_class(self, description):
+        names = tuple(d[0] for d in description)
+        row_class = self.row_classes.get(names)
+        if row_class is None:
+            # rename replaces names that are not identifiers, e.g. count(*)
+            row_class = namedtuple("Row", names, rename=True)
+            self.row_classes[names] = row_class
+        return row_class
+
+    # The direction applies to the last order_by column only, as in
+    # "ORDER BY a,b DESC", or with sort_each to every column, which keyset
+    # pagination needs.
+    @staticmethod
+    def get_order_clause(order_by, desc, sort_each=False):
+        direction = " DESC" if desc else " ASC"
+        if sort_each:
+            return ",".join([e + direction for e in order_by])
+        return ",".join(order_by) + direction
+
+    # Returns the (query, values) pair search_table would execute.
+    # Query text is cached per shape, so only values are rebuilt on a hit.
+    def compile_search(
+        self,
+        table_name,
+        search_dict,
+        order_by=None,
+        group_by=None,
+        limit=None,
+        offset=None,
+        desc=True,
+        columns=None,
+        sort_each=False,
+    ):
+        filter_shape, values = self.get_search_shape(search_dict)
+        has_offset = limit is not None and offset is not None
+        shape = (
+            "search",
+            table_name,
+            filter_shape,
+            None if order_by is None else tuple(order_by),
+            None if group_by is None else tuple(group_by),
+            limit is not None,
+            has_offset,
+            desc,
+            None if columns is None else tuple(columns),
+            sort_each,
+        )
+
+        def build():
+            sanitize.validate_table_name(table_name)
+            quoted_table_name = sanitize.quote_string(table_name)
             if group_by is not None:
-                query = group_by_ops()
+                query = "SELECT count(*) AS count,{} from {}".format(
+                    ",".join(group_by), quoted_table_name
+                )
+            elif columns is not None:
+                query = "SELECT {} from {}".format(",".join(columns), quoted_table_name)
+            else:
+                query = f"SELECT * from {quoted_table_name}"
+            if filter_shape:
+                query += " WHERE " + self.get_where_clause(filter_shape)
+            if group_by is not None:
+                query += " GROUP BY {}".format(",".join(group_by))
+                query += " ORDER BY count DESC"
             elif order_by is not None:
-                direction = "DESC" if desc else "ASC"
-                query += " ORDER BY {} {}".format(",".join(order_by), direction)
+                query += " ORDER BY " + SqliteDao.get_order_clause(
+                    order_by, desc, sort_each
+                )
             if limit is not None:
-                query += " LIMIT {}".format(limit)
-                if offset is not None:
-                    query += " OFFSET {}".format(offset)
-            cursor.execute(query)
-            result = [dict(row) for row in cursor.fetchall()]
-            cursor.close()
-            return result
+                query += " LIMIT ?"
+                if has_offset:
+                    query += " OFFSET ?"
+            return query
 
-        # Query that contains where clause
-        extended_feature = isinstance(search_dict, SearchDict)
-        query += " WHERE "
-        key_strings = []
-        value_strings = []
-        for k, v in search_dict.items():
-            self.populate_search_dict(
-                key_strings, value_strings, k, v, extended_feature
-            )
-        query += " AND ".join(key_strings)
-        if group_by is not None:
-            query = group_by_ops()
-        elif order_by is not None:
-            direction = "DESC" if desc else "ASC"
-            query += " ORDER BY {} {}".format(",".join(order_by), direction)
+        query = self.get_statement(shape, build)
         if limit is not None:
-            query += " LIMIT {}".format(limit)
-            if offset is not None:
-                query += " OFFSET {}".format(offset)
-        if debug:
-            print(query)
-        cursor.execute(query, value_strings)
-        result = [dict(row) for row in cursor.fetchall()]
-        cursor.close()
-        return result
+            values.append(limit)
+            if has_offset:
+                values.append(offset)
+        return query, values
 
     def insert_row(self, table_name, row_tuple):
         # Row values are a dictionary representing the row.
         if not isinstance(row_tuple, dict):
             raise ValueError("row_tuple should be a dictionary")
-        sanitize.validate_table_name(table_name)
-        quoted_table_name = sanitize.quote_string(table_name)
-        query = f"INSERT INTO {quoted_table_name} "
-        keys = row_tuple.keys()
-        values = list(row_tuple.values())
-        query += "(" + ",".join(keys) + ")"
-        query += " VALUES "
-        query += "(" + ",".join(["?"] * len(row_tuple)) + ")"
-        cursor = self.conn.cursor()
+        query = self.compile_insert(table_name, tuple(row_tuple.keys()))
         try:
-            cursor.execute(query, values)
-            self.conn.commit()
+            self.execute_write(query, list(row_tuple.values()))
         except sqlite3.IntegrityError as e:
             raise DuplicateError(
                 "Insertion violates uniqueness constraint: {}".format(e)
             )
-        cursor.close()
+        self.invalidate_caches(table_name, inserted=True)
+
+    # Accepts any iterable of row dicts, including generators. Rows are
+    # grouped by key set, so optional columns may be left out, and written in
+    # chunks of chunk_size inside one transaction. Rows violating a uniqueness
+    # constraint are skipped. Returns {"inserted": n, "ignored": n}.
+    def insert_rows(self, table_name, row_tuples, chunk_size=None):
+        if chunk_size is None:
+            chunk_size = SqliteDao.INSERT_CHUNK_SIZE
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be a positive integer")
+        counts = {"inserted": 0, "ignored": 0}
 
-    def insert_rows(self, table_name, row_tuples):
-        # Assert each row tuples have the same length and keys
-        keys = row_tuples[0].keys()
-        multiple_values = []
+        def write(keys, multiple_values):
+            query = self.compile_insert(table_name, keys, ignore=True)
+            inserted = self.execute_write(query, multiple_values, many=True)
+            counts["inserted"] += inserted
+            counts["ignored"] += len(multiple_values) - inserted
+            self.invalidate_rows(table_name, keys, multiple_values, inserted=True)
+
+        with self.transaction():
+            SqliteDao.write_row_chunks(row_tuples, chunk_size, write)
+        return counts
+
+    # Buffers rows per key set and calls write(keys, multiple_values) each
+    # time a buffer reaches chunk_size, then once per leftover buffer.
+    @staticmethod
+    def write_row_chunks(row_tuples, chunk_size, write):
+        buffers = {}
         for row_tuple in row_tuples:
-            if row_tuple.keys() != keys:
-                raise ValueError("batch should have same keys")
-            multiple_values.append(list(row_tuple.values()))
-        sanitize.validate_table_name(table_name)
-        quoted_table_name = sanitize.quote_string(table_name)
-        query = f"INSERT OR IGNORE INTO {quoted_table_name} "
-        query += "(" + ",".join(keys) + ")"
-        query += " VALUES "
-        query += "(" + ",".join(["?"] * len(keys)) + ")"
-        cursor = self.conn.cursor()
-        cursor.executemany(query, multiple_values)
-        self.conn.commit()
-        cursor.close()
+            keys = tuple(row_tuple.keys())
+            buffer = buffers.setdefault(keys, [])
+            buffer.append(list(row_tuple.values()))
+            if len(buffer) >= chunk_size:
+                write(keys, buffer)
+                buffers[keys] = []
+        for keys, buffer in buffers.items():
+            if buffer:
+                write(keys, buffer)
+
+    def compile_insert(self, table_name, keys, ignore=False):
+        shape = ("insert", table_name, keys, ignore)
+
+        def build():
+            sanitize.validate_table_name(table_name)
+            quoted_table_name = sanitize.quote_string(table_name)
+            verb = "INSERT OR IGNORE INTO" if ignore else "INSERT INTO"
+            query = f"{verb} {quoted_table_name} "
+            query += "(" + ",".join(keys) + ")"
+            query += " VALUES "
+            query += "(" + ",".join(["?"] * len(keys)) + ")"
+            return query
+
+        return self.get_statement(shape, build)
+
+    # Insert rows, updating the existing row instead when conflict_keys collide,
+    # as one INSERT ... ON CONFLICT DO UPDATE statement per key shape.
+    # update_columns limits which columns get overwritten (default: every
+    # non-key column in the row). Returns the number of rows written.
+    def upsert_row(self, table_name, row_tuple, conflict_keys, update_columns=None):
+        if not isinstance(row_tuple, dict):
+            raise ValueError("row_tuple should be a dictionary")
+        return self.upsert_rows(table_name, [row_tuple], conflict_keys, update_columns)
+
+    # Like insert_rows, accepts any iterable and writes it in chunks of
+    # chunk_size per key set inside one transaction.
+    def upsert_rows(
+        self,
+        table_name,
+        row_tuples,
+        conflict_keys,
+        update_columns=None,
+        chunk_size=None,
+    ):
+        if not conflict_keys:
+            raise ValueError("upsert needs the conflict key columns")
+        if chunk_size is None:
+            chunk_size = SqliteDao.INSERT_CHUNK_SIZE
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be a positive integer")
+        conflict_keys = tuple(conflict_keys)
+        if update_columns is not None:
+            update_columns = tuple(update_columns)
+        counts = {"written": 0}
+
+        def write(keys, multiple_values):
+            query = self.compile_upsert(table_name, keys, conflict_keys, update_columns)
+            counts["written"] += self.execute_write(query, multiple_values, many=True)
+            # The conflict keys pick the row that gets updated
+            self.invalidate_rows(table_name, keys, multiple_values, conflict_keys)
+
+        with self.transaction():
+            SqliteDao.write_row_chunks(row_tuples, chunk_size, write)
+        return counts["written"]
+
+    def compile_upsert(self, table_name, keys, conflict_keys, update_columns=None):
+        shape = ("upsert", table_name, keys, conflict_keys, update_columns)
+
+        def build():
+            for key in conflict_keys:
+                if key not in keys:
+                    raise ValueError("row is missing conflict key {}".format(key))
+            sanitize.validate_table_name(table_name)
+            quoted_table_name = sanitize.quote_string(table_name)
+            if update_columns is None:
+                set_columns = [k for k in keys if k not in conflict_keys]
+            else:
+                # Columns the row does not carry are left untouched
+                set_columns = [k for k in update_columns if k in keys]
+            query = f"INSERT INTO {quoted_table_name} "
+            query += "(" + ",".join(keys) + ")"
+            query += " VALUES "
+            query += "(" + ",".join(["?"] * len(keys)) + ")"
+            query += " ON CONFLICT({})".format(",".join(conflict_keys))
+            if set_columns:
+                query += " DO UPDATE SET "
+                query += ", ".join(["{0}=excluded.{0}".format(k) for k in set_columns])
+            else:
+                query += " DO NOTHING"
+            return query
+
+        return self.get_statement(shape, build)
 
     def update_row(self, table_name, update_dict, search_dict):
         if not update_dict:
@@ -227,90 +1115,857 @@ class SqliteDao:
             value_strings.append(v)
         query += ", ".join(set_strings) + " WHERE "
         query += " AND ".join(search_strings)
-        cursor = self.conn.cursor()
-        cursor.execute(query, value_strings)
-        self.conn.commit()
-        cursor.close()
+        self.execute_write(query, value_strings)
+        self.invalidate_caches(table_name, search_dict, update_dict)
 
-    # Fills multiple rows one at the time.
-    def update_many(self, table_name, update_dicts, search_dicts):
+    # Fills multiple rows, update_dicts[i] into the row matching search_dicts[i].
+    # Pairs are grouped by their update and search keys, so shapes may differ.
+    # method="temp_table" bulk loads each group into a TEMP table and applies
+    # it with one UPDATE ... FROM instead of one UPDATE per row, much faster on
+    # large batches. Returns {"affected": rows updated, "seconds": elapsed}.
+    def update_many(self, table_name, update_dicts, search_dicts, method="executemany"):
+        if method not in SqliteDao.UPDATE_METHODS:
+            raise ValueError(
+                "method should be one of {}".format(SqliteDao.UPDATE_METHODS)
+            )
+        if len(update_dicts) != len(search_dicts):
+            raise ValueError("Need one search dict per update dict")
+        start = time.perf_counter()
         # Search dict will always be basic dictionary this time.
-        # Sanitize inputs! Assumed to be only used for table items.
-        set_columns = update_dicts[0].keys()
-        search_columns = search_dicts[0].keys()
-        values = [
-            list(update.values()) + list(search.values())
-            for update, search in zip(update_dicts, search_dicts)
-        ]
-        set_strings = ["{}=?".format(e) for e in set_columns]
-        search_strings = ["{}=?".format(e) for e in search_columns]
+        groups = {}
+        for update, search in zip(update_dicts, search_dicts):
+            if not update:
+                continue
+            if not search:
+                raise ValueError("must apply search conditions")
+            groups.setdefault((tuple(update), tuple(search)), []).append(
+                list(update.values()) + list(search.values())
+            )
+        affected = 0
+        with self.transaction():
+            for (set_columns, search_columns), values in groups.items():
+                if method == "temp_table":
+                    affected += self.update_from_temp_table(
+                        table_name, set_columns, search_columns, values
+                    )
+                else:
+                    query = self.compile_update_many(
+                        table_name, set_columns, search_columns
+                    )
+                    affected += self.execute_write(query, values, many=True)
+        if self.item_cache is None:
+            self.invalidate_caches(table_name)
+        else:
+            for update, search in zip(update_dicts, search_dicts):
+                self.invalidate_caches(table_name, search, update)
+        return {"affected": affected, "seconds": time.perf_counter() - start}
+
+    def compile_update_many(self, table_name, set_columns, search_columns):
+        shape = ("update_many", table_name, set_columns, search_columns)
+
+        def build():
+            sanitize.validate_table_name(table_name)
+            quoted_table_name = sanitize.quote_string(table_name)
+            query = f"UPDATE {quoted_table_name} SET "
+            query += ", ".join(["{}=?".format(e) for e in set_columns]) + " WHERE "
+            query += " AND ".join(["{}=?".format(e) for e in search_columns])
+            return query
+
+        return self.get_statement(shape, build)
+
+    # values rows hold the set values followed by the search values. Must be
+    # called inside a transaction.
+    def update_from_temp_table(self, table_name, set_columns, search_columns, values):
         sanitize.validate_table_name(table_name)
         quoted_table_name = sanitize.quote_string(table_name)
-        query = f"UPDATE {quoted_table_name} SET "
-        query += ", ".join(set_strings) + " WHERE "
-        query += " AND ".join(search_strings)
-        cursor = self.conn.cursor()
-        cursor.executemany(query, values)
-        self.conn.commit()
+        # Later pairs for the same row win, as they would with executemany
+        latest = {}
+        for row_values in values:
+            latest[tuple(row_values[len(set_columns) :])] = row_values
+        # Untyped temp columns take the affinity of the column they are
+        # compared with, matching how bound parameters behave.
+        temp_set = ["v{}".format(i) for i in range(len(set_columns))]
+        temp_keys = ["k{}".format(i) for i in range(len(search_columns))]
+        temp_table = "temp.{}".format(SqliteDao.UPDATE_TEMP_TABLE)
+        self.execute_write(f"DROP TABLE IF EXISTS {temp_table}")
+        self.execute_write(
+            "CREATE TEMP TABLE {} ({})".format(
+                SqliteDao.UPDATE_TEMP_TABLE, ", ".join(temp_set + temp_keys)
+            )
+        )
+        try:
+            self.execute_write(
+                "INSERT INTO {} VALUES ({})".format(
+                    temp_table, ",".join(["?"] * (len(temp_set) + len(temp_keys)))
+                ),
+                list(latest.values()),
+                many=True,
+            )
+            match = " AND ".join(
+                "u.{} = {}.{}".format(key, quoted_table_name, column)
+                for key, column in zip(temp_keys, search_columns)
+            )
+            if sqlite3.sqlite_version_info >= (3, 33, 0):
+                query = f"UPDATE {quoted_table_name} SET "
+                query += ", ".join(
+                    "{}=u.{}".format(column, value)
+                    for column, value in zip(set_columns, temp_set)
+                )
+                # Visiting rows in key order keeps index seeks local
+                query += " FROM (SELECT * FROM {} ORDER BY {}) AS u".format(
+                    temp_table, ",".join(temp_keys)
+                )
+                query += f" WHERE {match}"
+            else:
+                # No UPDATE ... FROM before sqlite 3.33, correlate instead
+                query = f"UPDATE {quoted_table_name} SET "
+                query += ", ".join(
+                    "{}=(SELECT u.{} FROM {} AS u WHERE {})".format(
+                        column, value, temp_table, match
+                    )
+                    for column, value in zip(set_columns, temp_set)
+                )
+                query += " WHERE EXISTS (SELECT 1 FROM {} AS u WHERE {})".format(
+                    temp_table, match
+                )
+            return self.execute_write(query)
+        finally:
+            self.execute_write(f"DROP TABLE {temp_table}")
+
+    # For backfilling purpose, fills multiple matching rows at the same time.
+    def update_rows(self, table_name, update_dict, search_dict):
+        if not update_dict:
+            return
+        filter_shape, search_values = self.get_search_shape(search_dict)
+        shape = ("update_rows", table_name, tuple(update_dict.keys()), filter_shape)
+
+        def build():
+            sanitize.validate_table_name(table_name)
+            quoted_table_name = sanitize.quote_string(table_name)
+            query = f"UPDATE {quoted_table_name} SET "
+            query += ", ".join(["{}=?".format(k) for k in update_dict.keys()])
+            if filter_shape:
+                query += " WHERE " + self.get_where_clause(filter_shape)
+            return query
+
+        query = self.get_statement(shape, build)
+        value_strings = list(update_dict.values()) + search_values
+        if self.advisor is None:
+            self.execute_write(query, value_strings)
+        else:
+            self.advise(
+                "update",
+                table_name,
+                query,
+                value_strings,
+                search_dict,
+                None,
+                None,
+                partial(self.execute_write, query, value_strings),
+            )
+        self.invalidate_caches(table_name, search_dict, update_dict)
+
+    def delete_rows(self, table_name, search_dict):
+        filter_shape, value_strings = self.get_search_shape(search_dict)
+        shape = ("delete_rows", table_name, filter_shape)
+
+        def build():
+            sanitize.validate_table_name(table_name)
+            quoted_table_name = sanitize.quote_string(table_name)
+            query = f"DELETE FROM {quoted_table_name}"
+            if filter_shape:
+                query += " WHERE " + self.get_where_clause(filter_shape)
+            return query
+
+        query = self.get_statement(shape, build)
+        if self.advisor is None:
+            self.execute_write(query, value_strings)
+        else:
+            self.advise(
+                "delete",
+                table_name,
+                query,
+                value_strings,
+                search_dict,
+                None,
+                None,
+                partial(self.execute_write, query, value_strings),
+            )
+        self.invalidate_caches(table_name, search_dict)
+
+    def populate_search_dict(self, key_strings, value_strings, k, v, extended_feature):
+        if extended_feature:
+            if SearchDict.is_comp(v):
+                key_strings.append("{} {} ?".format(k, v["operator"]))
+                value_strings.append(v["value"])
+            else:
+                key_strings.append("{} BETWEEN ? AND ?".format(k))
+                value_strings.extend([v["value_low"], v["value_high"]])
+        else:
+            key_strings.append("{} = ?".format(k))
+            value_strings.append(v)
+
+    # ======================================== #
+    # COMPILED STATEMENT CACHE                 #
+    # ======================================== #
+
+    # Reduce a search dict to a hashable shape and the values to bind, in order.
+    @staticmethod
+    def get_search_shape(search_dict):
+        extended_feature = isinstance(search_dict, SearchDict)
+        shape = []
+        values = []
+        for k, v in search_dict.items():
+            if not extended_feature:
+                shape.append((k, "="))
+                values.append(v)
+            elif SearchDict.is_comp(v):
+                shape.append((k, v["operator"]))
+                values.append(v["value"])
+            elif v["statement_type"] == "row_comparison":
+                shape.append((k, v["operator"]))
+                values.extend(v["values"])
+            elif v["statement_type"] == "in":
+                operator = "NOT IN" if v["negate"] else "IN"
+                in_values = v["values"]
+                if len(in_values) > SqliteDao.IN_LIST_LIMIT:
+                    shape.append((k, operator, None))
+                    values.append(SqliteDao.to_json_array(in_values))
+                else:
+                    # Repeating the last value is harmless in an IN list and
+                    # keeps the number of statement shapes logarithmic
+                    if in_values:
+                        in_values = SqliteDao.pad_chunk(
+                            in_values, SqliteDao.IN_LIST_LIMIT
+                        )
+                    shape.append((k, operator, len(in_values)))
+                    values.extend(in_values)
+            else:
+                shape.append((k, "BETWEEN"))
+                values.extend([v["value_low"], v["value_high"]])
+        return tuple(shape), values
+
+    # IN filters carry a third element, the number of bound values or None
+    # for a JSON array.
+    @staticmethod
+    def get_where_clause(filter_shape):
+        key_strings = []
+        for k, operator, *size in filter_shape:
+            if operator == "BETWEEN":
+                key_strings.append("{} BETWEEN ? AND ?".format(k))
+            elif size and size[0] is None:
+                # Unary + drops the affinity json_each gives value, so the
+                # column's own affinity applies, as with bound parameters
+                key_strings.append(
+                    "{} {} (SELECT +value FROM json_each(?))".format(k, operator)
+                )
+            elif size:
+                key_strings.append(
+                    "{} {} ({})".format(k, operator, ",".join(["?"] * size[0]))
+                )
+            elif isinstance(k, tuple):
+                key_strings.append(
+                    "({}) {} ({})".format(
+                        ",".join(k), operator, ",".join(["?"] * len(k))
+                    )
+                )
+            else:
+                key_strings.append("{} {} ?".format(k, operator))
+        return " AND ".join(key_strings)
+
+    @staticmethod
+    def to_json_array(values):
+        try:
+            return json.dumps(values, allow_nan=False)
+        except (TypeError, ValueError):
+            raise ValueError(
+                "IN lists over {} values take str, int, float, bool or None".format(
+                    SqliteDao.IN_LIST_LIMIT
+                )
+            )
+
+    # Fetch query text for a statement shape, building it only on a miss.
+    def get_statement(self, shape, build):
+        with self.statement_lock:
+            query = self.statement_cache.get(shape)
+            if query is not None:
+                self.statement_cache_hits += 1
+                self.statement_cache.move_to_end(shape)
+                return query
+            self.statement_cache_misses += 1
+        query = build()
+        with self.statement_lock:
+            self.statement_cache[shape] = query
+            if len(self.statement_cache) > SqliteDao.STATEMENT_CACHE_SIZE:
+                self.statement_cache.popitem(last=False)
+        return query
+
+    def get_statement_cache_stats(self):
+        return {
+            "hits": self.statement_cache_hits,
+            "misses": self.statement_cache_misses,
+            "size": len(self.statement_cache),
+            "max_size": SqliteDao.STATEMENT_CACHE_SIZE,
+        }
+
+    def clear_statement_cache(self):
+        with self.statement_lock:
+            self.statement_cache.clear()
+            self.statement_cache_hits = 0
+            self.statement_cache_misses = 0
+
+    # ======================================== #
+    # ITEM AND RESULT CACHES                   #
+    # ======================================== #
+
+    # Cache the rows find_item returns, keyed by table and index dict:
+    #   dao.enable_item_cache(max_items=10000, ttl=30)
+    # Writes made through this dao evict the rows they touch, or every cached
+    # row of the table when the rows cannot be told from the search dict.
+    # Writes from other processes are not seen, set ttl to bound staleness.
+    def enable_item_cache(self, max_items=1024, ttl=None):
+        self.item_cache = LRUCache(max_items, ttl)
+        self.item_cache_keys = {}
+
+    def disable_item_cache(self):
+        self.item_cache = None
+        self.item_cache_keys = {}
+
+    def get_item_cache_stats(self):
+        if self.item_cache is None:
+            return None
+        return self.item_cache.get_stats()
+
+    # Entries are keyed on the index values stored in the row, with their
+    # types, so writes carrying the very same values can evict them alone.
+    # A lookup by values SQLite converts or collates ("1" for 1) always
+    # misses, it still finds the row.
+    @staticmethod
+    def get_item_cache_key(table_name, index_items):
+        return (table_name, tuple((k, type(v), v) for k, v in index_items))
+
+    def find_cached_item(self, class_type, index_dict):
+        table_name = class_type.TABLE_NAME
+        key = SqliteDao.get_item_cache_key(table_name, index_dict.items())
+        cached = self.item_cache.get(key)
+        if cached is MISSING:
+            self.item_cache_keys.setdefault(table_name, set()).add(tuple(index_dict))
+            generation = self.item_cache.get_generation(table_name)
+            query, values = self.compile_search(
+                table_name, index_dict, None, None, 1, None, True
+            )
+            cached = self.fetch_query(
+                query,
+                values,
+                "tuple",
+                lambda cursor, rows: (tuple(d[0] for d in cursor.description), rows),
+            )
+            names, rows = cached
+            if not rows:
+                # Misses are not cached, an insert never has to look for them
+                return None
+            cached = (names, rows[0])
+            stored = dict(zip(names, rows[0]))
+            key = SqliteDao.get_item_cache_key(
+                table_name, [(k, stored[k]) for k in index_dict]
+            )
+            self.item_cache.put(key, cached, table_name, generation)
+        # Each hit builds a fresh item, callers may modify what they get
+        return SqliteDao.build_item(class_type, *cached)
+
+    # Cache search_table results, keyed by query text, values and row format,
+    # bounded by entry count and by an estimate of their size in memory:
+    #   dao.enable_result_cache(max_entries=256, max_bytes=32 * 1024 * 1024)
+    # Writes through this dao drop the cached results of their table. Commits
+    # from other connections or processes bump PRAGMA data_version, checked
+    # on every lookup, which drops every cached result.
+    def enable_result_cache(
+        self, max_entries=256, max_bytes=16 * 1024 * 1024, ttl=None
+    ):
+        self.result_cache = LRUCache(max_entries, ttl, max_bytes)
+        self.data_version = None
+
+    def disable_result_cache(self):
+        self.result_cache = None
+
+    def get_result_cache_stats(self):
+        if self.result_cache is None:
+            return None
+        return self.result_cache.get_stats()
+
+    def fetch_cached_result(self, table_name, query, values, row_format):
+        self.check_data_version()
+        key = (query, tuple(values), row_format)
+        rows = self.result_cache.get(key)
+        if rows is MISSING:
+            generation = self.result_cache.get_generation(table_name)
+            rows = self.fetch_query(
+                query,
+                values,
+                row_format,
+                lambda cursor, rows: self.format_rows(cursor, rows, row_format),
+            )
+            self.result_cache.put(
+                key, rows, table_name, generation, estimate_size(rows)
+            )
+        # Copies keep callers from modifying the cached result
+        if row_format == "dict":
+            return [dict(row) for row in rows]
+        return list(rows)
+
+    def check_data_version(self):
+        cursor = self.conn.execute("PRAGMA data_version")
+        version = cursor.fetchone()[0]
         cursor.close()
+        if version != self.data_version:
+            if self.data_version is not None:
+                self.result_cache.clear()
+            self.data_version = version
+
+    # Called after every write to table_name, with the search dict and update
+    # dict of the write when it has them. Inserts leave cached items alone,
+    # they never change a row that already exists.
+    def invalidate_caches(
+        self, table_name, search_dict=None, update_dict=None, inserted=False
+    ):
+        if self.item_cache is None and self.result_cache is None:
+            return
+        if self.result_cache is not None:
+            self.result_cache.invalidate_tag(table_name)
+        evicted = None
+        if self.item_cache is not None and not inserted:
+            evicted = self.invalidate_items(table_name, search_dict, update_dict)
+        if self.conn.in_transaction:
+            # Readers may cache the committed rows again until commit
+            writes = self.uncommitted_writes.setdefault(table_name, [])
+            if writes is not None and not inserted:
+                if (
+                    evicted is None
+                    or len(writes) >= SqliteDao.UNCOMMITTED_EVICTION_LIMIT
+                ):
+                    self.uncommitted_writes[table_name] = None
+                else:
+                    writes.extend(evicted)
+
+    # search_keys are the columns the write matched rows on (an upsert's
+    # conflict keys), every column by default
+    def invalidate_rows(
+        self, table_name, keys, multiple_values, search_keys=None, inserted=False
+    ):
+        if self.item_cache is None or inserted:
+            self.invalidate_caches(table_name, inserted=inserted)
+            return
+        for values in multiple_values:
+            row = dict(zip(keys, values))
+            if search_keys is None:
+                self.invalidate_caches(table_name, row)
+                continue
+            search_dict = {k: row[k] for k in search_keys}
+            update_dict = {k: v for k, v in row.items() if k not in search_keys}
+            self.invalidate_caches(table_name, search_dict, update_dict)
+
+    # SQLite matches rows by column affinity and collation, Python by value,
+    # so only a plain search dict carrying exactly the values of cached
+    # entries (see get_item_cache_key) evicts those entries alone. Anything
+    # else evicts the whole table. update_dict catches updates that move a
+    # row to new index values. Returns the evicted keys, None for the table.
+    def invalidate_items(self, table_name, search_dict=None, update_dict=None):
+        key_sets = tuple(self.item_cache_keys.get(table_name, ()))
+        precise = (
+            search_dict
+            and not isinstance(search_dict, SearchDict)
+            and all(k in search_dict for keys in key_sets for k in keys)
+        )
+        evicted = []
+        if precise:
+            for keys in key_sets:
+                key = SqliteDao.get_item_cache_key(
+                    table_name, [(k, search_dict[k]) for k in keys]
+                )
+                if key not in self.item_cache:
+                    precise = False
+                    break
+                evicted.append(key)
+                if update_dict and any(k in update_dict for k in keys):
+                    moved = {**search_dict, **update_dict}
+                    evicted.append(
+                        SqliteDao.get_item_cache_key(
+                            table_name, [(k, moved[k]) for k in keys]
+                        )
+                    )
+        if not precise:
+            self.item_cache.invalidate_tag(table_name)
+            return None
+        for key in evicted:
+            self.item_cache.pop(key, table_name)
+        return evicted
+
+    def invalidate_uncommitted(self):
+        if not self.uncommitted_writes:
+            return
+        uncommitted_writes = self.uncommitted_writes
+        self.uncommitted_writes = {}
+        for table_name, writes in uncommitted_writes.items():
+            if self.result_cache is not None:
+                self.result_cache.invalidate_tag(table_name)
+            if self.item_cache is None:
+                continue
+            if writes is None:
+                self.item_cache.invalidate_tag(table_name)
+                continue
+            for key in writes:
+                self.item_cache.pop(key, table_name)
+
+    # ======================================== #
+    # QUERY ADVISOR                            #
+    # ======================================== #
+
+    # Record the plan of every distinct search_table, search_items,
+    # update_rows and delete_rows statement along with how often it runs
+    # and how long it takes, see get_advisor_report:
+    #   dao.enable_advisor()
+    #   ... run the workload ...
+    #   dao.get_advisor_report()["suggested_indexes"]
+    def enable_advisor(self):
+        if self.advisor is None:
+            self.advisor = QueryAdvisor()
+
+    def disable_advisor(self):
+        self.advisor = None
+
+    # Returns {"shapes": [...], "column_usage": {...}, "suggested_indexes": {...}}.
+    # shapes are sorted by cost, frequency times mean seconds, and list the
+    # SCAN steps of their plan. suggested_indexes holds an index_dict per
+    # table for create_table, covering the shapes that scan.
+    def get_advisor_report(self):
+        if self.advisor is None:
+            return None
+        tables = set(shape["table"] for shape in self.advisor.get_shapes())
+        existing = {table: self.get_indexes(table) for table in tables}
+        return {
+            "shapes": self.advisor.get_shapes(),
+            "column_usage": self.advisor.get_column_usage(),
+            "suggested_indexes": self.advisor.suggest_indexes(existing),
+        }
+
+    def advise(
+        self, kind, table_name, query, values, search_dict, order_by, group_by, run
+    ):
+        if not self.advisor.is_known(query):
+            filter_shape, _ = self.get_search_shape(search_dict)
+            self.advisor.add_shape(
+                kind,
+                table_name,
+                query,
+                filter_shape,
+                order_by,
+                group_by,
+                self.explain_query(query, values),
+            )
+        start = time.perf_counter()
+        result = run()
+        self.advisor.record(query, time.perf_counter() - start)
+        return result
 
-    # For backfilling purpose, fills multiple matching rows at the same time.
-    def update_rows(self, table_name, update_dict, search_dict):
-        extended_feature = isinstance(search_dict, SearchDict)
-        if not update_dict:
-            return
+    # Detail lines of EXPLAIN QUERY PLAN, run on the writer so tables
+    # created in an open transaction are visible.
+    def explain_query(self, query, values):
+        try:
+            cursor = self.conn.execute("EXPLAIN QUERY PLAN " + query, values)
+            plan = [row[3] for row in cursor.fetchall()]
+            cursor.close()
+        except sqlite3.Error as e:
+            plan = ["EXPLAIN failed: {}".format(e)]
+        return plan
+
+    # Index name -> indexed columns, including the automatic indexes behind
+    # PRIMARY KEY and UNIQUE constraints
+    def get_indexes(self, table_name):
         sanitize.validate_table_name(table_name)
         quoted_table_name = sanitize.quote_string(table_name)
-        query = f"UPDATE {quoted_table_name} SET "
-        set_strings = []
-        search_strings = []
-        value_strings = []
-        for k, v in update_dict.items():
-            set_strings.append("{}=?".format(k))
-            value_strings.append(v)
-        for k, v in search_dict.items():
-            self.populate_search_dict(
-                search_strings, value_strings, k, v, extended_feature
-            )
-        query += ", ".join(set_strings)
-        if search_strings:
-            query += " WHERE "
-            query += " AND ".join(search_strings)
-        cursor = self.conn.cursor()
-        cursor.execute(query, value_strings)
-        self.conn.commit()
-        cursor.close()
+        indexes = {}
+        with self.reader() as conn:
+            cursor = conn.execute(f"PRAGMA index_list({quoted_table_name})")
+            names = [row["name"] for row in cursor.fetchall()]
+            cursor.close()
+            for name in names:
+                quoted_index_name = sanitize.quote_string(name)
+                cursor = conn.execute(f"PRAGMA index_info({quoted_index_name})")
+                indexes[name] = [row["name"] for row in cursor.fetchall()]
+                cursor.close()
+        return indexes
 
-    def delete_rows(self, table_name, search_dict):
-        extended_feature = isinstance(search_dict, SearchDict)
-        cursor = self.conn.cursor()
+    # ======================================== #
+    # INSTRUMENTATION                          #
+    # ======================================== #
+
+    # Time every statement the dao runs, with latency histograms per query,
+    # a slow query log on the "sqlitedao" logger and per statement events:
+    #   dao.enable_instrumentation(slow_query_ms=50)
+    #   dao.add_query_listener(lambda event: print(event["seconds"]))
+    #   dao.get_query_stats()
+    # Disabled, the hot paths only pay for an attribute check.
+    def enable_instrumentation(self, slow_query_ms=None, buckets=None):
+        instrumentation = Instrumentation(
+            None if slow_query_ms is None else slow_query_ms / 1000,
+            DEFAULT_BUCKETS if buckets is None else buckets,
+        )
+        if self.instrumentation is not None:
+            for callback in self.instrumentation.listeners:
+                instrumentation.add_listener(callback)
+        self.instrumentation = instrumentation
+        return instrumentation
+
+    def disable_instrumentation(self):
+        self.instrumentation = None
+
+    # callback(event) runs on the querying thread after each statement, see
+    # Instrumentation for the event keys. Exceptions it raises are logged.
+    def add_query_listener(self, callback):
+        if self.instrumentation is None:
+            self.enable_instrumentation()
+        self.instrumentation.add_listener(callback)
+
+    def remove_query_listener(self, callback):
+        if self.instrumentation is not None:
+            self.instrumentation.remove_listener(callback)
+
+    # query -> count, errors, rows, total/mean/max/p50/p99 seconds, histogram
+    def get_query_stats(self):
+        if self.instrumentation is None:
+            return None
+        return self.instrumentation.get_stats()
+
+    def measure(self, kind, query, values=(), many=False):
+        if self.instrumentation is None:
+            return nullcontext({})
+        return self.instrumentation.measure(kind, query, values, many)
+
+    # ======================================== #
+    # BULK IMPORT AND EXPORT                   #
+    # ======================================== #
+
+    # Column name -> declared type, in table order
+    def get_columns(self, table_name):
         sanitize.validate_table_name(table_name)
         quoted_table_name = sanitize.quote_string(table_name)
-        query = f"DELETE FROM {quoted_table_name}"
-        key_strings = []
-        value_strings = []
-        if len(search_dict) > 0:
-            query += " WHERE "
-            for k, v in search_dict.items():
-                self.populate_search_dict(
-                    key_strings, value_strings, k, v, extended_feature
-                )
-            query += " AND ".join(key_strings)
-        cursor.execute(query, value_strings)
-        self.conn.commit()
-        cursor.close()
+        with self.reader() as conn:
+            cursor = conn.execute(f"PRAGMA table_info({quoted_table_name})")
+            columns = {row["name"]: row["type"] for row in cursor.fetchall()}
+            cursor.close()
+        return columns
 
-    def populate_search_dict(self, key_strings, value_strings, k, v, extended_feature):
-        if extended_feature:
-            if SearchDict.is_comp(v):
-                key_strings.append("{} {} ?".format(k, v["operator"]))
-                value_strings.append(v["value"])
-            else:
-                key_strings.append("{} BETWEEN ? AND ?".format(k))
-                value_strings.extend([v["value_low"], v["value_high"]])
+    # target is a table name or a TableItem class. Values are converted with
+    # the class ALL_COLUMNS callables when present, else by declared column
+    # type. column_map renames source fields, fields that match no column are
+    # dropped and empty strings become NULL. on_error="skip" drops rows that
+    # fail to convert instead of raising. processes=N converts in a process
+    # pool while the calling thread keeps inserting. Returns counts, seconds
+    # and rows_per_second.
+    def import_csv(
+        self,
+        target,
+        path,
+        column_map=None,
+        batch_size=None,
+        on_error="raise",
+        processes=None,
+        **reader_kwargs,
+    ):
+        with open(path, newline="", encoding="utf-8") as f:
+            return self.import_records(
+                target,
+                csv.DictReader(f, **reader_kwargs),
+                column_map=column_map,
+                batch_size=batch_size,
+                on_error=on_error,
+                processes=processes,
+            )
+
+    # Same as import_csv for files holding one JSON object per line.
+    # Lines are parsed in the worker processes when processes is set.
+    def import_jsonl(
+        self,
+        target,
+        path,
+        column_map=None,
+        batch_size=None,
+        on_error="raise",
+        processes=None,
+    ):
+        with open(path, encoding="utf-8") as f:
+            return self.import_records(
+                target,
+                (line for line in f if line.strip()),
+                parse=transfer.parse_json_line,
+                column_map=column_map,
+                batch_size=batch_size,
+                on_error=on_error,
+                processes=processes,
+            )
+
+    def import_records(
+        self,
+        target,
+        records,
+        parse=None,
+        column_map=None,
+        batch_size=None,
+        on_error="raise",
+        processes=None,
+    ):
+        if on_error not in ("raise", "skip"):
+            raise ValueError("on_error must be 'raise' or 'skip'")
+        if batch_size is None:
+            batch_size = SqliteDao.INSERT_CHUNK_SIZE
+        if isinstance(target, str):
+            table_name = target
+            converters = None
         else:
-            key_strings.append("{} = ?".format(k))
-            value_strings.append(v)
+            table_name = target.TABLE_NAME
+            converters = dict(target.ALL_COLUMNS) or None
+        declared_columns = self.get_columns(table_name)
+        if not declared_columns:
+            raise ValueError("Table {} does not exist".format(table_name))
+        if converters is None:
+            converters = {
+                column: transfer.affinity_converter(declared_type)
+                for column, declared_type in declared_columns.items()
+            }
+        coercer = transfer.RowCoercer(converters, column_map)
+        coerce = partial(transfer.coerce_chunk, coercer, parse, on_error == "skip")
+        chunks = transfer.chunked(records, batch_size)
+        stats = {"read": 0, "skipped": 0}
+
+        def collect(results):
+            for rows, skipped in results:
+                stats["read"] += len(rows) + skipped
+                stats["skipped"] += skipped
+                yield from rows
+
+        start = time.perf_counter()
+        if processes:
+            # Two chunks per worker keep the workers busy while only a few
+            # chunks are held in memory
+            with multiprocessing.Pool(processes) as pool:
+                results = transfer.bounded_imap(pool, coerce, chunks, 2 * processes)
+                counts = self.insert_rows(table_name, collect(results), batch_size)
+        else:
+            counts = self.insert_rows(
+                table_name, collect(map(coerce, chunks)), batch_size
+            )
+        seconds = time.perf_counter() - start
+        stats.update(counts)
+        stats["seconds"] = seconds
+        stats["rows_per_second"] = stats["read"] / seconds if seconds else 0.0
+        return stats
+
+    # Like search_table, but returns column name -> values, read straight
+    # from the cursor without building a dict per row. INTEGER and REAL
+    # columns come back as array.array (or NumPy arrays when numpy is
+    # installed, unless use_numpy=False), other columns as lists. A numeric
+    # column holding NULLs or mismatched values falls back to a list.
+    def search_columns(
+        self,
+        table_name,
+        search_dict,
+        columns=None,
+        order_by=None,
+        limit=None,
+        offset=None,
+        desc=True,
+        use_numpy=None,
+        batch_size=None,
+    ):
+        if use_numpy is None:
+            use_numpy = transfer.numpy is not None
+        elif use_numpy and transfer.numpy is None:
+            raise ImportError("use_numpy requires numpy to be installed")
+        if batch_size is None:
+            batch_size = SqliteDao.ITER_BATCH_SIZE
+        declared_columns = self.get_columns(table_name)
+        query, values = self.compile_search(
+            table_name, search_dict, order_by, None, limit, offset, desc, columns
+        )
+        with self.reader() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            try:
+                with self.measure("read", query, values):
+                    cursor.execute(query, values)
+                names = [d[0] for d in cursor.description]
+                containers = [
+                    transfer.column_container(declared_columns.get(name))
+                    for name in names
+                ]
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for index, column_values in enumerate(zip(*rows)):
+                        containers[index] = transfer.extend_column(
+                            containers[index], column_values
+                        )
+            finally:
+                cursor.close()
+        if use_numpy:
+            containers = [transfer.to_numpy(c) for c in containers]
+        return dict(zip(names, containers))
+
+    # Stream matching rows to dest (a path or file object) as "csv" or
+    # "jsonl", batch_size rows at a time. columns selects and orders the
+    # exported columns. compress="gzip" (implied by a .gz path) compresses
+    # the output. Returns the number of rows written.
+    def export(
+        self,
+        table_name,
+        search_dict=None,
+        fmt="csv",
+        dest=None,
+        columns=None,
+        compress=None,
+        order_by=None,
+        desc=True,
+        batch_size=None,
+    ):
+        if fmt not in ("csv", "jsonl"):
+            raise ValueError("fmt must be 'csv' or 'jsonl'")
+        if dest is None:
+            raise ValueError("export needs a destination path or file object")
+        if batch_size is None:
+            batch_size = SqliteDao.ITER_BATCH_SIZE
+        query, values = self.compile_search(
+            table_name, search_dict or {}, order_by, desc=desc, columns=columns
+        )
+        written = 0
+        with transfer.open_output(dest, compress) as out, self.reader() as conn:
+            with self.measure("read", query, values):
+                cursor = conn.execute(query, values)
+            try:
+                names = [d[0] for d in cursor.description]
+                if fmt == "csv":
+                    writer = csv.writer(out)
+                    writer.writerow(names)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    if fmt == "csv":
+                        writer.writerows(rows)
+                    else:
+                        out.writelines(
+                            [
+                                json.dumps(
+                                    dict(zip(names, row)), default=transfer.json_default
+                                )
+                                + "\n"
+                                for row in rows
+                            ]
+                        )
+                    written += len(rows)
+            finally:
+                cursor.close()
+        return written
 
     # ======================================== #
     # ACCOMODATE TABLE ITEMS                   #
@@ -318,19 +1973,51 @@ class SqliteDao:
 
     def insert_item(self, table_item, update_if_duplicate=False):
         try:
-            self.insert_row(table_item.get_table(), table_item.get_row_tuple())
+            # Slotted items hand out a live view, insert_row takes a dict
+            self.insert_row(table_item.get_table(), dict(table_item.get_row_tuple()))
         except DuplicateError:
-            if update_if_duplicate:
-                self.update_item(table_item)
-            else:
+            if not update_if_duplicate:
                 raise
+            # The stored row may differ from what the item was loaded with,
+            # so every column is written whatever the item's dirty set
+            update_dict, search_dict = SqliteDao.get_item_update(table_item, True)
+            self.update_row(table_item.get_table(), update_dict, search_dict)
+        table_item.mark_clean()
 
     def insert_items(self, table_items):
         if len(set([e.TABLE_NAME for e in table_items])) > 1:
             raise ValueError("Items updated should be of the same type")
-        self.insert_rows(
+        counts = self.insert_rows(
             table_items[0].get_table(), [item.get_row_tuple() for item in table_items]
         )
+        # With duplicates skipped there is no telling which items match a row
+        if not counts["ignored"]:
+            for item in table_items:
+                item.mark_clean()
+
+    def upsert_item(self, table_item, update_columns=None):
+        return self.upsert_items([table_item], update_columns)
+
+    def upsert_items(self, table_items, update_columns=None):
+        if not table_items:
+            return 0
+        if not table_items[0].INDEX_KEYS:
+            raise NoIndexError(
+                "This table does not have index keys, and cannot upsert items"
+            )
+        if len(set([e.TABLE_NAME for e in table_items])) > 1:
+            raise ValueError("Items updated should be of the same type")
+        written = self.upsert_rows(
+            table_items[0].get_table(),
+            (item.get_row_tuple() for item in table_items),
+            table_items[0].INDEX_KEYS,
+            update_columns,
+        )
+        # Partial updates leave the stored row unknown
+        if update_columns is None:
+            for item in table_items:
+                item.mark_clean()
+        return written
 
     # Find item based on a index only table_item, returns the full item if found
     def find_item(self, table_item):
@@ -338,42 +2025,184 @@ class SqliteDao:
             raise NoIndexError(
                 "This table does not have index keys specified, use get_items instead"
             )
-        result = self.search_table(table_item.get_table(), table_item.get_index_dict())
+        # Inside its own transaction a thread reads past the cache
+        if (
+            self.item_cache is not None
+            and self.transaction_owner != threading.get_ident()
+        ):
+            return self.find_cached_item(type(table_item), table_item.get_index_dict())
+        result = self.search_items(type(table_item), table_item.get_index_dict())
         if result:
-            return type(table_item)(result[0])
+            return result[0]
         return None
 
+    # row_format="row" hands each item the sqlite3.Row without copying it,
+    # for item classes that only index into row_tuple.
     def get_items(
-        self, class_type, search_dict, order_by=None, limit=None, offset=None, desc=True
+        self,
+        class_type,
+        search_dict,
+        order_by=None,
+        limit=None,
+        offset=None,
+        desc=True,
+        row_format="dict",
+    ):
+        if row_format not in ("dict", "row"):
+            raise ValueError("items can only be built from 'dict' or 'row' rows")
+        return self.search_items(
+            class_type, search_dict, order_by, limit, offset, desc, row_format
+        )
+
+    def iter_items(self, class_type, search_dict, **kwargs):
+        batches = self.iter_item_batches(class_type, search_dict, **kwargs)
+        try:
+            for batch in batches:
+                yield from batch
+        finally:
+            batches.close()
+
+    # Yields lists of clean items, one per fetchmany call
+    def iter_item_batches(
+        self,
+        class_type,
+        search_dict,
+        order_by=None,
+        limit=None,
+        offset=None,
+        desc=True,
+        batch_size=None,
+    ):
+        if batch_size is None:
+            batch_size = SqliteDao.ITER_BATCH_SIZE
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive integer")
+        query, values = self.compile_search(
+            class_type.TABLE_NAME, search_dict, order_by, None, limit, offset, desc
+        )
+        row_format = SqliteDao.get_item_row_format(class_type)
+        batches = self.iter_query(
+            query,
+            values,
+            row_format,
+            lambda cursor, rows: self.make_items(class_type, cursor, rows, row_format),
+            batch_size,
+        )
+        try:
+            yield from batches
+        finally:
+            batches.close()
+
+    def search_items(
+        self,
+        class_type,
+        search_dict,
+        order_by=None,
+        limit=None,
+        offset=None,
+        desc=True,
+        row_format="dict",
+        sort_each=False,
     ):
-        rows = self.search_table(
+        query, values = self.compile_search(
             class_type.TABLE_NAME,
             search_dict,
-            order_by=order_by,
-            limit=limit,
-            offset=offset,
-            desc=desc,
+            order_by,
+            None,
+            limit,
+            offset,
+            desc,
+            sort_each=sort_each,
+        )
+        row_format = SqliteDao.get_item_row_format(class_type, row_format)
+        run = partial(
+            self.fetch_query,
+            query,
+            values,
+            row_format,
+            lambda cursor, rows: self.make_items(class_type, cursor, rows, row_format),
+        )
+        if self.advisor is None:
+            return run()
+        return self.advise(
+            "search",
+            class_type.TABLE_NAME,
+            query,
+            values,
+            search_dict,
+            order_by,
+            None,
+            run,
         )
-        return [class_type(row) for row in rows]
 
+    # Classes with from_row_values (see SlottedTableItem) are built from
+    # plain cursor tuples, others from a dict or sqlite3.Row per row.
+    @staticmethod
+    def get_item_row_format(class_type, row_format="dict"):
+        if hasattr(class_type, "from_row_values"):
+            return "tuple"
+        return row_format
+
+    # Items come back marked clean, see TableItem.get_dirty_columns
+    def make_items(self, class_type, cursor, rows, row_format):
+        if row_format == "tuple":
+            names = tuple(d[0] for d in cursor.description)
+            build = class_type.from_row_values
+            items = [build(names, row) for row in rows]
+        elif row_format == "row":
+            items = [class_type(row) for row in rows]
+        else:
+            items = [class_type(TrackedRow(row)) for row in rows]
+        for item in items:
+            item.mark_clean()
+        return items
+
+    # Keyset pagination over INDEX_KEYS. last_item is the last item of the
+    # previous page, or a token from encode_page_cursor, or None to start.
     def get_items_page(self, class_type, search_dict, last_item, desc=True, limit=50):
         if not isinstance(search_dict, SearchDict):
             raise ValueError(
                 "pagination search dict must be instance of sqlitedao.SearchDict"
             )
+        if not class_type.INDEX_KEYS:
+            raise NoIndexError(
+                "This table does not have index keys, and cannot be paginated"
+            )
         if last_item is not None:
-            for index in class_type.INDEX_KEYS:
-                curr_val = last_item.row_tuple[index]
-                comp_char = "<" if desc else ">"
-                search_dict.add_filter(index, curr_val, comp_char)
-        rows = self.search_table(
-            class_type.TABLE_NAME,
+            if isinstance(last_item, str):
+                last_values = SqliteDao.decode_page_cursor(last_item)
+            else:
+                row_tuple = last_item.get_row_tuple()
+                last_values = [row_tuple[index] for index in class_type.INDEX_KEYS]
+            # Copy so the caller can reuse their search dict for the next page
+            search_dict = SearchDict(search_dict).add_row_filter(
+                class_type.INDEX_KEYS, last_values, "<" if desc else ">"
+            )
+        return self.search_items(
+            class_type,
             search_dict,
             order_by=class_type.INDEX_KEYS,
             desc=desc,
             limit=limit,
+            sort_each=True,
         )
-        return [class_type(row) for row in rows]
+
+    # Opaque token for resuming get_items_page after the given item
+    @staticmethod
+    def encode_page_cursor(table_item):
+        row_tuple = table_item.get_row_tuple()
+        values = [row_tuple[index] for index in type(table_item).INDEX_KEYS]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    @staticmethod
+    def decode_page_cursor(token):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(token.encode()))
+        except ValueError:
+            raise ValueError("Invalid page cursor: {}".format(token))
+        if not isinstance(values, list):
+            raise ValueError("Invalid page cursor: {}".format(token))
+        return values
 
     def delete_item(self, table_item):
         if not table_item.INDEX_KEYS:
@@ -382,18 +2211,68 @@ class SqliteDao:
             )
         self.delete_rows(table_item.get_table(), table_item.get_index_dict())
 
+    # Deletes by INDEX_KEYS in chunked IN lists (see find_items), all in one
+    # transaction. Returns the number of rows deleted.
+    def delete_items(self, table_items, chunk_size=None):
+        if not table_items:
+            return 0
+        class_type = type(table_items[0])
+        if not class_type.INDEX_KEYS:
+            raise NoIndexError(
+                "This table does not have index keys, and cannot delete individual items, use delete_rows instead"
+            )
+        if len(set([e.TABLE_NAME for e in table_items])) > 1:
+            raise ValueError("Items deleted should be of the same type")
+        if chunk_size is None:
+            chunk_size = SqliteDao.FIND_CHUNK_SIZE
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be a positive integer")
+        table_name = class_type.TABLE_NAME
+        index_keys = tuple(class_type.INDEX_KEYS)
+        keys = []
+        for item in table_items:
+            index_dict = item.get_index_dict()
+            keys.append(tuple(index_dict[k] for k in index_keys))
+        keys = list(dict.fromkeys(keys))
+        deleted = 0
+        with self.transaction():
+            for start in range(0, len(keys), chunk_size):
+                chunk = keys[start : start + chunk_size]
+                chunk = SqliteDao.pad_chunk(chunk, chunk_size)
+                query = self.compile_delete_items(table_name, index_keys, len(chunk))
+                deleted += self.execute_write(
+                    query, [value for key in chunk for value in key]
+                )
+            self.invalidate_rows(table_name, index_keys, keys)
+        return deleted
+
+    def compile_delete_items(self, table_name, index_keys, size):
+        shape = ("delete_items", table_name, index_keys, size)
+
+        def build():
+            sanitize.validate_table_name(table_name)
+            quoted_table_name = sanitize.quote_string(table_name)
+            query = f"DELETE FROM {quoted_table_name} WHERE "
+            return query + SqliteDao.get_key_match(index_keys, size)
+
+        return self.get_statement(shape, build)
+
+    # Writes only the columns changed since the item was loaded, nothing at
+    # all when none changed. Returns whether an UPDATE was issued.
     def update_item(self, table_item):
         if not table_item.INDEX_KEYS:
             raise NoIndexError(
                 "This table does not have index keys, and cannot update individual items"
             )
-        self.update_row(
-            table_item.get_table(),
-            table_item.get_row_tuple(),
-            table_item.get_index_dict(),
-        )
+        update_dict, search_dict = SqliteDao.get_item_update(table_item)
+        if update_dict:
+            self.update_row(table_item.get_table(), update_dict, search_dict)
+        table_item.mark_clean()
+        return bool(update_dict)
 
-    def update_items(self, table_items):
+    # Items are grouped by their set of changed columns, see update_many for
+    # method. Returns the number of items written.
+    def update_items(self, table_items, method="executemany"):
         # Enforce index key and same table
         if not table_items[0].INDEX_KEYS:
             raise NoIndexError(
@@ -401,12 +2280,174 @@ class SqliteDao:
             )
         if len(set([e.TABLE_NAME for e in table_items])) > 1:
             raise ValueError("Items updated should be of the same type")
-        self.update_many(
-            table_items[0].get_table(),
-            [item.get_row_tuple() for item in table_items],
-            [item.get_index_dict() for item in table_items],
+        update_dicts = []
+        search_dicts = []
+        for item in table_items:
+            update_dict, search_dict = SqliteDao.get_item_update(item)
+            if update_dict:
+                update_dicts.append(update_dict)
+                search_dicts.append(search_dict)
+        if update_dicts:
+            self.update_many(
+                table_items[0].get_table(), update_dicts, search_dicts, method
+            )
+        for item in table_items:
+            item.mark_clean()
+        return len(update_dicts)
+
+    # Resolve index-only items with a few queries instead of one each: every
+    # chunk of keys is bound in a VALUES list next to its position, joined to
+    # the table and matched back by position, so SQLite decides what matches
+    # (affinity, collation) rather than Python equality. Returns the full
+    # items in input order, None where no row matched. Goes through the item
+    # cache when enabled.
+    def find_items(self, table_items, chunk_size=None):
+        if not table_items:
+            return []
+        class_type = type(table_items[0])
+        if not class_type.INDEX_KEYS:
+            raise NoIndexError(
+                "This table does not have index keys specified, use get_items instead"
+            )
+        if len(set([e.TABLE_NAME for e in table_items])) > 1:
+            raise ValueError("Items searched should be of the same type")
+        if chunk_size is None:
+            chunk_size = SqliteDao.FIND_CHUNK_SIZE
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be a positive integer")
+        table_name = class_type.TABLE_NAME
+        index_keys = tuple(class_type.INDEX_KEYS)
+        keys = []
+        for item in table_items:
+            index_dict = item.get_index_dict()
+            keys.append(tuple(index_dict[k] for k in index_keys))
+        use_cache = (
+            self.item_cache is not None
+            and self.transaction_owner != threading.get_ident()
+        )
+        # Equal keys are looked up once
+        unique = list(dict.fromkeys(keys))
+        found = [None] * len(unique)
+        missing = []
+        for position, key in enumerate(unique):
+            if use_cache:
+                cached = self.item_cache.get(
+                    SqliteDao.get_item_cache_key(table_name, zip(index_keys, key))
+                )
+                if cached is not MISSING:
+                    found[position] = cached
+                    continue
+            missing.append((position, key))
+        if missing and use_cache:
+            self.item_cache_keys.setdefault(table_name, set()).add(index_keys)
+            generation = self.item_cache.get_generation(table_name)
+        for start in range(0, len(missing), chunk_size):
+            chunk = SqliteDao.pad_chunk(missing[start : start + chunk_size], chunk_size)
+            query = self.compile_find_items(table_name, index_keys, len(chunk))
+            names, rows = self.fetch_query(
+                query,
+                [value for position, key in chunk for value in (position, *key)],
+                "tuple",
+                lambda cursor, rows: (tuple(d[0] for d in cursor.description), rows),
+            )
+            # The input position comes last, after the table columns
+            names = names[:-1]
+            stored = [names.index(k) for k in index_keys]
+            for row in rows:
+                position = row[-1]
+                if found[position] is not None:
+                    continue
+                row = row[:-1]
+                found[position] = (names, row)
+                if use_cache:
+                    key = [(k, row[i]) for k, i in zip(index_keys, stored)]
+                    self.item_cache.put(
+                        SqliteDao.get_item_cache_key(table_name, key),
+                        (names, row),
+                        table_name,
+                        generation,
+                    )
+        positions = {key: position for position, key in enumerate(unique)}
+        results = []
+        for key in keys:
+            cached = found[positions[key]]
+            results.append(
+                None if cached is None else SqliteDao.build_item(class_type, *cached)
+            )
+        return results
+
+    def compile_find_items(self, table_name, index_keys, size):
+        shape = ("find_items", table_name, index_keys, size)
+
+        def build():
+            sanitize.validate_table_name(table_name)
+            quoted_table_name = sanitize.quote_string(table_name)
+            # VALUES columns are named column1 (the position), column2, ...
+            row_value = "(" + ",".join(["?"] * (len(index_keys) + 1)) + ")"
+            match = " AND ".join(
+                "t.{} = k.column{}".format(key, i + 2)
+                for i, key in enumerate(index_keys)
+            )
+            # CROSS JOIN keeps the keys as the outer loop, seeking the table
+            return (
+                "SELECT t.*, k.column1 FROM (VALUES {}) AS k "
+                "CROSS JOIN {} AS t ON {}".format(
+                    ",".join([row_value] * size), quoted_table_name, match
+                )
+            )
+
+        return self.get_statement(shape, build)
+
+    # Condition matching rows whose index_keys equal any of size bound tuples
+    @staticmethod
+    def get_key_match(index_keys, size):
+        if len(index_keys) == 1:
+            return "{} IN ({})".format(index_keys[0], ",".join(["?"] * size))
+        # A bare VALUES list on the right of IN is scanned row by row against
+        # the table, the subquery lets sqlite seek the index
+        row_value = "(" + ",".join(["?"] * len(index_keys)) + ")"
+        return "({}) IN (SELECT * FROM (VALUES {}))".format(
+            ",".join(index_keys), ",".join([row_value] * size)
         )
 
+    # Pad a chunk of keys to a power of two by repeating its last key, so
+    # only a few statement shapes get cached.
+    @staticmethod
+    def pad_chunk(chunk, chunk_size):
+        size = 1
+        while size < len(chunk):
+            size *= 2
+        size = min(size, chunk_size)
+        return chunk + [chunk[-1]] * (size - len(chunk))
+
+    # Items come back marked clean
+    @staticmethod
+    def build_item(class_type, names, values):
+        if hasattr(class_type, "from_row_values"):
+            item = class_type.from_row_values(names, values)
+        else:
+            item = class_type(TrackedRow(zip(names, values)))
+        item.mark_clean()
+        return item
+
+    # SET holds the dirty columns, or every non-index column for items the
+    # dao never loaded (or with full_row). WHERE matches the index values of
+    # the loaded row, so index columns can be changed as well.
+    @staticmethod
+    def get_item_update(table_item, full_row=False):
+        row_tuple = table_item.get_row_tuple()
+        if full_row:
+            dirty = None
+        else:
+            dirty = table_item.get_dirty_columns()
+        if dirty is None:
+            index_keys = type(table_item).INDEX_KEYS
+            dirty = [k for k in row_tuple.keys() if k not in index_keys]
+        update_dict = {k: row_tuple[k] for k in dirty}
+        if full_row:
+            return update_dict, table_item.get_index_dict()
+        return update_dict, table_item.get_clean_index_dict()
+
 
 class SearchDict(dict):
     def add_filter(self, column_name, value, operator="="):
@@ -424,6 +2465,38 @@ class SearchDict(dict):
             "value_high": value_high,
         }
 
+    # column IN (values), long lists bind as one JSON array so they never hit
+    # the parameter limit and can still seek on an index of column
+    def add_in(self, column_name, values):
+        self[column_name] = {
+            "statement_type": "in",
+            "values": list(values),
+            "negate": False,
+        }
+        return self
+
+    def add_not_in(self, column_name, values):
+        self[column_name] = {
+            "statement_type": "in",
+            "values": list(values),
+            "negate": True,
+        }
+        return self
+
+    # Row-value comparison, e.g. (year, month) > (2020, 12). Single-column
+    # keys compile to a plain comparison, both can seek on a matching index.
+    def add_row_filter(self, column_names, values, operator="="):
+        column_names = tuple(column_names)
+        if len(column_names) != len(values):
+            raise ValueError("row filter needs one value per column")
+        key = column_names[0] if len(column_names) == 1 else column_names
+        self[key] = {
+            "statement_type": "row_comparison",
+            "values": list(values),
+            "operator": operator,
+        }
+        return self
+
     @staticmethod
     def is_comp(val):
         return val["statement_type"] == "comparison"
@@ -449,6 +2522,8 @@ class ColumnDict(dict):
 
 
 class TableItem:
+    # Subclasses still get an instance __dict__ unless they declare slots too
+    __slots__ = ()
     TABLE_NAME = None  # Must be set to the table name in subclasses
     INDEX_KEYS = []  # Set to list of index columns in subclasses
     ALL_COLUMNS = {}  # Set to column name -> type mapping in subclasses
@@ -470,7 +2545,7 @@ class TableItem:
                     raise ValueError("ALL_COLUMNS must contain index fields")
                 if row_tuple[index] is None:
                     raise ValueError("index field must be populated")
-            self.row_tuple = row_tuple
+            self.row_tuple = TrackedRow(row_tuple)
         else:
             raise ValueError("Must pass in either a tuple object or field arguments")
 
@@ -490,6 +2565,305 @@ class TableItem:
         except KeyError as e:
             print("Row tuple does not contain index: {}".format(e))
 
+    # Mark the current values clean, get_dirty_columns reports changes since.
+    # The dao calls this whenever it loads, inserts or updates an item.
+    # TrackedRow and sqlite3.Row rows are kept as they are, other rows are
+    # snapshot into a copy.
+    def mark_clean(self):
+        row_tuple = self.get_row_tuple()
+        if isinstance(row_tuple, TrackedRow):
+            row_tuple.original = None
+            self.clean_row = row_tuple
+        elif isinstance(row_tuple, sqlite3.Row):
+            self.clean_row = row_tuple
+        else:
+            self.clean_row = {k: row_tuple[k] for k in row_tuple.keys()}
+
+    # Columns changed since mark_clean, None if the item was never marked
+    def get_dirty_columns(self):
+        clean_row = getattr(self, "clean_row", None)
+        if clean_row is None:
+            return None
+        row_tuple = self.get_row_tuple()
+        if row_tuple is clean_row:
+            if isinstance(row_tuple, TrackedRow):
+                return row_tuple.get_changed_columns()
+            # sqlite3.Row is read only
+            return []
+        # The row was replaced, compare with the values it had when clean
+        if isinstance(clean_row, TrackedRow):
+            clean_row = clean_row.get_clean_row()
+        elif isinstance(clean_row, sqlite3.Row):
+            clean_row = dict(clean_row)
+        return [
+            k
+            for k in row_tuple.keys()
+            if k not in clean_row or clean_row[k] != row_tuple[k]
+        ]
+
+    # Index values as of mark_clean, the current ones if never marked
+    def get_clean_index_dict(self):
+        clean_row = getattr(self, "clean_row", None)
+        if clean_row is None:
+            return self.get_index_dict()
+        if isinstance(clean_row, TrackedRow):
+            return {k: clean_row.get_clean_value(k) for k in type(self).INDEX_KEYS}
+        return {k: clean_row[k] for k in type(self).INDEX_KEYS}
+
+
+# Row dict of the items the dao builds. The first write to a key keeps its
+# previous value in original, so clean items hold no second copy of the row.
+class TrackedRow(dict):
+    __slots__ = ("original",)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.original = None
+
+    def __setitem__(self, key, value):
+        self.remember(key)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.remember(key)
+        super().__delitem__(key)
+
+    def pop(self, key, *default):
+        if key in self:
+            self.remember(key)
+        return super().pop(key, *default)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def popitem(self):
+        key, value = super().popitem()
+        self.remember_value(key, value)
+        return key, value
+
+    def clear(self):
+        for key in self.keys():
+            self.remember(key)
+        super().clear()
+
+    # Copies and pickles pass the keys to the constructor instead of
+    # setting them one by one, which would record them as changed
+    def __reduce__(self):
+        original = None if self.original is None else dict(self.original)
+        return (type(self), (dict(self),), (None, {"original": original}))
+
+    def remember(self, key):
+        self.remember_value(key, self.get(key, MISSING))
+
+    def remember_value(self, key, value):
+        original = self.original
+        if original is None:
+            original = self.original = {}
+        if key not in original:
+            original[key] = value
+
+    def get_clean_value(self, key):
+        if self.original and key in self.original:
+            return self.original[key]
+        return self[key]
+
+    def get_changed_columns(self):
+        original = self.original
+        if not original:
+            return []
+        return [
+            k
+            for k in self.keys()
+            if k in original and (original[k] is MISSING or original[k] != self[k])
+        ]
+
+    def get_clean_row(self):
+        clean_row = dict(self)
+        for key, value in (self.original or {}).items():
+            if value is MISSING:
+                clean_row.pop(key, None)
+            else:
+                clean_row[key] = value
+        return clean_row
+
+
+class SlottedItemMeta(type):
+    # Generates __slots__ from ALL_COLUMNS for each class that declares it
+    def __new__(mcs, name, bases, namespace):
+        columns = namespace.get("ALL_COLUMNS")
+        if columns:
+            namespace["COLUMN_BITS"] = {c: 1 << i for i, c in enumerate(columns)}
+        if columns and "__slots__" not in namespace:
+            inherited = set()
+            for base in bases:
+                for klass in base.__mro__:
+                    inherited.update(getattr(klass, "__slots__", ()))
+            for column in columns:
+                if not column.isidentifier():
+                    raise ValueError(
+                        "Column {} cannot be used as a slot name".format(column)
+                    )
+            namespace["__slots__"] = tuple(c for c in columns if c not in inherited)
+        return super().__new__(mcs, name, bases, namespace)
+
+
+# Declarative TableItem storing each column of ALL_COLUMNS in a slot:
+#
+#   class Player(SlottedTableItem):
+#       TABLE_NAME = "players"
+#       INDEX_KEYS = ["name"]
+#       ALL_COLUMNS = {"name": str, "position": str, "age": int}
+#
+# Items have no __dict__ and no stored row dict: row_tuple and get_row_tuple
+# are a live view over the slots, and the dao builds them straight from
+# cursor tuples.
+class SlottedTableItem(TableItem, metaclass=SlottedItemMeta):
+    # dirty_mask has the COLUMN_BITS of the columns written since mark_clean,
+    # None before the first mark_clean. clean_index keeps the clean value of
+    # index columns written since.
+    __slots__ = ("dirty_mask", "clean_index")
+    COLUMN_BITS = {}
+
+    def __init__(self, row_tuple=None, **kwargs):
+        if self.TABLE_NAME is None:
+            raise NotImplementedError("Subclasses must define TABLE_NAME")
+        self.dirty_mask = None
+        self.clean_index = None
+        ALL_COLUMNS = type(self).ALL_COLUMNS
+        if row_tuple:
+            present = row_tuple.keys()
+            for col in ALL_COLUMNS:
+                setattr(self, col, row_tuple[col] if col in present else None)
+        elif len(kwargs) and ALL_COLUMNS:
+            for col in ALL_COLUMNS:
+                setattr(self, col, None)
+            for key, val in kwargs.items():
+                if key in ALL_COLUMNS:
+                    setattr(self, key, ALL_COLUMNS[key](val))
+            for index in type(self).INDEX_KEYS:
+                if index not in ALL_COLUMNS:
+                    raise ValueError("ALL_COLUMNS must contain index fields")
+                if getattr(self, index) is None:
+                    raise ValueError("index field must be populated")
+        else:
+            raise ValueError("Must pass in either a tuple object or field arguments")
+
+    # Build an item from a cursor tuple and its column names, no dict involved
+    @classmethod
+    def from_row_values(cls, names, values):
+        item = cls.__new__(cls)
+        assigned, missing = get_slot_plan(cls, names)
+        # Skips the tracking __setattr__, the item is not marked yet
+        set_slot = object.__setattr__
+        set_slot(item, "dirty_mask", None)
+        set_slot(item, "clean_index", None)
+        for index, col in assigned:
+            set_slot(item, col, values[index])
+        for col in missing:
+            set_slot(item, col, None)
+        return item
+
+    def __setattr__(self, name, value):
+        bit = type(self).COLUMN_BITS.get(name)
+        if bit is not None:
+            mask = self.dirty_mask
+            if mask is not None and not mask & bit:
+                if name in type(self).INDEX_KEYS:
+                    if self.clean_index is None:
+                        self.clean_index = {}
+                    self.clean_index[name] = getattr(self, name)
+                self.dirty_mask = mask | bit
+        object.__setattr__(self, name, value)
+
+    @property
+    def row_tuple(self):
+        return SlottedRowView(self)
+
+    @row_tuple.setter
+    def row_tuple(self, row_tuple):
+        ALL_COLUMNS = type(self).ALL_COLUMNS
+        for key, val in row_tuple.items():
+            if key in ALL_COLUMNS:
+                setattr(self, key, val)
+
+    def get_index_dict(self):
+        return {k: getattr(self, k) for k in type(self).INDEX_KEYS}
+
+    def mark_clean(self):
+        self.dirty_mask = 0
+        self.clean_index = None
+
+    # Every column assigned since mark_clean, even to an equal value
+    def get_dirty_columns(self):
+        mask = self.dirty_mask
+        if mask is None:
+            return None
+        return [col for col, bit in type(self).COLUMN_BITS.items() if mask & bit]
+
+    def get_clean_index_dict(self):
+        if self.dirty_mask is None:
+            return self.get_index_dict()
+        clean_index = self.clean_index or {}
+        return {
+            k: clean_index[k] if k in clean_index else getattr(self, k)
+            for k in type(self).INDEX_KEYS
+        }
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, dict(self.get_row_tuple()))
+
+
+# Which cursor positions fill which slots, and which slots get no value,
+# computed once per item class and column list.
+@lru_cache(maxsize=256)
+def get_slot_plan(cls, names):
+    assigned = tuple(
+        (index, name) for index, name in enumerate(names) if name in cls.ALL_COLUMNS
+    )
+    missing = tuple(col for col in cls.ALL_COLUMNS if col not in names)
+    return assigned, missing
+
+
+# Dict interface over the slots of a SlottedTableItem, reads and writes go
+# straight to the item attributes.
+class SlottedRowView(MutableMapping):
+    __slots__ = ("item",)
+
+    def __init__(self, item):
+        self.item = item
+
+    def __getitem__(self, key):
+        if key not in type(self.item).ALL_COLUMNS:
+            raise KeyError(key)
+        return getattr(self.item, key)
+
+    def __setitem__(self, key, value):
+        if key not in type(self.item).ALL_COLUMNS:
+            raise KeyError(key)
+        setattr(self.item, key, value)
+
+    def __delitem__(self, key):
+        raise TypeError("Columns cannot be removed from a table item")
+
+    def __iter__(self):
+        return iter(type(self.item).ALL_COLUMNS)
+
+    def __len__(self):
+        return len(type(self.item).ALL_COLUMNS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
 
 class NoIndexError(Exception):
     pass
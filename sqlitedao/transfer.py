@@ -0,0 +1,186 @@
+# Helpers for streaming rows between files and tables.
+
+import base64
+import gzip
+import io
+import json
+import os
+from array import array
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Map a declared column type to a python converter using sqlite's
+# affinity rules. None means the value is stored as given.
+def affinity_converter(declared_type):
+    declared_type = (declared_type or "").upper()
+    if "INT" in declared_type:
+        return int
+    if "CHAR" in declared_type or "CLOB" in declared_type or "TEXT" in declared_type:
+        return str
+    if "BLOB" in declared_type or not declared_type:
+        return None
+    if "REAL" in declared_type or "FLOA" in declared_type or "DOUB" in declared_type:
+        return float
+    return to_numeric
+
+
+def to_numeric(value):
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+# Turns a parsed record into a row dict for the table. Lives at module level
+# so it can be pickled into worker processes.
+class RowCoercer:
+    def __init__(self, converters, column_map=None, null_values=("",)):
+        self.converters = converters
+        self.column_map = column_map or {}
+        self.null_values = null_values
+
+    def __call__(self, record):
+        row = {}
+        for key, value in record.items():
+            column = self.column_map.get(key, key)
+            if column not in self.converters:
+                continue
+            if value is None or value in self.null_values:
+                row[column] = None
+                continue
+            converter = self.converters[column]
+            row[column] = value if converter is None else converter(value)
+        return row
+
+
+# Coerce a chunk of records, returns (rows, skipped). parse turns a raw
+# record (e.g. a JSON line) into a dict first when given.
+def coerce_chunk(coercer, parse, skip_errors, records):
+    rows = []
+    skipped = 0
+    for record in records:
+        try:
+            if parse is not None:
+                record = parse(record)
+            rows.append(coercer(record))
+        except (ValueError, TypeError):
+            if not skip_errors:
+                raise
+            skipped += 1
+    return rows, skipped
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Like pool.imap, but submits at most window items ahead of the consumer.
+# pool.imap pulls the whole input into its task queue as fast as it can read.
+def bounded_imap(pool, func, iterable, window):
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def parse_json_line(line):
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("JSON line is not an object: {}".format(line[:80]))
+    return record
+
+
+# Blobs are written to JSON as base64 text
+def json_default(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode("ascii")
+    raise TypeError("{} is not JSON serializable".format(type(value).__name__))
+
+
+# Yields a text stream writing to dest, a path or a file object. File
+# objects passed in are flushed but left open for the caller.
+@contextmanager
+def open_output(dest, compress=None):
+    if compress not in (None, "gzip"):
+        raise ValueError("compress must be None or 'gzip'")
+    if isinstance(dest, (str, os.PathLike)):
+        if compress == "gzip" or os.fspath(dest).endswith(".gz"):
+            out = gzip.open(dest, "wt", encoding="utf-8", newline="")
+        else:
+            out = open(dest, "w", encoding="utf-8", newline="")
+        with out:
+            yield out
+        return
+    if compress == "gzip":
+        with gzip.GzipFile(fileobj=dest, mode="wb") as binary:
+            out = io.TextIOWrapper(binary, encoding="utf-8", newline="")
+            try:
+                yield out
+            finally:
+                out.flush()
+                out.detach()
+        return
+    if isinstance(dest, (io.RawIOBase, io.BufferedIOBase)):
+        out = io.TextIOWrapper(dest, encoding="utf-8", newline="")
+        try:
+            yield out
+        finally:
+            # Detach so the wrapper never closes the caller's file
+            out.flush()
+            out.detach()
+        return
+    yield dest
+    dest.flush()
+
+
+# Typed containers for columnar results: array.array for INTEGER and REAL
+# affinity, plain lists for everything else.
+def column_container(declared_type):
+    converter = affinity_converter(declared_type)
+    if converter is int:
+        return array("q")
+    if converter is float:
+        return array("d")
+    return []
+
+
+# Append a column slice, falling back to a list when a value (NULL, or a
+# value stored against the column affinity) does not fit the array type.
+def extend_column(container, values):
+    if isinstance(container, array):
+        try:
+            container.extend(array(container.typecode, values))
+            return container
+        except (TypeError, OverflowError):
+            container = container.tolist()
+    container.extend(values)
+    return container
+
+
+def to_numpy(container):
+    if isinstance(container, array):
+        dtype = numpy.int64 if container.typecode == "q" else numpy.float64
+        return numpy.frombuffer(container, dtype=dtype)
+    return container
@@ -0,0 +1,73 @@
+"""
+
+Test query plan capture and index suggestions
+
+"""
+
+from sqlitedao import SearchDict
+from .dao_test import prepopulated_dao
+from .dao_test import TEST_TABLE_NAME
+from .item_test import PlayerX
+
+
+def test_advisor_disabled_by_default(xdao):
+    assert xdao.get_advisor_report() is None
+    xdao.search_table(TEST_TABLE_NAME, {})
+    xdao.enable_advisor()
+    assert xdao.get_advisor_report()["shapes"] == []
+
+
+def test_advisor_flags_scans(xdao):
+    xdao.enable_advisor()
+    for age in [40, 45, 50]:
+        xdao.search_table(TEST_TABLE_NAME, SearchDict().add_filter("age", age, ">"))
+    xdao.find_item(PlayerX(name="LeBron James"))
+    xdao.update_rows(
+        TEST_TABLE_NAME,
+        {"height": "6-7"},
+        SearchDict().add_filter("position", "SG").add_filter("age", 50, "<"),
+    )
+    xdao.delete_rows(TEST_TABLE_NAME, {"name": "Nobody"})
+    report = xdao.get_advisor_report()
+    shapes = {(s["kind"], s["count"]): s for s in report["shapes"]}
+    assert set(shapes) == {("search", 3), ("search", 1), ("update", 1), ("delete", 1)}
+    assert shapes[("search", 3)]["scans"]
+    assert not shapes[("search", 1)]["scans"]
+    assert not shapes[("delete", 1)]["scans"]
+    assert shapes[("update", 1)]["scans"]
+    costs = [s["cost"] for s in report["shapes"]]
+    assert costs == sorted(costs, reverse=True)
+    usage = report["column_usage"][TEST_TABLE_NAME]
+    assert usage[0] == {"column": "age", "operator": ">", "count": 3}
+    assert report["suggested_indexes"] == {
+        TEST_TABLE_NAME: {
+            "advised_age": ["age"],
+            "advised_position_age": ["position", "age"],
+        }
+    }
+
+
+def test_advisor_suggestions_accepted_by_create_table(xdao):
+    xdao.enable_advisor()
+    search = SearchDict().add_filter("position", "SG")
+    xdao.search_table(TEST_TABLE_NAME, search, order_by=["age"])
+    suggested = xdao.get_advisor_report()["suggested_indexes"][TEST_TABLE_NAME]
+    # The index serves the filter and the sort
+    assert suggested == {"advised_position_age": ["position", "age"]}
+    # The table exists, only the indexes get created
+    xdao.create_table(TEST_TABLE_NAME, {"name": "text"}, suggested)
+    assert xdao.get_advisor_report()["suggested_indexes"] == {}
+    query, values = xdao.compile_search(TEST_TABLE_NAME, search, order_by=["age"])
+    plan = xdao.explain_query(query, values)
+    assert plan[0].startswith("SEARCH")
+
+
+def test_advisor_treats_in_as_equality(xdao):
+    xdao.enable_advisor()
+    search = SearchDict().add_in("position", ["SG", "PG"])
+    search.add_filter("age", 30, ">")
+    xdao.search_table(TEST_TABLE_NAME, search)
+    report = xdao.get_advisor_report()
+    assert report["suggested_indexes"] == {
+        TEST_TABLE_NAME: {"advised_position_age": ["position", "age"]}
+    }
@@ -0,0 +1,117 @@
+"""
+
+Test the asyncio facade
+
+"""
+
+from sqlitedao import AsyncSqliteDao, SearchDict, SqliteDao
+from .dao_test import prepopulated_dao
+from .dao_test import TEST_DB_NAME, TEST_TABLE_NAME
+from .item_test import Player, zion, harden
+from .slotted_item_test import SlottedPlayer
+import asyncio
+import time
+import pytest
+
+
+@pytest.fixture(name="adao")
+def async_dao(xdao):
+    adao = AsyncSqliteDao(xdao, max_pending=2)
+    yield adao
+    adao.close()
+
+
+def test_async_search_and_items(adao):
+    async def scenario():
+        rows = await adao.search_table(TEST_TABLE_NAME, {}, order_by=["age"])
+        assert rows[0]["name"] == "Michael Jordan"
+        await adao.insert_items([zion, harden])
+        search = SearchDict().add_filter("age", 40, "<")
+        youth = await adao.get_items(Player, search, order_by=["age"])
+        assert youth[2] == zion
+        page = await adao.get_items_page(Player, SearchDict(), None, limit=2)
+        assert len(page) == 2
+        lebron = await adao.find_item(Player(name="LeBron James"))
+        lebron.grow()
+        await adao.update_items([lebron])
+        lebron = await adao.find_item(Player(name="LeBron James"))
+        assert lebron.age == 36
+        await adao.delete_rows(TEST_TABLE_NAME, {"name": "LeBron James"})
+        assert await adao.get_row_count(TEST_TABLE_NAME) == 4
+
+    asyncio.run(scenario())
+
+
+def test_async_back_pressure(adao):
+    async def scenario():
+        depths = []
+
+        def slow_count():
+            depths.append(adao.pending)
+            time.sleep(0.01)
+            return adao.dao.get_row_count(TEST_TABLE_NAME)
+
+        counts = await asyncio.gather(*[adao.run(slow_count) for _ in range(10)])
+        assert counts == [3] * 10
+        assert max(depths) <= 2
+        assert adao.pending == 0
+
+    asyncio.run(scenario())
+
+
+def test_async_iterators(adao):
+    async def scenario():
+        batches = []
+        async for batch in adao.iter_batches(TEST_TABLE_NAME, {}, batch_size=2):
+            batches.append(batch)
+        assert [len(b) for b in batches] == [2, 1]
+        names = [
+            p.name
+            async for p in adao.iter_items(Player, {}, order_by=["age"], batch_size=1)
+        ]
+        assert names == ["Michael Jordan", "Kobe Bryant", "LeBron James"]
+
+    asyncio.run(scenario())
+
+
+def test_async_iter_items_tuple_rows(xdao):
+    SqliteDao.terminate_instance(TEST_DB_NAME)
+    dao = SqliteDao.get_instance(TEST_DB_NAME, row_format="tuple")
+    adao = AsyncSqliteDao(dao)
+
+    async def scenario():
+        return [
+            p
+            async for p in adao.iter_items(
+                SlottedPlayer, {}, order_by=["age"], batch_size=2
+            )
+        ]
+
+    try:
+        players = asyncio.run(scenario())
+        assert [p.name for p in players] == [
+            "Michael Jordan",
+            "Kobe Bryant",
+            "LeBron James",
+        ]
+        assert players[0].get_dirty_columns() == []
+    finally:
+        adao.close()
+
+
+def test_async_lookups_inside_streams(xdao):
+    SqliteDao.terminate_instance(TEST_DB_NAME)
+    dao = SqliteDao.get_instance(TEST_DB_NAME, read_pool_size=1, pool_timeout=2)
+    adao = AsyncSqliteDao(dao)
+
+    async def scenario():
+        ages = []
+        async for row in adao.iter_table(TEST_TABLE_NAME, {}, order_by=["age"]):
+            player = await adao.find_item(Player(name=row["name"]))
+            ages.append(player.age)
+        return ages
+
+    try:
+        assert asyncio.run(scenario()) == [56, 41, 35]
+    finally:
+        adao.close()
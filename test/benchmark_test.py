@@ -0,0 +1,64 @@
+"""
+
+Smoke test the benchmark suite on a tiny dataset
+
+"""
+
+from benchmark.__main__ import main
+from benchmark.cases import CASES
+from benchmark.runner import compare, percentile, run_suite
+import json
+import os
+import sqlite3
+
+
+def test_benchmark_suite_runs(tmp_path):
+    report = run_suite(200, scale=0.01, db_dir=str(tmp_path))
+    assert report["meta"]["rows"] == 200
+    assert set(report["results"]) == set(case.name for case in CASES)
+    for result in report["results"].values():
+        assert result["samples"] >= 1
+        assert result["p50_seconds"] <= result["p99_seconds"] <= result["max_seconds"]
+        assert result["peak_bytes"] >= 0
+    assert report["results"]["find_item"]["rows"] == report["results"]["find_item"][
+        "samples"
+    ]
+    # Write cases undo their inserts, the database is reused as is
+    rerun = run_suite(200, scale=0.01, db_dir=str(tmp_path), cases=["insert_rows"])
+    assert rerun["meta"]["build_seconds"] == {}
+    assert all(row["status"] != "new" for row in compare(rerun, report))
+
+
+def test_benchmark_updates_restore_rows(tmp_path):
+    def read_ages():
+        path = os.path.join(str(tmp_path), "benchmark-200-0.db")
+        conn = sqlite3.connect(path)
+        try:
+            return conn.execute("SELECT name, age FROM players").fetchall()
+        finally:
+            conn.close()
+
+    run_suite(200, scale=0.01, db_dir=str(tmp_path), cases=["find_item"])
+    before = read_ages()
+    updates = ["update_item", "update_many", "update_many_temp_table"]
+    run_suite(200, scale=0.5, db_dir=str(tmp_path), cases=updates)
+    assert read_ages() == before
+
+
+def test_benchmark_compare_gates(tmp_path):
+    baseline = tmp_path / "baseline.json"
+    args = ["--rows", "100", "--scale", "0.01", "--cases", "find_item"]
+    assert main(args + ["--output", str(baseline)]) == 0
+    report = json.loads(baseline.read_text())
+    assert list(report["results"]) == ["find_item"]
+    report["results"]["find_item"]["p50_seconds"] = 1e-9
+    baseline.write_text(json.dumps(report))
+    assert main(args + ["--compare", str(baseline)]) == 1
+    assert main(args + ["--compare", str(baseline), "--threshold", "1e12"]) == 0
+
+
+def test_percentile():
+    ordered = list(range(1, 101))
+    assert percentile(ordered, 0.5) == 50
+    assert percentile(ordered, 0.99) == 99
+    assert percentile([3], 0.99) == 3
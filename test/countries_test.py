@@ -1,7 +1,13 @@
 import os
 import csv
+import gzip
+import io
+import json
+import multiprocessing
 import pytest
+from array import array
 from sqlitedao import SqliteDao, TableItem, ColumnDict, SearchDict
+from sqlitedao import transfer
 
 
 TEST_DB_NAME = "test.db"
@@ -99,6 +105,26 @@ def test_loading_from_csv(data, cdao):
     assert countries[0].name == "Russian Federation"
 
 
+def test_aggregate_countries(prepared_cdao):
+    rich = SearchDict().add_filter("gdp_per_capita", 50000, ">")
+    rows = prepared_cdao.aggregate(
+        "countries",
+        metrics={
+            "total_gdp": ("total", "gdp"),
+            "rich_gdp": ("sum", "gdp", rich),
+            "rich": ("count", "*", rich),
+            "largest": ("max", "area"),
+        },
+    )
+    countries = prepared_cdao.search_table("countries", {})
+    rich_gdp = [c["gdp"] for c in countries if c["gdp_per_capita"] > 50000]
+    assert rows[0]["total_gdp"] == pytest.approx(sum(c["gdp"] for c in countries))
+    assert rows[0]["rich_gdp"] == pytest.approx(sum(rich_gdp))
+    assert rows[0]["rich"] == len(rich_gdp)
+    assert rows[0]["largest"] == max(c["area"] for c in countries)
+    assert prepared_cdao.count_rows("countries", rich) == len(rich_gdp)
+
+
 def test_basic_item_pagination(prepared_cdao):
     countries = prepared_cdao.get_items_page(
         Country, SearchDict(), None, limit=10, desc=False
@@ -170,3 +196,155 @@ def test_item_pagination_with_multiple_criteria(prepared_cdao):
     beta_expected = ["France", "Germany", "Greece", "Greenland", "Iceland"]
     assert alpha_expected == [c.name for c in alpha]
     assert beta_expected == [c.name for c in beta]
+
+
+COUNTRY_COLUMN_MAP = {
+    "country": "name",
+    "Surface area (km2)": "area",
+    "Population in thousands (2017)": "population",
+    "GDP: Gross domestic product (million current US$)": "gdp",
+    "GDP per capita (current US$)": "gdp_per_capita",
+}
+
+
+@pytest.fixture(name="csv_path")
+def get_csv_path():
+    curr_path = os.path.abspath(__file__)
+    return os.path.abspath(os.path.join(curr_path, "..", "countries.csv"))
+
+
+def test_import_csv(csv_path, prepared_cdao):
+    expected = prepared_cdao.search_table("countries", {}, order_by=["name"])
+    prepared_cdao.delete_rows("countries", {})
+    with pytest.raises(ValueError):
+        prepared_cdao.import_csv(Country, csv_path, column_map=COUNTRY_COLUMN_MAP)
+    assert prepared_cdao.get_row_count("countries") == 0
+    stats = prepared_cdao.import_csv(
+        Country, csv_path, column_map=COUNTRY_COLUMN_MAP, on_error="skip"
+    )
+    assert stats["read"] == 229
+    assert stats["inserted"] == len(expected)
+    assert stats["skipped"] == 229 - len(expected)
+    assert stats["rows_per_second"] > 0
+    assert prepared_cdao.search_table("countries", {}, order_by=["name"]) == expected
+
+
+def test_import_jsonl_by_declared_types(cdao, tmp_path):
+    path = tmp_path / "countries.jsonl"
+    lines = [
+        '{"name": "Atlantis", "area": "1200", "gdp": 3}',
+        "",
+        '{"name": "Lemuria", "population": "7.5", "capital": "Nowhere"}',
+    ]
+    path.write_text("\n".join(lines) + "\n")
+    stats = cdao.import_jsonl("countries", str(path), batch_size=1)
+    assert stats["read"] == 2
+    assert stats["inserted"] == 2
+    atlantis = cdao.find_item(Country(name="Atlantis"))
+    assert atlantis.area == 1200.0
+    assert isinstance(atlantis.gdp, float)
+    assert cdao.find_item(Country(name="Lemuria")).population == 7.5
+
+
+def test_import_csv_with_process_pool(csv_path, cdao):
+    stats = cdao.import_csv(
+        Country,
+        csv_path,
+        column_map=COUNTRY_COLUMN_MAP,
+        on_error="skip",
+        batch_size=50,
+        processes=2,
+    )
+    assert stats["read"] == 229
+    assert cdao.get_row_count("countries") == stats["inserted"]
+    assert cdao.get_items(Country, {}, order_by=["area"])[0].name == "Russian Federation"
+
+
+def test_process_pool_pulls_a_bounded_window():
+    pulled = []
+
+    def chunks():
+        for i in range(20):
+            pulled.append(i)
+            yield [i]
+
+    with multiprocessing.Pool(2) as pool:
+        results = transfer.bounded_imap(pool, len, chunks(), 4)
+        for consumed, result in enumerate(results, 1):
+            assert result == 1
+            assert len(pulled) <= consumed + 3
+    assert len(pulled) == 20
+
+
+def test_export_csv(prepared_cdao, tmp_path):
+    large = SearchDict().add_filter("area", 1000000, ">")
+    path = tmp_path / "large.csv"
+    written = prepared_cdao.export(
+        "countries",
+        large,
+        dest=str(path),
+        columns=["name", "area"],
+        order_by=["area"],
+        batch_size=3,
+    )
+    with open(path, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert written == len(rows) == len(prepared_cdao.search_table("countries", large))
+    assert list(rows[0].keys()) == ["name", "area"]
+    assert rows[0]["name"] == "Russian Federation"
+
+
+def test_export_jsonl_gzip(prepared_cdao, tmp_path):
+    path = tmp_path / "countries.jsonl.gz"
+    written = prepared_cdao.export("countries", fmt="jsonl", dest=str(path))
+    assert written == prepared_cdao.get_row_count("countries")
+    with gzip.open(path, "rt") as f:
+        rows = [json.loads(line) for line in f]
+    assert len(rows) == written
+    assert set(rows[0].keys()) == set(Country.ALL_COLUMNS)
+
+
+def test_export_to_file_objects(prepared_cdao):
+    search = {"name": "Canada"}
+    text = io.StringIO()
+    assert prepared_cdao.export("countries", search, dest=text, columns=["name"]) == 1
+    assert text.getvalue().splitlines() == ["name", "Canada"]
+    binary = io.BytesIO()
+    prepared_cdao.export(
+        "countries", search, fmt="jsonl", dest=binary, compress="gzip"
+    )
+    assert not binary.closed
+    line = gzip.decompress(binary.getvalue()).decode()
+    assert json.loads(line)["name"] == "Canada"
+
+
+def test_search_columns(prepared_cdao):
+    large = SearchDict().add_filter("area", 1000000, ">")
+    result = prepared_cdao.search_columns(
+        "countries", large, columns=["name", "area"], order_by=["area"], use_numpy=False
+    )
+    rows = prepared_cdao.search_table("countries", large, order_by=["area"])
+    assert list(result.keys()) == ["name", "area"]
+    assert isinstance(result["area"], array)
+    assert result["area"].typecode == "d"
+    assert isinstance(result["name"], list)
+    assert list(result["area"]) == [r["area"] for r in rows]
+    assert result["name"][0] == "Russian Federation"
+
+
+def test_search_columns_with_nulls(cdao):
+    cdao.insert_rows(
+        "countries",
+        [{"name": "Atlantis", "area": 10.5}, {"name": "Lemuria", "area": None}],
+    )
+    result = cdao.search_columns("countries", {}, use_numpy=False)
+    assert set(result.keys()) == set(Country.ALL_COLUMNS)
+    assert result["area"] == [10.5, None]
+    assert result["gdp"] == [None, None]
+
+
+def test_search_columns_numpy(prepared_cdao):
+    numpy = pytest.importorskip("numpy")
+    result = prepared_cdao.search_columns("countries", {}, columns=["area"])
+    assert isinstance(result["area"], numpy.ndarray)
+    assert result["area"].dtype == numpy.float64
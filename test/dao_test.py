@@ -312,6 +312,66 @@ def test_groupby_with_limit(xdao):
     assert groupby_positions[0]["position"] == "SG"
 
 
+def test_aggregate(xdao):
+    rows = xdao.aggregate(
+        TEST_TABLE_NAME,
+        group_by=["position"],
+        metrics={
+            "players": ("count", "*"),
+            "oldest": ("max", "age"),
+            "mean_age": ("avg", "age"),
+            "over_50": ("count", "*", SearchDict().add_filter("age", 50, ">")),
+        },
+        order_by=["players"],
+    )
+    assert rows == [
+        {"position": "SG", "players": 2, "oldest": 56, "mean_age": 48.5, "over_50": 1},
+        {"position": "SF", "players": 1, "oldest": 35, "mean_age": 35.0, "over_50": 0},
+    ]
+    # Without group_by the whole filtered table is one group
+    rows = xdao.aggregate(
+        TEST_TABLE_NAME,
+        {"position": "SG"},
+        metrics={"total": ("sum", "age"), "names": ("count_distinct", "name")},
+    )
+    assert rows == [{"total": 97, "names": 2}]
+
+
+def test_aggregate_having_and_limit(xdao):
+    search = SearchDict().add_filter("age", 30, ">")
+    having = SearchDict().add_filter("players", 1, ">")
+    rows = xdao.aggregate(
+        TEST_TABLE_NAME,
+        search,
+        group_by=["position"],
+        metrics={"players": ("count", "*")},
+        having=having,
+    )
+    assert rows == [{"position": "SG", "players": 2}]
+    rows = xdao.aggregate(
+        TEST_TABLE_NAME, group_by=["position"], order_by=["position"], limit=1
+    )
+    assert rows == [{"position": "SG", "count": 2}]
+
+
+def test_aggregate_refuses_unknown_functions(xdao):
+    with pytest.raises(ValueError):
+        xdao.aggregate(TEST_TABLE_NAME, metrics={"x": ("random", "age")})
+    with pytest.raises(ValueError):
+        xdao.aggregate(TEST_TABLE_NAME, metrics={"x": ("sum", "*")})
+    with pytest.raises(ValueError):
+        xdao.aggregate(TEST_TABLE_NAME, metrics={"x": ("sum", "age; DROP")})
+    with pytest.raises(ValueError):
+        xdao.aggregate(TEST_TABLE_NAME, metrics={"x": "sum"})
+
+
+def test_count_rows(xdao):
+    assert xdao.count_rows(TEST_TABLE_NAME) == 3
+    assert xdao.count_rows(TEST_TABLE_NAME, {"position": "SG"}) == 2
+    search = SearchDict().add_filter("age", 100, ">")
+    assert xdao.count_rows(TEST_TABLE_NAME, search) == 0
+
+
 def test_orderby(xdao):
     rows = xdao.search_table(TEST_TABLE_NAME, {}, order_by=["age"])
     assert rows[0]["name"] == "Michael Jordan"
@@ -324,6 +384,18 @@ def test_orderby_with_limit(xdao):
     assert rows[1]["name"] == "Kobe Bryant"
 
 
+def test_orderby_direction_on_last_column(xdao):
+    # "ORDER BY position,age DESC", positions ascending then oldest first
+    rows = xdao.search_table(TEST_TABLE_NAME, {}, order_by=["position", "age"])
+    assert [r["name"] for r in rows] == [
+        "LeBron James",
+        "Michael Jordan",
+        "Kobe Bryant",
+    ]
+    query, _ = xdao.compile_search(TEST_TABLE_NAME, {}, order_by=["position", "age"])
+    assert query.endswith("ORDER BY position,age DESC")
+
+
 def test_orderby_groupby_conflict(xdao):
     groupby_positions = xdao.search_table(
         TEST_TABLE_NAME, {}, group_by=["position"], order_by=["age"]
@@ -379,3 +451,197 @@ def test_between_with_delete(xdao):
     assert not any([e["name"] == "Kobe Bryant" for e in rows])
     # Go lakers
     assert any([e["name"] == "LeBron James" for e in rows])
+
+
+def test_in_with_search(xdao):
+    search = SearchDict().add_in("name", ["Kobe Bryant", "LeBron James", "Nobody"])
+    rows = xdao.search_table(TEST_TABLE_NAME, search, order_by=["age"])
+    assert [e["name"] for e in rows] == ["Kobe Bryant", "LeBron James"]
+    search = SearchDict().add_not_in("position", ["SF"])
+    assert len(xdao.search_table(TEST_TABLE_NAME, search)) == 2
+    assert xdao.search_table(TEST_TABLE_NAME, SearchDict().add_in("age", [])) == []
+    search = SearchDict().add_not_in("age", [])
+    assert len(xdao.search_table(TEST_TABLE_NAME, search)) == 3
+
+
+def test_in_pads_to_few_shapes(xdao):
+    xdao.clear_statement_cache()
+    for count in [3, 4]:
+        names = ["Kobe Bryant"] + ["x{}".format(i) for i in range(count - 1)]
+        search = SearchDict().add_in("name", names)
+        assert len(xdao.search_table(TEST_TABLE_NAME, search)) == 1
+    assert xdao.get_statement_cache_stats()["misses"] == 1
+
+
+def test_long_in_list_binds_json(xdao):
+    names = ["LeBron James"] + ["x{}".format(i) for i in range(5000)]
+    query, values = xdao.compile_search(
+        TEST_TABLE_NAME, SearchDict().add_in("name", names)
+    )
+    assert "json_each" in query
+    assert len(values) == 1
+    assert any("USING INDEX" in step for step in xdao.explain_query(query, values))
+    rows = xdao.search_table(TEST_TABLE_NAME, SearchDict().add_in("name", names))
+    assert [e["name"] for e in rows] == ["LeBron James"]
+    # Values take the column affinity, as bound parameters do
+    xdao.insert_row(TEST_TABLE_NAME, {"name": "23", "position": "SG", "age": 23})
+    search = SearchDict().add_in("name", list(range(1000)))
+    assert [e["name"] for e in xdao.search_table(TEST_TABLE_NAME, search)] == ["23"]
+    ages = [str(i) for i in range(1000) if i != 41]
+    xdao.update_rows(
+        TEST_TABLE_NAME, {"height": "7-0"}, SearchDict().add_not_in("age", ages)
+    )
+    rows = xdao.search_table(TEST_TABLE_NAME, {"height": "7-0"})
+    assert [e["name"] for e in rows] == ["Kobe Bryant"]
+    xdao.delete_rows(TEST_TABLE_NAME, SearchDict().add_in("name", names))
+    assert xdao.get_row_count(TEST_TABLE_NAME) == 3
+    with pytest.raises(ValueError):
+        xdao.search_table(TEST_TABLE_NAME, SearchDict().add_in("name", [b"x"] * 200))
+
+
+def test_statement_cache_reuses_shape(xdao):
+    xdao.clear_statement_cache()
+    search = SearchDict().add_filter("age", 40, operator="<")
+    first = xdao.search_table(TEST_TABLE_NAME, search, order_by=["age"], limit=2)
+    search = SearchDict().add_filter("age", 50, operator="<")
+    second = xdao.search_table(TEST_TABLE_NAME, search, order_by=["age"], limit=5)
+    stats = xdao.get_statement_cache_stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+    assert len(first) == 1
+    assert len(second) == 2
+    # A different operator is a different shape
+    xdao.search_table(TEST_TABLE_NAME, SearchDict().add_filter("age", 50, ">"))
+    assert xdao.get_statement_cache_stats()["misses"] == 2
+
+
+def test_statement_cache_binds_values(xdao):
+    query_one, values_one = xdao.compile_search(
+        TEST_TABLE_NAME, {"position": "SG"}, limit=1, offset=1
+    )
+    query_two, values_two = xdao.compile_search(
+        TEST_TABLE_NAME, {"position": "SF"}, limit=3, offset=0
+    )
+    assert query_one == query_two
+    assert values_one == ["SG", 1, 1]
+    assert values_two == ["SF", 3, 0]
+
+
+def test_statement_cache_for_update_and_delete(xdao):
+    xdao.clear_statement_cache()
+    xdao.update_rows(TEST_TABLE_NAME, {"age": 1}, {"name": "Kobe Bryant"})
+    xdao.update_rows(TEST_TABLE_NAME, {"age": 2}, {"name": "LeBron James"})
+    xdao.delete_rows(TEST_TABLE_NAME, {"name": "Kobe Bryant"})
+    xdao.delete_rows(TEST_TABLE_NAME, {"name": "LeBron James"})
+    stats = xdao.get_statement_cache_stats()
+    assert stats["misses"] == 2
+    assert stats["hits"] == 2
+    assert xdao.get_row_count(TEST_TABLE_NAME) == 1
+
+
+def test_iter_table(xdao):
+    rows = list(xdao.iter_table(TEST_TABLE_NAME, {}, order_by=["age"], batch_size=1))
+    assert rows == xdao.search_table(TEST_TABLE_NAME, {}, order_by=["age"])
+    search = SearchDict().add_filter("age", 40, operator=">")
+    batches = list(xdao.iter_batches(TEST_TABLE_NAME, search, batch_size=1))
+    assert len(batches) == 2
+    assert all(len(batch) == 1 for batch in batches)
+
+
+def test_iter_table_closes_cursor(xdao):
+    rows = xdao.iter_table(TEST_TABLE_NAME, {}, batch_size=1)
+    assert next(rows)["name"] == "LeBron James"
+    rows.close()
+    # An open statement on the table would lock it against dropping
+    xdao.drop_table(TEST_TABLE_NAME)
+    assert not xdao.is_table_exist(TEST_TABLE_NAME)
+
+
+def test_batch_insert_from_generator(dao):
+    create_table_columns = {
+        "name": "text primary key",
+        "position": "text",
+        "age": "integer",
+        "height": "text",
+    }
+    dao.create_table(TEST_TABLE_NAME, create_table_columns)
+    rookies = ({"name": "Rookie {}".format(i), "age": 19} for i in range(25))
+    counts = dao.insert_rows(TEST_TABLE_NAME, rookies, chunk_size=10)
+    assert counts == {"inserted": 25, "ignored": 0}
+    assert dao.get_row_count(TEST_TABLE_NAME) == 25
+
+
+def test_batch_insert_mixed_keys(xdao):
+    rows = [
+        {"name": "Zion Williamson", "age": 20},
+        {"name": "James Harden", "position": "SG", "age": 30, "height": "6-5"},
+        {"name": "Ja Morant", "age": 21},
+        lebron,
+    ]
+    counts = xdao.insert_rows(TEST_TABLE_NAME, iter(rows), chunk_size=1)
+    assert counts == {"inserted": 3, "ignored": 1}
+    assert xdao.search_table(TEST_TABLE_NAME, {"name": "Ja Morant"})[0]["age"] == 21
+    assert xdao.insert_rows(TEST_TABLE_NAME, []) == {"inserted": 0, "ignored": 0}
+
+
+def test_upsert_rows_streams_in_chunks(xdao, monkeypatch):
+    pulled = []
+    written_after = []
+
+    def rows():
+        for age in range(5):
+            pulled.append(age)
+            name = "LeBron James" if age == 4 else "Rookie {}".format(age)
+            yield {"name": name, "age": age}
+
+    execute_write = xdao.execute_write
+
+    def record_write(query, values, many=False):
+        written_after.append(len(pulled))
+        return execute_write(query, values, many=many)
+
+    monkeypatch.setattr(xdao, "execute_write", record_write)
+    assert xdao.upsert_rows(TEST_TABLE_NAME, rows(), ["name"], chunk_size=2) == 5
+    assert written_after == [2, 4, 5]
+    assert xdao.get_row_count(TEST_TABLE_NAME) == 7
+    assert xdao.search_table(TEST_TABLE_NAME, {"name": "LeBron James"})[0]["age"] == 4
+
+
+@pytest.mark.parametrize("method", ["executemany", "temp_table"])
+def test_batch_update_mixed_shapes(xdao, method):
+    update_dicts = [{"age": 36}, {"position": "PG"}, {"age": 57}, {"age": 99}]
+    search_dicts = [
+        {"name": "LeBron James"},
+        {"name": "Kobe Bryant"},
+        {"name": "Michael Jordan"},
+        {"name": "Nobody"},
+    ]
+    stats = xdao.update_many(TEST_TABLE_NAME, update_dicts, search_dicts, method)
+    assert stats["affected"] == 3
+    assert stats["seconds"] >= 0
+    players = {p["name"]: p for p in xdao.search_table(TEST_TABLE_NAME, {})}
+    assert players["LeBron James"]["age"] == 36
+    assert players["Kobe Bryant"]["position"] == "PG"
+    assert players["Kobe Bryant"]["age"] == 41
+    assert players["Michael Jordan"]["age"] == 57
+    # Later pairs for the same row win
+    xdao.update_many(
+        TEST_TABLE_NAME,
+        [{"age": 1}, {"age": 2}],
+        [{"name": "LeBron James"}, {"name": "LeBron James"}],
+        method,
+    )
+    assert xdao.search_table(TEST_TABLE_NAME, {"name": "LeBron James"})[0]["age"] == 2
+    with pytest.raises(ValueError):
+        xdao.update_many(TEST_TABLE_NAME, update_dicts, search_dicts, "bulk")
+
+
+def test_batch_update_temp_table_matches_affinity(xdao):
+    # Text keys still find integer columns, as bound parameters would
+    stats = xdao.update_many(
+        TEST_TABLE_NAME, [{"position": "OLD"}], [{"age": "56"}], "temp_table"
+    )
+    assert stats["affected"] == 1
+    assert not xdao.conn.execute(
+        "SELECT name FROM sqlite_temp_master WHERE type='table'"
+    ).fetchall()
@@ -4,7 +4,14 @@ Testing more flexibility in table structure and items
 
 """
 
-from sqlitedao import SqliteDao, ColumnDict, TableItem, NoIndexError, DuplicateError
+from sqlitedao import (
+    SqliteDao,
+    ColumnDict,
+    SearchDict,
+    TableItem,
+    NoIndexError,
+    DuplicateError,
+)
 import os
 import pytest
 import uuid
@@ -229,3 +236,128 @@ def test_insert_items_for_multiple_primary_key_cols(ydao):
     with pytest.raises(DuplicateError) as e:
         dupmood = Mood(year=2020, month=12, day=26, mood="happy")
         ydao.insert_item(dupmood)
+
+
+def test_composite_keyset_pagination(ydao):
+    moods = [
+        Mood(year=year, month=month, day=day, mood="happy")
+        for year in [2020, 2021]
+        for month in [1, 12]
+        for day in [1, 2, 3]
+    ]
+    ydao.insert_items(moods)
+    search = SearchDict()
+    first = ydao.get_items_page(Mood, search, None, limit=4, desc=False)
+    second = ydao.get_items_page(Mood, search, first[-1], limit=4, desc=False)
+    assert search == {}
+    days = [(m.year, m.month, m.day) for m in first + second]
+    assert days == [
+        (2020, 1, 1),
+        (2020, 1, 2),
+        (2020, 1, 3),
+        (2020, 12, 1),
+        (2020, 12, 2),
+        (2020, 12, 3),
+        (2021, 1, 1),
+        (2021, 1, 2),
+    ]
+    latest = ydao.get_items_page(Mood, search, None, limit=2)
+    older = ydao.get_items_page(Mood, search, latest[-1], limit=2)
+    assert [(m.month, m.day) for m in older] == [(12, 1), (1, 3)]
+
+
+def test_keyset_pagination_seeks_index(ydao):
+    search = SearchDict().add_row_filter(["year", "month", "day"], [2020, 1, 1], ">")
+    query, values = ydao.compile_search(
+        "mood", search, order_by=Mood.INDEX_KEYS, limit=10, desc=False
+    )
+    assert "(year,month,day) > (?,?,?)" in query
+    plan = ydao.conn.execute("EXPLAIN QUERY PLAN " + query, values).fetchall()
+    assert any(step["detail"].startswith("SEARCH") for step in plan)
+
+
+def test_keyset_pagination_cursor_token(ydao):
+    ydao.insert_items(
+        [Mood(year=2020, month=1, day=day, mood="calm") for day in range(1, 6)]
+    )
+    first = ydao.get_items_page(Mood, SearchDict(), None, limit=2, desc=False)
+    token = SqliteDao.encode_page_cursor(first[-1])
+    assert isinstance(token, str)
+    second = ydao.get_items_page(Mood, SearchDict(), token, limit=2, desc=False)
+    assert [m.day for m in second] == [3, 4]
+    with pytest.raises(ValueError):
+        ydao.get_items_page(Mood, SearchDict(), "not a cursor", limit=2)
+
+
+def test_refute_pagination_for_no_index_table(dao):
+    with pytest.raises(NoIndexError):
+        dao.get_items_page(Relation, SearchDict(), None)
+
+
+def test_upsert_rows_for_multiple_primary_key_cols(ydao):
+    ydao.insert_item(Mood(year=2020, month=12, day=24, mood="happy"))
+    rows = [
+        {"year": 2020, "month": 12, "day": 24, "mood": "sad"},
+        {"year": 2020, "month": 12, "day": 25, "mood": "happy"},
+        {"year": 2020, "month": 12, "day": 26},
+    ]
+    ydao.upsert_rows("mood", rows, ["year", "month", "day"])
+    assert ydao.get_row_count("mood") == 3
+    assert ydao.find_item(Mood(year=2020, month=12, day=24)).mood == "sad"
+    assert ydao.find_item(Mood(year=2020, month=12, day=26)).mood is None
+    # Only key columns given, an existing row is left alone
+    ydao.upsert_row("mood", {"year": 2020, "month": 12, "day": 24}, Mood.INDEX_KEYS)
+    assert ydao.find_item(Mood(year=2020, month=12, day=24)).mood == "sad"
+    with pytest.raises(ValueError):
+        ydao.upsert_rows("mood", rows, ["year", "month", "week"])
+
+
+def test_find_items_for_multiple_primary_key_cols(ydao):
+    ydao.insert_items(
+        [Mood(year=2020, month=1, day=day, mood="calm") for day in range(1, 8)]
+    )
+    wanted = [Mood(year=2020, month=1, day=day) for day in [7, 9, 1, 7, 3]]
+    found = ydao.find_items(wanted, chunk_size=3)
+    assert [m.day if m else None for m in found] == [7, None, 1, 7, 3]
+    assert found[0] is not found[3]
+    query = ydao.compile_find_items("mood", ("year", "month", "day"), 4)
+    assert "FROM (VALUES (?,?,?,?),(?,?,?,?)," in query
+    binds = [0, 2020, 1, 1] * 4
+    plan = ydao.conn.execute("EXPLAIN QUERY PLAN " + query, binds).fetchall()
+    assert not any(step["detail"].startswith("SCAN mood") for step in plan)
+
+
+def test_find_items_match_like_find_item(xdao):
+    xdao.insert_item(Survey(id="1", answer1="yes", answer2=1))
+    # An int key on a text column is converted by sqlite, not compared as is
+    wanted = [Survey(id=1), Survey(id="2"), Survey(id="1")]
+    assert xdao.find_item(wanted[0]).answer1 == "yes"
+    found = xdao.find_items(wanted)
+    assert [s.id if s else None for s in found] == ["1", None, "1"]
+    # So does the column collation
+    xdao.conn.execute(
+        "CREATE TABLE codes (id TEXT COLLATE NOCASE PRIMARY KEY, answer1 TEXT, "
+        "answer2 INTEGER)"
+    )
+    xdao.insert_row("codes", {"id": "abc", "answer1": "no", "answer2": 2})
+
+    class Code(Survey):
+        TABLE_NAME = "codes"
+
+    assert xdao.find_item(Code(id="ABC")).id == "abc"
+    found = xdao.find_items([Code(id="ABC"), Code(id="abd"), Code(id="aBc")])
+    assert [c.id if c else None for c in found] == ["abc", None, "abc"]
+
+
+def test_delete_items_for_multiple_primary_key_cols(ydao):
+    ydao.insert_items(
+        [Mood(year=2020, month=month, day=1, mood="calm") for month in range(1, 13)]
+    )
+    doomed = [Mood(year=2020, month=month, day=1) for month in [1, 3, 3, 5, 7]]
+    doomed.append(Mood(year=2019, month=1, day=1))
+    assert ydao.delete_items(doomed, chunk_size=3) == 4
+    assert ydao.get_row_count("mood") == 8
+    assert ydao.find_item(Mood(year=2020, month=3, day=1)) is None
+    assert ydao.delete_items([]) == 0
+    with pytest.raises(NoIndexError):
+        ydao.delete_items([Relation(name1="US", name2="Russia", relation=2)])
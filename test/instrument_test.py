@@ -0,0 +1,113 @@
+"""
+
+Test per query timings, the slow query log and query listeners
+
+"""
+
+from sqlitedao import SearchDict
+from sqlitedao.instrument import Instrumentation
+from .dao_test import prepopulated_dao
+from .dao_test import TEST_TABLE_NAME
+from .item_test import PlayerX
+import logging
+import pytest
+
+
+def test_instrumentation_disabled(xdao):
+    assert xdao.get_query_stats() is None
+    xdao.search_table(TEST_TABLE_NAME, {})
+    assert xdao.instrumentation is None
+
+
+def test_query_listener_events(xdao):
+    events = []
+    xdao.add_query_listener(events.append)
+    rows = xdao.search_table(TEST_TABLE_NAME, {"position": "SF"})
+    read = events[-1]
+    assert read["kind"] == "read"
+    assert read["query"].startswith("SELECT")
+    assert read["params"] == 1
+    assert read["rows"] == len(rows)
+    assert read["seconds"] >= 0
+    assert read["error"] is None
+    xdao.update_rows(TEST_TABLE_NAME, {"age": 40}, {"position": "SF"})
+    write, commit = events[-2:]
+    assert write["kind"] == "write"
+    assert write["params"] == 2
+    assert write["rows"] == len(rows)
+    assert commit["kind"] == "commit"
+    assert commit["query"] == "COMMIT"
+    xdao.remove_query_listener(events.append)
+    count = len(events)
+    xdao.get_row_count(TEST_TABLE_NAME)
+    assert len(events) == count
+
+
+def test_query_stats(xdao):
+    xdao.enable_instrumentation(buckets=[0.5, 1.0])
+    for _ in range(3):
+        xdao.search_table(TEST_TABLE_NAME, SearchDict().add_filter("age", 30, ">"))
+    xdao.get_items(PlayerX, {})
+    stats = xdao.get_query_stats()
+    query, _ = xdao.compile_search(
+        TEST_TABLE_NAME, SearchDict().add_filter("age", 30, ">")
+    )
+    shape = stats[query]
+    assert shape["count"] == 3
+    assert shape["errors"] == 0
+    assert shape["rows"] > 0
+    assert shape["histogram"] == [(0.5, 3), (1.0, 0), (float("inf"), 0)]
+    assert shape["p50_seconds"] <= shape["max_seconds"] <= 0.5
+    assert shape["mean_seconds"] == pytest.approx(shape["total_seconds"] / 3)
+    xdao.instrumentation.reset()
+    assert xdao.get_query_stats() == {}
+
+
+def test_executemany_and_stream(xdao):
+    events = []
+    xdao.add_query_listener(events.append)
+    rows = [
+        {"name": str(i), "position": "C", "age": i, "height": "7-0"} for i in range(5)
+    ]
+    xdao.insert_rows(TEST_TABLE_NAME, rows)
+    insert = [e for e in events if e["kind"] == "write"][-1]
+    assert insert["params"] == 20
+    assert insert["rows"] == 5
+    batches = list(xdao.iter_batches(TEST_TABLE_NAME, {}, batch_size=2))
+    stream = events[-1]
+    assert stream["kind"] == "read"
+    assert stream["rows"] == sum(len(batch) for batch in batches)
+
+
+def test_slow_query_log(xdao, caplog):
+    xdao.enable_instrumentation(slow_query_ms=0)
+    with caplog.at_level(logging.WARNING, logger="sqlitedao"):
+        xdao.get_row_count(TEST_TABLE_NAME)
+    assert "Slow read" in caplog.text
+    assert "count(*)" in caplog.text
+    xdao.enable_instrumentation(slow_query_ms=10000)
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger="sqlitedao"):
+        xdao.get_row_count(TEST_TABLE_NAME)
+    assert caplog.text == ""
+
+
+def test_failing_query_and_listener(xdao, caplog):
+    def broken(event):
+        raise RuntimeError("listener bug")
+
+    events = []
+    xdao.add_query_listener(broken)
+    xdao.add_query_listener(events.append)
+    with caplog.at_level(logging.ERROR, logger="sqlitedao"):
+        assert xdao.get_row_count(TEST_TABLE_NAME) > 0
+    assert "listener bug" in caplog.text
+    with pytest.raises(Exception):
+        xdao.search_table("no_such_table", {})
+    assert events[-1]["error"] is not None
+    assert xdao.get_query_stats()[events[-1]["query"]]["errors"] == 1
+
+
+def test_instrumentation_buckets_validated():
+    with pytest.raises(ValueError):
+        Instrumentation(buckets=[1.0, 0.5])
@@ -0,0 +1,164 @@
+"""
+
+Test the find_item cache and its invalidation
+
+"""
+
+from sqlitedao import SearchDict, TableItem
+from sqlitedao.cache import LRUCache, MISSING
+from .dao_test import prepopulated_dao
+from .dao_test import TEST_TABLE_NAME
+from .item_test import PlayerX
+from .slotted_item_test import SlottedPlayer
+import pytest
+import time
+
+
+def test_lru_cache_eviction_and_ttl():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1, "t")
+    cache.put("b", 2, "t")
+    assert cache.get("a") == 1
+    cache.put("c", 3, "u")
+    # b was the least recently used
+    assert cache.get("b") is MISSING
+    assert cache.get_stats()["evictions"] == 1
+    cache.invalidate_tag("t")
+    assert cache.get("a") is MISSING
+    assert cache.get("c") == 3
+    expiring = LRUCache(ttl=0.01)
+    expiring.put("a", 1)
+    time.sleep(0.02)
+    assert expiring.get("a") is MISSING
+    with pytest.raises(ValueError):
+        LRUCache(max_entries=0)
+
+
+def test_lru_cache_rejects_stale_put():
+    cache = LRUCache()
+    generation = cache.get_generation("t")
+    cache.pop("a", "t")
+    cache.put("a", 1, "t", generation)
+    assert cache.get("a") is MISSING
+    cache.put("a", 1, "t", cache.get_generation("t"))
+    assert cache.get("a") == 1
+
+
+def test_find_item_cached(xdao):
+    assert xdao.get_item_cache_stats() is None
+    xdao.enable_item_cache(max_items=10)
+    lebron = xdao.find_item(PlayerX(name="LeBron James"))
+    again = xdao.find_item(PlayerX(name="LeBron James"))
+    assert lebron == again
+    assert lebron is not again
+    assert xdao.find_item(PlayerX(name="Nobody")) is None
+    stats = xdao.get_item_cache_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+    assert stats["size"] == 1
+    assert stats["hit_ratio"] == pytest.approx(1 / 3)
+    xdao.disable_item_cache()
+    assert xdao.get_item_cache_stats() is None
+
+
+def test_item_cache_invalidated_by_item_writes(xdao):
+    xdao.enable_item_cache()
+    lebron = xdao.find_item(PlayerX(name="LeBron James"))
+    lebron.age = 36
+    lebron.sync_tuple()
+    xdao.update_item(lebron)
+    assert xdao.find_item(PlayerX(name="LeBron James")).age == 36
+    kobe = xdao.find_item(PlayerX(name="Kobe Bryant"))
+    kobe.age = 42
+    kobe.sync_tuple()
+    xdao.update_items([kobe])
+    assert xdao.find_item(PlayerX(name="Kobe Bryant")).age == 42
+    xdao.delete_item(kobe)
+    assert xdao.find_item(PlayerX(name="Kobe Bryant")) is None
+    xdao.insert_item(kobe)
+    assert xdao.find_item(PlayerX(name="Kobe Bryant")).age == 42
+    # Precise evictions leave the other entries cached
+    assert xdao.get_item_cache_stats()["size"] == 2
+
+
+def test_item_cache_invalidated_by_row_writes(xdao):
+    xdao.enable_item_cache()
+    xdao.find_item(PlayerX(name="LeBron James"))
+    xdao.find_item(PlayerX(name="Michael Jordan"))
+    xdao.update_rows(
+        TEST_TABLE_NAME, {"position": "PG"}, SearchDict().add_filter("age", 40, ">")
+    )
+    assert xdao.get_item_cache_stats()["size"] == 0
+    assert xdao.find_item(PlayerX(name="Michael Jordan")).position == "PG"
+    xdao.update_rows(TEST_TABLE_NAME, {"name": "MJ"}, {"name": "Michael Jordan"})
+    assert xdao.find_item(PlayerX(name="Michael Jordan")) is None
+    assert xdao.find_item(PlayerX(name="MJ")).position == "PG"
+    xdao.delete_rows(TEST_TABLE_NAME, SearchDict().add_filter("age", 30, ">"))
+    assert xdao.find_item(PlayerX(name="MJ")) is None
+    xdao.upsert_row(
+        TEST_TABLE_NAME, {"name": "MJ", "position": "SG", "age": 56}, ["name"]
+    )
+    assert xdao.find_item(PlayerX(name="MJ")).age == 56
+    xdao.upsert_row(TEST_TABLE_NAME, {"name": "MJ", "age": 57}, ["name"])
+    assert xdao.find_item(PlayerX(name="MJ")).age == 57
+
+
+class User(TableItem):
+    TABLE_NAME = "users"
+    INDEX_KEYS = ["id"]
+    ALL_COLUMNS = {"id": int, "email": str, "name": str}
+
+
+@pytest.fixture(name="udao")
+def users_dao(xdao):
+    xdao.create_table(
+        "users",
+        {"id": "integer primary key", "email": "text unique", "name": "text"},
+    )
+    xdao.insert_rows("users", [{"id": 1, "email": "a@x", "name": "Ann"}])
+    xdao.enable_item_cache()
+    yield xdao
+
+
+def test_item_cache_writes_by_converted_values(udao):
+    assert udao.find_item(User(id=1)).row_tuple["name"] == "Ann"
+    # SQLite converts "1" for the INTEGER key, Python never matches it to 1
+    udao.update_rows("users", {"name": "Bob"}, {"id": "1"})
+    assert udao.find_item(User(id=1)).row_tuple["name"] == "Bob"
+    lookup = User({"id": "1", "email": None, "name": None})
+    assert udao.find_item(lookup).row_tuple["name"] == "Bob"
+    udao.update_rows("users", {"name": "Cid"}, {"id": 1})
+    assert udao.find_item(lookup).row_tuple["name"] == "Cid"
+    assert udao.find_item(User(id=1)).row_tuple["name"] == "Cid"
+
+
+def test_item_cache_upsert_on_other_conflict_keys(udao):
+    assert udao.find_item(User(id=1)).row_tuple["name"] == "Ann"
+    udao.upsert_row(
+        "users", {"id": 2, "email": "a@x", "name": "Bob"}, ["email"], ["name"]
+    )
+    assert udao.find_item(User(id=1)).row_tuple["name"] == "Bob"
+
+
+def test_item_cache_slotted_items(xdao):
+    xdao.enable_item_cache()
+    first = xdao.find_item(SlottedPlayer(name="LeBron James"))
+    second = xdao.find_item(SlottedPlayer(name="LeBron James"))
+    assert isinstance(second, SlottedPlayer)
+    assert first.get_row_tuple() == second.get_row_tuple()
+    assert xdao.get_item_cache_stats()["hits"] == 1
+
+
+def test_item_cache_transaction(xdao):
+    xdao.enable_item_cache()
+    xdao.find_item(PlayerX(name="LeBron James"))
+    with pytest.raises(RuntimeError):
+        with xdao.transaction():
+            xdao.update_rows(TEST_TABLE_NAME, {"age": 99}, {"name": "LeBron James"})
+            # The transaction sees its own write
+            assert xdao.find_item(PlayerX(name="LeBron James")).age == 99
+            raise RuntimeError("rollback")
+    assert xdao.find_item(PlayerX(name="LeBron James")).age == 35
+    with xdao.transaction():
+        xdao.update_rows(TEST_TABLE_NAME, {"age": 36}, {"name": "LeBron James"})
+    assert xdao.find_item(PlayerX(name="LeBron James")).age == 36
@@ -209,3 +209,145 @@ def test_get_items_offset(xdao):
 def test_find_item(xdao):
     lebron = xdao.find_item(Player(name="LeBron James"))
     assert lebron.height == "6-8.5"
+
+
+def test_iter_items(xdao):
+    xdao.insert_items([zion, harden])
+    search = SearchDict().add_filter("age", 40, "<")
+    youth = xdao.iter_items(PlayerX, search, order_by=["age"], batch_size=2)
+    assert not isinstance(youth, list)
+    youth = list(youth)
+    assert len(youth) == 3
+    assert youth[2] == zion
+
+
+def test_upsert_items(xdao):
+    lebron = xdao.find_item(Player(name="LeBron James"))
+    lebron.grow()
+    written = xdao.upsert_items([lebron, zion])
+    assert written == 2
+    assert xdao.get_row_count(TEST_TABLE_NAME) == 4
+    assert xdao.find_item(Player(name="LeBron James")).age == 36
+    assert xdao.find_item(Player(name="Zion Williamson")) == zion
+
+
+def test_upsert_selected_columns(xdao):
+    kobe = xdao.find_item(Player(name="Kobe Bryant"))
+    kobe.grow()
+    kobe.position = "SF"
+    kobe.sync_tuple()
+    xdao.upsert_item(kobe, update_columns=["age"])
+    kobe_now = xdao.find_item(Player(name="Kobe Bryant"))
+    assert kobe_now.age == 42
+    assert kobe_now.position == "SG"
+
+
+def test_dirty_columns(xdao):
+    lebron = xdao.find_item(PlayerX(name="LeBron James"))
+    assert lebron.get_dirty_columns() == []
+    lebron.grow()
+    assert lebron.get_dirty_columns() == ["age"]
+    assert PlayerX(name="Zion Williamson").get_dirty_columns() is None
+    statements = []
+    xdao.conn.set_trace_callback(statements.append)
+    assert xdao.update_item(lebron)
+    assert not xdao.update_item(lebron)
+    xdao.conn.set_trace_callback(None)
+    updates = [s for s in statements if s.startswith("UPDATE")]
+    assert updates == [
+        "UPDATE \"{}\" SET age=36 WHERE name='LeBron James'".format(TEST_TABLE_NAME)
+    ]
+    assert xdao.find_item(PlayerX(name="LeBron James")).age == 36
+
+
+def test_insert_duplicate_writes_full_row(xdao):
+    lebron = xdao.find_item(PlayerX(name="LeBron James"))
+    # The stored row moves away from the clean item
+    xdao.update_row(
+        TEST_TABLE_NAME, {"age": 40, "height": "7-0"}, {"name": "LeBron James"}
+    )
+    xdao.insert_item(lebron, update_if_duplicate=True)
+    stored = xdao.find_item(PlayerX(name="LeBron James"))
+    assert stored.age == 35
+    assert stored.height == "6-8.5"
+    assert lebron.get_dirty_columns() == []
+
+
+def test_dirty_tracking_keeps_no_copy(xdao):
+    lebron = xdao.find_item(PlayerX(name="LeBron James"))
+    assert lebron.clean_row is lebron.row_tuple
+    lebron.row_tuple["age"] = 36
+    assert lebron.get_dirty_columns() == ["age"]
+    lebron.row_tuple["age"] = 35
+    assert lebron.get_dirty_columns() == []
+    lebron.row_tuple |= {"age": 5}
+    assert lebron.get_dirty_columns() == ["age"]
+    assert xdao.update_item(lebron)
+    assert xdao.find_item(PlayerX(name="LeBron James")).age == 5
+    kobe = xdao.get_items(PlayerX, {"name": "Kobe Bryant"}, row_format="row")[0]
+    assert kobe.clean_row is kobe.row_tuple
+    assert kobe.get_dirty_columns() == []
+    # Items replacing their row are compared with the clean values
+    jordan = xdao.find_item(Player(name="Michael Jordan"))
+    jordan.grow()
+    assert jordan.get_dirty_columns() == ["age"]
+    assert jordan.get_clean_index_dict() == {"name": "Michael Jordan"}
+
+
+def test_dirty_index_column(xdao):
+    jordan = xdao.find_item(PlayerX(name="Michael Jordan"))
+    jordan.row_tuple["name"] = "MJ"
+    xdao.update_item(jordan)
+    assert xdao.find_item(PlayerX(name="Michael Jordan")) is None
+    assert xdao.find_item(PlayerX(name="MJ")).age == 56
+
+
+def test_update_items_grouped_by_changes(xdao):
+    players = xdao.get_items(PlayerX, {})
+    players[0].grow()
+    players[1].row_tuple["position"] = "C"
+    statements = []
+    xdao.conn.set_trace_callback(statements.append)
+    assert xdao.update_items(players) == 2
+    xdao.conn.set_trace_callback(None)
+    updates = sorted(s.split(" WHERE")[0] for s in statements if "UPDATE" in s)
+    assert updates == [
+        "UPDATE \"{}\" SET age={}".format(TEST_TABLE_NAME, players[0].age),
+        "UPDATE \"{}\" SET position='C'".format(TEST_TABLE_NAME),
+    ]
+    assert xdao.update_items(players) == 0
+
+
+def test_find_items(xdao):
+    wanted = [
+        PlayerX(name="Michael Jordan"),
+        PlayerX(name="Nobody"),
+        PlayerX(name="LeBron James"),
+    ]
+    found = xdao.find_items(wanted)
+    assert [p.age if p else None for p in found] == [56, None, 35]
+    assert found[0].get_dirty_columns() == []
+    assert xdao.find_items([]) == []
+    xdao.enable_item_cache()
+    xdao.find_item(PlayerX(name="Kobe Bryant"))
+    found = xdao.find_items(wanted + [PlayerX(name="Kobe Bryant")])
+    assert found[3].age == 41
+    assert xdao.get_item_cache_stats()["hits"] == 1
+    found = xdao.find_items(wanted)
+    assert xdao.get_item_cache_stats()["hits"] == 3
+
+
+def test_delete_items(xdao):
+    xdao.enable_item_cache()
+    kobe = xdao.find_item(PlayerX(name="Kobe Bryant"))
+    lebron = xdao.find_item(PlayerX(name="LeBron James"))
+    deleted = xdao.delete_items([kobe, lebron, PlayerX(name="Nobody")])
+    assert deleted == 2
+    assert xdao.get_row_count(TEST_TABLE_NAME) == 1
+    assert xdao.find_items([kobe, lebron]) == [None, None]
+
+
+def test_get_items_with_in(xdao):
+    search = SearchDict().add_in("position", ["SG", "C"])
+    players = xdao.get_items(PlayerX, search, order_by=["age"], desc=False)
+    assert [p.name for p in players] == ["Kobe Bryant", "Michael Jordan"]
@@ -0,0 +1,104 @@
+"""
+
+Test pooled read connections with a single writer
+
+"""
+
+from sqlitedao import SqliteDao, SearchDict, PoolTimeoutError
+from .dao_test import TEST_DB_NAME, TEST_TABLE_NAME, lebron, kobe, jordan
+from .item_test import Player
+from concurrent.futures import ThreadPoolExecutor
+import os
+import pytest
+
+
+@pytest.fixture(name="pdao")
+def pooled_dao():
+    if os.path.exists(TEST_DB_NAME):
+        os.remove(TEST_DB_NAME)
+    dao = SqliteDao.get_instance(TEST_DB_NAME, read_pool_size=2, pool_timeout=0.1)
+    dao.create_table(
+        TEST_TABLE_NAME,
+        {
+            "name": "text primary key",
+            "position": "text",
+            "age": "integer",
+            "height": "text",
+        },
+    )
+    dao.insert_rows(TEST_TABLE_NAME, [lebron, kobe, jordan])
+    yield dao
+    SqliteDao.terminate_instance(TEST_DB_NAME)
+    if os.path.exists(TEST_DB_NAME):
+        os.remove(TEST_DB_NAME)
+
+
+def test_pool_requires_file():
+    with pytest.raises(ValueError):
+        SqliteDao(":memory:", read_pool_size=2)
+
+
+def test_pooled_reads_across_threads(pdao):
+    search = SearchDict().add_filter("age", 40, operator=">")
+
+    def read(_):
+        return len(pdao.search_table(TEST_TABLE_NAME, search))
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        counts = list(executor.map(read, range(20)))
+    assert counts == [2] * 20
+    stats = pdao.get_pool_stats()
+    assert stats["size"] == 2
+    assert stats["open"] <= 2
+    assert stats["checkouts"] == 20
+    assert stats["avg_checkout_seconds"] >= 0
+
+
+def test_pooled_readers_are_read_only(pdao):
+    with pdao.read_pool.connection() as conn:
+        with pytest.raises(Exception):
+            conn.execute(f"DELETE FROM {TEST_TABLE_NAME}")
+    assert pdao.get_row_count(TEST_TABLE_NAME) == 3
+
+
+def test_transaction_reads_own_writes(pdao):
+    with pdao.transaction():
+        pdao.insert_item(Player(name="Zion Williamson", age=20))
+        assert pdao.find_item(Player(name="Zion Williamson")) is not None
+        # Readers only see committed data
+        with pdao.read_pool.connection() as conn:
+            count = conn.execute(f"SELECT count(*) FROM {TEST_TABLE_NAME}")
+            assert count.fetchone()[0] == 3
+    assert pdao.get_row_count(TEST_TABLE_NAME) == 4
+
+
+def test_batched_writes_visible_before_flush(pdao):
+    pdao.set_batch_commit(every=100)
+    pdao.insert_row(TEST_TABLE_NAME, {"name": "Zion Williamson", "age": 20})
+    rows = pdao.search_table(TEST_TABLE_NAME, {"name": "Zion Williamson"})
+    assert len(rows) == 1
+    pdao.flush()
+    checkouts = pdao.get_pool_stats()["checkouts"]
+    assert pdao.get_row_count(TEST_TABLE_NAME) == 4
+    assert pdao.get_pool_stats()["checkouts"] == checkouts + 1
+
+
+def test_pool_timeout(pdao):
+    first = pdao.read_pool.checkout()
+    second = pdao.read_pool.checkout()
+    with pytest.raises(PoolTimeoutError):
+        pdao.search_table(TEST_TABLE_NAME, {})
+    pdao.read_pool.checkin(first)
+    assert len(pdao.search_table(TEST_TABLE_NAME, {})) == 3
+    pdao.read_pool.checkin(second)
+    assert pdao.get_pool_stats()["waits"] == 0
+
+
+def test_nested_reads_reuse_the_thread_reader(pdao):
+    pdao.read_pool.size = 1
+    ages = []
+    for row in pdao.iter_table(TEST_TABLE_NAME, {}, order_by=["age"], batch_size=1):
+        ages.append(pdao.find_item(Player(name=row["name"])).age)
+    assert ages == [56, 41, 35]
+    assert pdao.get_pool_stats()["open"] == 1
+    assert pdao.get_pool_stats()["idle"] == 1
@@ -0,0 +1,107 @@
+"""
+
+Test PRAGMA profiles applied at connection time
+
+"""
+
+from sqlitedao import SqliteDao
+from .dao_test import TEST_DB_NAME, TEST_TABLE_NAME
+import os
+import sqlite3
+import pytest
+
+
+@pytest.fixture(name="wal_dao")
+def balanced_wal_dao():
+    if os.path.exists(TEST_DB_NAME):
+        os.remove(TEST_DB_NAME)
+    dao = SqliteDao.get_instance(
+        TEST_DB_NAME,
+        read_pool_size=2,
+        profile="balanced-wal",
+        pragmas={"page_size": 8192},
+    )
+    yield dao
+    SqliteDao.terminate_instance(TEST_DB_NAME)
+    for path in [TEST_DB_NAME, TEST_DB_NAME + "-wal", TEST_DB_NAME + "-shm"]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def test_profile_at_creation(wal_dao):
+    pragmas = wal_dao.get_pragmas()
+    assert wal_dao.profile == "balanced-wal"
+    assert pragmas["journal_mode"] == "wal"
+    assert pragmas["synchronous"] == 1
+    assert pragmas["cache_size"] == -16000
+    assert pragmas["temp_store"] == 2
+    assert pragmas["page_size"] == 8192
+
+
+def test_switch_profile(wal_dao):
+    wal_dao.create_table(TEST_TABLE_NAME, {"name": "text", "age": "integer"})
+    pragmas = wal_dao.set_profile("bulk-load")
+    assert pragmas["synchronous"] == 0
+    assert pragmas["cache_size"] == -262144
+    # page_size is fixed once the database has pages
+    assert pragmas["page_size"] == 8192
+    pragmas = wal_dao.set_profile("balanced-wal", cache_size=-4000)
+    assert pragmas["synchronous"] == 1
+    assert pragmas["cache_size"] == -4000
+    pragmas = wal_dao.set_profile(mmap_size=0)
+    assert wal_dao.profile == "balanced-wal"
+    assert pragmas["cache_size"] == -4000
+    assert pragmas["mmap_size"] == 0
+
+
+def test_profile_applies_to_readers(wal_dao):
+    wal_dao.set_profile("read-mostly")
+    with wal_dao.read_pool.connection() as conn:
+        assert conn.execute("PRAGMA cache_size").fetchone()[0] == -65536
+        assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2
+
+
+def test_leave_wal_with_open_readers(wal_dao):
+    wal_dao.create_table(TEST_TABLE_NAME, {"name": "text", "age": "integer"})
+    wal_dao.insert_row(TEST_TABLE_NAME, {"name": "LeBron James", "age": 35})
+    assert len(wal_dao.search_table(TEST_TABLE_NAME, {})) == 1
+    assert wal_dao.get_pool_stats()["idle"] == 1
+    pragmas = wal_dao.set_profile("durable")
+    assert pragmas["journal_mode"] == "delete"
+    assert wal_dao.profile == "durable"
+    assert len(wal_dao.search_table(TEST_TABLE_NAME, {})) == 1
+
+
+def test_failed_journal_mode_switch_keeps_profile(wal_dao):
+    wal_dao.create_table(TEST_TABLE_NAME, {"name": "text", "age": "integer"})
+    with wal_dao.read_pool.connection() as conn:
+        # A busy reader holding a read transaction open
+        conn.execute("BEGIN")
+        conn.execute("SELECT count(*) FROM {}".format(TEST_TABLE_NAME)).fetchone()
+        with pytest.raises(sqlite3.OperationalError, match="journal_mode"):
+            wal_dao.set_profile("durable")
+        conn.execute("COMMIT")
+    assert wal_dao.profile == "balanced-wal"
+    assert wal_dao.get_pragmas()["journal_mode"] == "wal"
+    assert wal_dao.set_profile("durable")["journal_mode"] == "delete"
+
+
+def test_invalid_profile_and_pragmas():
+    dao = SqliteDao(":memory:")
+    with pytest.raises(ValueError):
+        dao.set_profile("fastest")
+    with pytest.raises(ValueError):
+        dao.set_profile(locking_mode="EXCLUSIVE")
+    with pytest.raises(ValueError):
+        dao.set_profile(cache_size="1; DROP TABLE x")
+    with pytest.raises(ValueError):
+        with dao.transaction():
+            dao.set_profile("durable")
+    dao.close()
+
+
+def test_profile_on_memory_database():
+    dao = SqliteDao(":memory:", profile="durable")
+    assert dao.set_profile("balanced-wal")["journal_mode"] == "memory"
+    assert dao.profile == "balanced-wal"
+    dao.close()
@@ -0,0 +1,85 @@
+"""
+
+Test the search_table result cache
+
+"""
+
+from sqlitedao import SearchDict
+from .dao_test import prepopulated_dao
+from .dao_test import TEST_DB_NAME, TEST_TABLE_NAME
+import pytest
+import sqlite3
+
+
+def test_result_cache_hits(xdao):
+    assert xdao.get_result_cache_stats() is None
+    xdao.enable_result_cache()
+    old = SearchDict().add_filter("age", 40, ">")
+    first = xdao.search_table(TEST_TABLE_NAME, old, order_by=["age"])
+    first[0]["age"] = 0
+    second = xdao.search_table(TEST_TABLE_NAME, old, order_by=["age"])
+    assert [row["age"] for row in second] == [56, 41]
+    counts = xdao.search_table(TEST_TABLE_NAME, {}, group_by=["position"])
+    assert xdao.search_table(TEST_TABLE_NAME, {}, group_by=["position"]) == counts
+    # Same query with other values or formats is another entry
+    xdao.search_table(TEST_TABLE_NAME, SearchDict().add_filter("age", 50, ">"))
+    assert xdao.search_table(TEST_TABLE_NAME, old, row_format="tuple")[0][0]
+    stats = xdao.get_result_cache_stats()
+    assert stats["hits"] == 2
+    assert stats["misses"] == 4
+    assert stats["size"] == 4
+    assert stats["bytes"] > 0
+    xdao.disable_result_cache()
+    assert xdao.get_result_cache_stats() is None
+
+
+def test_result_cache_local_writes(xdao):
+    xdao.enable_result_cache()
+    assert len(xdao.search_table(TEST_TABLE_NAME, {})) == 3
+    xdao.insert_row(TEST_TABLE_NAME, {"name": "Zion Williamson", "age": 20})
+    assert len(xdao.search_table(TEST_TABLE_NAME, {})) == 4
+    xdao.update_rows(TEST_TABLE_NAME, {"age": 21}, {"name": "Zion Williamson"})
+    zion = xdao.search_table(TEST_TABLE_NAME, {"name": "Zion Williamson"})
+    assert zion[0]["age"] == 21
+    xdao.delete_rows(TEST_TABLE_NAME, {"name": "Zion Williamson"})
+    assert len(xdao.search_table(TEST_TABLE_NAME, {})) == 3
+    with xdao.transaction():
+        xdao.insert_rows(TEST_TABLE_NAME, [{"name": "Zion Williamson", "age": 20}])
+        assert len(xdao.search_table(TEST_TABLE_NAME, {})) == 4
+    assert len(xdao.search_table(TEST_TABLE_NAME, {})) == 4
+
+
+def test_result_cache_aggregates(xdao):
+    xdao.enable_result_cache()
+    assert xdao.count_rows(TEST_TABLE_NAME, {"position": "SG"}) == 2
+    assert xdao.count_rows(TEST_TABLE_NAME, {"position": "SG"}) == 2
+    assert xdao.get_result_cache_stats()["hits"] == 1
+    xdao.insert_row(TEST_TABLE_NAME, {"name": "Ray Allen", "position": "SG"})
+    assert xdao.count_rows(TEST_TABLE_NAME, {"position": "SG"}) == 3
+
+
+def test_result_cache_external_writes(xdao):
+    xdao.enable_result_cache()
+    assert len(xdao.search_table(TEST_TABLE_NAME, {})) == 3
+    other = sqlite3.connect(TEST_DB_NAME)
+    other.execute(
+        "INSERT INTO {} (name, age) VALUES ('Zion Williamson', 20)".format(
+            TEST_TABLE_NAME
+        )
+    )
+    other.commit()
+    other.close()
+    assert len(xdao.search_table(TEST_TABLE_NAME, {})) == 4
+
+
+def test_result_cache_byte_bound(xdao):
+    xdao.enable_result_cache(max_bytes=4096)
+    xdao.search_table(TEST_TABLE_NAME, {"name": "LeBron James"})
+    xdao.search_table(TEST_TABLE_NAME, {"name": "Kobe Bryant"})
+    stats = xdao.get_result_cache_stats()
+    assert 0 < stats["bytes"] <= 4096
+    xdao.enable_result_cache(max_bytes=1)
+    xdao.search_table(TEST_TABLE_NAME, {})
+    assert xdao.get_result_cache_stats()["size"] == 0
+    with pytest.raises(ValueError):
+        xdao.enable_result_cache(max_bytes=0)
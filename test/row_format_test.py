@@ -0,0 +1,105 @@
+"""
+
+Test lightweight row formats, with a small memory and time benchmark
+
+"""
+
+from sqlitedao import SqliteDao, ColumnDict, SearchDict
+from .dao_test import prepopulated_dao
+from .dao_test import TEST_TABLE_NAME, lebron
+from .item_test import PlayerX
+import pytest
+import sqlite3
+import time
+import tracemalloc
+
+BENCH_ROWS = 10000
+
+
+@pytest.fixture(name="wide_dao")
+def wide_table_dao():
+    dao = SqliteDao(":memory:")
+    columns = ColumnDict().add_column("id", "integer", primary_key=True)
+    for i in range(12):
+        columns.add_column("col{}".format(i), "integer")
+    dao.create_table("wide", columns)
+    dao.insert_rows(
+        "wide",
+        (
+            dict([("id", n)] + [("col{}".format(i), n * i) for i in range(12)])
+            for n in range(BENCH_ROWS)
+        ),
+    )
+    yield dao
+    dao.close()
+
+
+def test_row_formats(xdao):
+    search = {"name": "LeBron James"}
+    as_tuple = xdao.search_table(TEST_TABLE_NAME, search, row_format="tuple")[0]
+    assert as_tuple == tuple(lebron.values())
+    as_named = xdao.search_table(TEST_TABLE_NAME, search, row_format="namedtuple")[0]
+    assert as_named.age == 35
+    assert as_named._asdict() == lebron
+    as_row = xdao.search_table(TEST_TABLE_NAME, search, row_format="row")[0]
+    assert isinstance(as_row, sqlite3.Row)
+    assert as_row["height"] == "6-8.5"
+    with pytest.raises(ValueError):
+        xdao.search_table(TEST_TABLE_NAME, search, row_format="xml")
+
+
+def test_namedtuple_class_cached(xdao):
+    first = xdao.search_table(TEST_TABLE_NAME, {}, row_format="namedtuple")
+    second = xdao.iter_table(TEST_TABLE_NAME, {}, row_format="namedtuple")
+    assert type(first[0]) is type(next(second))
+    second.close()
+    counts = xdao.search_table(
+        TEST_TABLE_NAME, {}, group_by=["position"], row_format="namedtuple"
+    )
+    assert counts[0].count == 2
+
+
+def test_dao_default_row_format():
+    dao = SqliteDao(":memory:", row_format="tuple")
+    columns = {
+        "name": "text primary key",
+        "position": "text",
+        "age": "integer",
+        "height": "text",
+    }
+    dao.create_table(TEST_TABLE_NAME, columns)
+    dao.insert_row(TEST_TABLE_NAME, {"name": "Kobe Bryant", "age": 41})
+    assert dao.search_table(TEST_TABLE_NAME, {}) == [("Kobe Bryant", None, 41, None)]
+    # Items are still built from dict rows
+    assert dao.find_item(PlayerX(name="Kobe Bryant")).age == 41
+    with pytest.raises(ValueError):
+        SqliteDao(":memory:", row_format="xml")
+
+
+def test_get_items_from_raw_rows(xdao):
+    search = SearchDict().add_filter("age", 40, "<")
+    players = xdao.get_items(PlayerX, search, row_format="row")
+    assert players[0].name == "LeBron James"
+    with pytest.raises(ValueError):
+        xdao.get_items(PlayerX, search, row_format="tuple")
+
+
+def measure(dao, row_format):
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = dao.search_table("wide", {}, row_format=row_format)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(rows) == BENCH_ROWS
+    return peak, elapsed
+
+
+def test_row_format_benchmark(wide_dao):
+    results = {fmt: measure(wide_dao, fmt) for fmt in SqliteDao.ROW_FORMATS}
+    for fmt, (peak, elapsed) in results.items():
+        print("{:>10}: {:8.1f} KiB {:7.2f} ms".format(fmt, peak / 1024, elapsed * 1000))
+    # Tuples skip both the sqlite3.Row and the dict copy
+    assert results["tuple"][0] < results["dict"][0] * 0.75
+    assert results["namedtuple"][0] < results["dict"][0]
+    assert results["row"][0] < results["dict"][0]
@@ -0,0 +1,136 @@
+"""
+
+Test slot based table items
+
+"""
+
+from sqlitedao import SlottedTableItem, SearchDict
+from .dao_test import prepopulated_dao
+from .dao_test import TEST_TABLE_NAME
+from .item_test import PlayerX
+import pytest
+import tracemalloc
+
+
+class SlottedPlayer(SlottedTableItem):
+    TABLE_NAME = TEST_TABLE_NAME
+    INDEX_KEYS = ["name"]
+    ALL_COLUMNS = {"name": str, "position": str, "age": int, "height": str}
+
+    def grow(self):
+        self.age += 1
+
+
+def test_slotted_item_has_no_dict():
+    player = SlottedPlayer(name="Zion Williamson", age="20")
+    assert SlottedPlayer.__slots__ == ("name", "position", "age", "height")
+    assert not hasattr(player, "__dict__")
+    assert player.age == 20
+    assert player.position is None
+    with pytest.raises(AttributeError):
+        player.nickname = "Zanos"
+    with pytest.raises(ValueError):
+        SlottedPlayer(position="PF")
+
+
+def test_slotted_row_tuple_view():
+    player = SlottedPlayer(name="Zion Williamson", position="PF", age=20)
+    player.grow()
+    assert player.row_tuple["age"] == 21
+    player.row_tuple["age"] += 1
+    assert player.age == 22
+    assert dict(player.row_tuple) == player.get_row_tuple()
+    # get_row_tuple is the same live view
+    player.get_row_tuple()["age"] += 1
+    assert player.age == 23
+    assert repr(player).startswith("SlottedPlayer({'name': 'Zion Williamson'")
+    assert player.get_index_dict() == {"name": "Zion Williamson"}
+    with pytest.raises(KeyError):
+        player.row_tuple["nickname"] = "Zanos"
+
+
+def test_slotted_items_with_dao(xdao):
+    kobe = xdao.find_item(SlottedPlayer(name="Kobe Bryant"))
+    assert isinstance(kobe, SlottedPlayer)
+    assert kobe.height == "6-6"
+    kobe.grow()
+    xdao.update_item(kobe)
+    assert xdao.find_item(PlayerX(name="Kobe Bryant")).age == 42
+    xdao.insert_item(SlottedPlayer(name="Zion Williamson", age=20))
+    search = SearchDict().add_filter("age", 40, "<")
+    youth = xdao.get_items(SlottedPlayer, search, order_by=["age"])
+    assert [p.name for p in youth] == ["LeBron James", "Zion Williamson"]
+    assert youth[0] == xdao.find_item(PlayerX(name="LeBron James"))
+    streamed = list(xdao.iter_items(SlottedPlayer, search, order_by=["age"]))
+    assert streamed == youth
+    page = xdao.get_items_page(SlottedPlayer, SearchDict(), youth[0], limit=1)
+    assert page[0].name == "Kobe Bryant"
+
+
+def test_slotted_items_from_partial_columns(xdao):
+    query, values = xdao.compile_search(TEST_TABLE_NAME, {}, columns=["name", "age"])
+    players = xdao.fetch_query(
+        query,
+        values,
+        "tuple",
+        lambda cursor, rows: xdao.make_items(SlottedPlayer, cursor, rows, "tuple"),
+    )
+    assert len(players) == 3
+    assert all(p.height is None for p in players)
+
+
+def test_slotted_item_memory(xdao):
+    xdao.insert_rows(
+        TEST_TABLE_NAME,
+        (
+            {"name": "Player {}".format(i), "position": "SG", "age": i}
+            for i in range(5000)
+        ),
+    )
+    query, values = xdao.compile_search(TEST_TABLE_NAME, {})
+
+    def measure(build):
+        tracemalloc.start()
+        items = build()
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert len(items) == 5003
+        return size
+
+    def build_unmarked(cursor, rows):
+        if rows and isinstance(rows[0], tuple):
+            names = tuple(d[0] for d in cursor.description)
+            return [SlottedPlayer.from_row_values(names, row) for row in rows]
+        return [PlayerX(dict(row)) for row in rows]
+
+    # Items the dao loads are marked clean, which must not copy their rows
+    regular = measure(lambda: xdao.get_items(PlayerX, {}))
+    unmarked = measure(lambda: xdao.fetch_query(query, values, "dict", build_unmarked))
+    assert regular < unmarked * 1.05
+    slotted = measure(lambda: xdao.get_items(SlottedPlayer, {}))
+    unmarked = measure(lambda: xdao.fetch_query(query, values, "tuple", build_unmarked))
+    assert slotted < unmarked * 1.05
+    assert slotted < regular * 0.7
+
+
+def test_slotted_dirty_columns(xdao):
+    kobe = xdao.find_item(SlottedPlayer(name="Kobe Bryant"))
+    assert kobe.get_dirty_columns() == []
+    kobe.grow()
+    kobe.position = "SF"
+    assert kobe.get_dirty_columns() == ["position", "age"]
+    assert xdao.update_items([kobe]) == 1
+    assert kobe.get_dirty_columns() == []
+    assert xdao.find_item(SlottedPlayer(name="Kobe Bryant")).position == "SF"
+
+
+def test_slotted_dirty_index_column(xdao):
+    jordan = xdao.find_item(SlottedPlayer(name="Michael Jordan"))
+    jordan.name = "MJ"
+    jordan.name = "Air Jordan"
+    assert jordan.get_dirty_columns() == ["name"]
+    assert jordan.get_clean_index_dict() == {"name": "Michael Jordan"}
+    xdao.update_item(jordan)
+    assert xdao.find_item(SlottedPlayer(name="Michael Jordan")) is None
+    assert xdao.find_item(SlottedPlayer(name="Air Jordan")).age == 56
+    assert jordan.get_clean_index_dict() == {"name": "Air Jordan"}
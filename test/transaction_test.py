@@ -0,0 +1,90 @@
+"""
+
+Test explicit transactions and batched commits
+
+"""
+
+from .dao_test import prepopulated_dao
+from .dao_test import TEST_DB_NAME, TEST_TABLE_NAME
+from .item_test import Player
+import pytest
+import sqlite3
+import time
+
+
+def committed_count():
+    # A separate connection only sees committed rows
+    conn = sqlite3.connect(TEST_DB_NAME)
+    count = conn.execute(f"SELECT count(*) FROM {TEST_TABLE_NAME}").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_transaction_commits_once(xdao):
+    with xdao.transaction():
+        xdao.insert_item(Player(name="Zion Williamson", age=20))
+        xdao.insert_item(Player(name="James Harden", age=30))
+        assert xdao.get_row_count(TEST_TABLE_NAME) == 5
+        assert committed_count() == 3
+    assert committed_count() == 5
+
+
+def test_transaction_rollback(xdao):
+    with pytest.raises(RuntimeError):
+        with xdao.transaction():
+            xdao.insert_item(Player(name="Zion Williamson", age=20))
+            xdao.delete_rows(TEST_TABLE_NAME, {})
+            raise RuntimeError("abort")
+    assert xdao.get_row_count(TEST_TABLE_NAME) == 3
+    assert committed_count() == 3
+
+
+def test_nested_transaction_savepoint(xdao):
+    with xdao.transaction():
+        xdao.insert_item(Player(name="Zion Williamson", age=20))
+        with pytest.raises(RuntimeError):
+            with xdao.transaction():
+                xdao.insert_item(Player(name="James Harden", age=30))
+                raise RuntimeError("abort inner")
+        with xdao.transaction():
+            xdao.update_row(TEST_TABLE_NAME, {"age": 21}, {"name": "Zion Williamson"})
+    assert committed_count() == 4
+    assert xdao.find_item(Player(name="Zion Williamson")).age == 21
+    assert xdao.find_item(Player(name="James Harden")) is None
+
+
+def test_flush_refused_inside_transaction(xdao):
+    with pytest.raises(RuntimeError):
+        with xdao.transaction():
+            xdao.insert_item(Player(name="Zion Williamson", age=20))
+            with pytest.raises(ValueError):
+                xdao.flush()
+            with pytest.raises(ValueError):
+                xdao.set_batch_commit(every=10)
+            raise RuntimeError("abort")
+    assert committed_count() == 3
+    assert xdao.batch_every is None
+
+
+def test_batch_commit_every(xdao):
+    xdao.set_batch_commit(every=2)
+    xdao.insert_item(Player(name="Zion Williamson", age=20))
+    assert committed_count() == 3
+    xdao.insert_item(Player(name="James Harden", age=30))
+    assert committed_count() == 5
+    xdao.delete_item(Player(name="James Harden"))
+    assert committed_count() == 5
+    xdao.flush()
+    assert committed_count() == 4
+    xdao.set_batch_commit()
+
+
+def test_batch_commit_interval(xdao):
+    xdao.set_batch_commit(interval_ms=50)
+    xdao.insert_item(Player(name="Zion Williamson", age=20))
+    xdao.insert_item(Player(name="James Harden", age=30))
+    assert committed_count() == 3
+    # The timer commits the batch without waiting for another write
+    time.sleep(0.1)
+    assert committed_count() == 5
+    xdao.set_batch_commit()